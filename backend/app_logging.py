@@ -0,0 +1,213 @@
+"""
+Structured JSON access and audit logging that never blocks a request.
+
+Log calls only enqueue the LogRecord. A background writer thread per file
+drains its queue, formats records as JSON lines, writes each batch with a
+single write() and rotates the file at LOG_MAX_BYTES.
+
+Every worker process writes and rotates its own files, named with its pid
+(audit.<pid>.log), so workers never rename a file another one is
+appending to. Log shippers should collect audit.*.log and access.*.log.
+
+- clickearn.access -> LOG_DIR/access.<pid>.log. The queue is bounded; when
+  the writer falls behind, records are dropped and counted.
+- clickearn.audit  -> LOG_DIR/audit.<pid>.log. Money movement and logins.
+  The queue is unbounded, so audit events are never dropped; backpressure
+  costs memory instead of records. A failed write is retried
+  LOG_WRITE_RETRIES times, then the batch goes to stderr instead of being
+  discarded.
+"""
+
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_DIR = os.environ.get('LOG_DIR', '/tmp/clickearn-logs')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 50 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 10))
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 500))
+LOG_FLUSH_SECONDS = float(os.environ.get('LOG_FLUSH_SECONDS', 0.5))
+ACCESS_LOG_QUEUE_SIZE = int(os.environ.get('ACCESS_LOG_QUEUE_SIZE', 10000))
+LOG_WRITE_RETRIES = int(os.environ.get('LOG_WRITE_RETRIES', 5))
+
+access_logger = logging.getLogger("clickearn.access")
+audit_logger = logging.getLogger("clickearn.audit")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, event and fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class BatchingFileHandler(logging.Handler):
+    """Queue-backed handler whose writer thread batches writes and rotates
+
+    filename is a template: the process id goes before its extension.
+    With retries, a batch that cannot be written is retried with backoff
+    and finally written to stderr; without, it is dropped and counted.
+    """
+
+    def __init__(self, filename: str, maxsize: int = 0, retries: int = 0):
+        super().__init__()
+        self.filename = filename
+        self.maxsize = maxsize
+        self.retries = retries
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.setFormatter(JsonFormatter())
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        root, ext = os.path.splitext(self.filename)
+        return f"{root}.{os.getpid()}{ext}"
+
+    def emit(self, record: logging.LogRecord):
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid is not None:
+                    # Forked after the parent started writing: the writer thread did not survive
+                    self.queue = queue.Queue(maxsize=self.maxsize)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name=f"log-writer-{os.path.basename(self.filename)}", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # A None entry is a flush() marker and closes the batch early
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + LOG_FLUSH_SECONDS
+            while batch[-1] is not None and len(batch) < LOG_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            if records:
+                self._write_batch(records)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write_batch(self, records: list):
+        data = "".join(self.format(record) + "\n" for record in records)
+        for attempt in range(self.retries + 1):
+            try:
+                self._write(data)
+                return
+            except Exception:
+                if attempt < self.retries:
+                    time.sleep(0.1 * 2 ** attempt)
+        self.handleError(records[0])
+        if self.retries:
+            # Still unwritable: stderr is collected by the process manager, so nothing is lost
+            sys.stderr.write(data)
+            sys.stderr.flush()
+        else:
+            self.dropped += len(records)
+
+    def _write(self, data: str):
+        path = self.path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) + len(data) > LOG_MAX_BYTES:
+            self._rotate(path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+    def _rotate(self, path: str):
+        for index in range(LOG_BACKUP_COUNT - 1, 0, -1):
+            source = f"{path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{path}.{index + 1}")
+        if LOG_BACKUP_COUNT > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+    def flush(self):
+        """Block until everything queued so far is on disk"""
+        if self._thread is not None:
+            self.queue.put(None)
+            self.queue.join()
+
+
+access_handler = BatchingFileHandler(os.path.join(LOG_DIR, "access.log"), maxsize=ACCESS_LOG_QUEUE_SIZE)
+audit_handler = BatchingFileHandler(os.path.join(LOG_DIR, "audit.log"), retries=LOG_WRITE_RETRIES)
+
+for _logger, _handler in ((access_logger, access_handler), (audit_logger, audit_handler)):
+    _logger.addHandler(_handler)
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+
+
+def audit(event: str, **fields):
+    """Record a financial or authentication event"""
+    audit_logger.info(event, extra={"fields": fields})
+
+
+def flush():
+    access_handler.flush()
+    audit_handler.flush()
+
+
+class AccessLogMiddleware:
+    """ASGI middleware writing one structured access log line per request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            client = scope.get("client")
+            access_logger.info("request", extra={"fields": {
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route.path if route is not None else None,
+                "status": status,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "client_ip": client[0] if client else None,
+            }})
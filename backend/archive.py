@@ -0,0 +1,171 @@
+"""
+Cold archival of old ledger rows and withdrawals to Parquet.
+
+archive_collection() moves documents older than a cutoff out of Mongo, in
+batches of ARCHIVE_BATCH_SIZE. Each batch is appended to zstd-compressed
+Parquet files partitioned by month:
+
+    ARCHIVE_DIR/<collection>/month=YYYY-MM/part-<timestamp>-<id>.parquet
+
+A part file is fully written (temp file + rename) before its documents
+are deleted. A crash in between leaves rows in both places, and readers
+drop duplicates by _id. Rows are sorted by user_id, so per-user reads skip
+row groups using the Parquet statistics.
+
+ARCHIVE_DIR/<collection>/_watermark.json records the newest archived
+created_at. Readers only open partitions when the requested range starts
+at or before it; the history endpoints read the archive only when the
+request gives an explicit since.
+
+Pending withdrawals are never archived.
+
+Run with: python backend/archive.py [--older-than-days 90] [--batch-size 5000] [--dry-run]
+"""
+
+import argparse
+import glob
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', '/var/lib/clickearn/archive')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 5000))
+ARCHIVE_COMPRESSION = os.environ.get('ARCHIVE_COMPRESSION', 'zstd')
+
+# Extra conditions a document must meet to be archived, per collection
+ARCHIVE_FILTERS = {
+    "clicks": {},
+    "withdrawals": {"status": {"$ne": "pending"}},
+}
+
+
+def _collection_dir(name: str) -> str:
+    return os.path.join(ARCHIVE_DIR, name)
+
+
+def read_watermark(name: str):
+    """Newest created_at archived for a collection, or None when nothing is"""
+    try:
+        with open(os.path.join(_collection_dir(name), "_watermark.json")) as f:
+            return datetime.fromisoformat(json.load(f)["archived_through"])
+    except FileNotFoundError:
+        return None
+
+
+def _write_watermark(name: str, archived_through: datetime):
+    current = read_watermark(name)
+    if current and current >= archived_through:
+        return
+    path = os.path.join(_collection_dir(name), "_watermark.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({"archived_through": archived_through.isoformat()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def _write_partition(name: str, month: str, frame: pd.DataFrame):
+    directory = os.path.join(_collection_dir(name), f"month={month}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.parquet")
+    frame.sort_values(["user_id", "created_at"]).to_parquet(
+        path + ".tmp", engine="pyarrow", compression=ARCHIVE_COMPRESSION, index=False, row_group_size=10000
+    )
+    os.replace(path + ".tmp", path)
+
+
+def archive_collection(collection, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE,
+                       dry_run: bool = False) -> int:
+    """Move documents created before cutoff to Parquet, returning how many moved"""
+    query = {"created_at": {"$lt": cutoff}, **ARCHIVE_FILTERS.get(collection.name, {})}
+    if dry_run:
+        return collection.count_documents(query)
+
+    moved = 0
+    while True:
+        docs = list(collection.find(query).sort("created_at", 1).limit(batch_size))
+        if not docs:
+            return moved
+        frame = pd.DataFrame(docs)
+        frame["_id"] = frame["_id"].astype(str)
+        for month, rows in frame.groupby(frame["created_at"].dt.strftime("%Y-%m")):
+            _write_partition(collection.name, month, rows)
+        _write_watermark(collection.name, max(doc["created_at"] for doc in docs))
+        collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        moved += len(docs)
+
+
+def _to_document(row: dict) -> dict:
+    doc = {}
+    for key, value in row.items():
+        if key == "_id":
+            continue
+        if isinstance(value, pd.Timestamp):
+            value = value.to_pydatetime()
+        elif value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+            # Columns the original document did not have
+            continue
+        doc[key] = value
+    return doc
+
+
+def read_archived(name: str, user_id: str, since: datetime = None, until: datetime = None) -> list:
+    """Archived documents for one user within [since, until), oldest first"""
+    watermark = read_watermark(name)
+    if watermark is None or (since and since > watermark):
+        return []
+
+    frames = []
+    for directory in sorted(glob.glob(os.path.join(_collection_dir(name), "month=*"))):
+        month = datetime.strptime(os.path.basename(directory)[len("month="):], "%Y-%m")
+        month_end = (month + timedelta(days=32)).replace(day=1)
+        if (since and month_end <= since) or (until and month >= until):
+            continue
+        for path in sorted(glob.glob(os.path.join(directory, "*.parquet"))):
+            frames.append(pd.read_parquet(path, engine="pyarrow", filters=[("user_id", "==", user_id)]))
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return []
+
+    rows = pd.concat(frames, ignore_index=True).drop_duplicates("_id")
+    if since:
+        rows = rows[rows["created_at"] >= since]
+    if until:
+        rows = rows[rows["created_at"] < until]
+    rows = rows.sort_values("created_at")
+    return [_to_document(row) for row in rows.to_dict("records")]
+
+
+def archived_totals(name: str) -> dict:
+    """Per-user amount sums and row counts over every archived partition"""
+    paths = glob.glob(os.path.join(_collection_dir(name), "month=*", "*.parquet"))
+    if not paths:
+        return {}
+    rows = pd.concat(
+        [pd.read_parquet(path, engine="pyarrow", columns=["_id", "user_id", "amount"]) for path in paths],
+        ignore_index=True
+    ).drop_duplicates("_id")
+    totals = rows.groupby("user_id")["amount"].agg(["sum", "count"])
+    return {user_id: (float(row["sum"]), int(row["count"])) for user_id, row in totals.iterrows()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old ClickEarn Pro ledger rows and withdrawals to Parquet")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be archived")
+    args = parser.parse_args()
+
+    import server
+    server.connect_database()
+    cutoff = datetime.now() - timedelta(days=args.older_than_days)
+    for collection in (server.clicks_collection, server.withdrawals_collection):
+        moved = archive_collection(collection, cutoff, args.batch_size, args.dry_run)
+        verb = "would archive" if args.dry_run else "archived"
+        print(f"{collection.name}: {verb} {moved} documents older than {cutoff:%Y-%m-%d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Bulk admin operations over users and balances.
+
+An operation applies one change to every user in a list of user IDs or
+matching a filter:
+
+- deactivate: is_active = False. Authentication rejects inactive users,
+  so their sessions stop working at once.
+- credit: adds amount to balance and total_earned. Each user also gets a
+  ledger adjustment row (clicks collection, idempotency_key
+  "bulk:<operation_id>"), so reconciliation accounts for the credit.
+- reset_limits: clicks_today and videos_today go back to 0.
+
+Operations are recorded in bulk_operations. Users are processed in
+user_id order, BULK_CHUNK_SIZE at a time. Each chunk is three unordered
+bulk writes:
+
+1. Ledger rows, for credits. Rows a previous attempt already wrote fail
+   the unique idempotency key and are skipped.
+2. User updates. The filter skips users whose bulk_operations list already
+   holds this operation.
+3. The operation's checkpoint: last_user_id and progress counters.
+
+Every step is idempotent. An interrupted operation resumes after its
+checkpoint, and replaying the chunk in flight changes nothing twice.
+
+Run with:
+    python backend/bulk_ops.py credit --amount 1.5 --reason "Promo" --user-ids ids.txt
+    python backend/bulk_ops.py deactivate --filter '{"phone": {"$in": ["+5511..."]}}'
+    python backend/bulk_ops.py --resume <operation_id>
+"""
+
+import argparse
+import json
+import os
+import uuid
+from datetime import datetime
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import app_logging
+import db_routing
+
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+# Operation ids kept on each user to make replays no-ops
+BULK_HISTORY_SIZE = 20
+MAX_BULK_CREDIT = float(os.environ.get('MAX_BULK_CREDIT', 100.0))
+
+KINDS = ("deactivate", "credit", "reset_limits")
+
+# User fields and operators a filter may use
+FILTER_FIELDS = {
+    "user_id", "email", "phone", "tier", "is_active", "auth_method",
+    "phone_verified", "email_verified", "balance", "total_earned"
+}
+FILTER_OPERATORS = {"$eq", "$ne", "$in", "$nin", "$gt", "$gte", "$lt", "$lte", "$exists"}
+
+
+def _validate_filter(query: dict):
+    if not isinstance(query, dict) or not query:
+        raise ValueError("filter must be a non-empty object")
+    for field, condition in query.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"filter field {field!r} is not allowed")
+        if isinstance(condition, dict):
+            unknown = set(condition) - FILTER_OPERATORS
+            if unknown:
+                raise ValueError(f"filter operators {sorted(unknown)} are not allowed")
+
+
+def create_operation(db, kind: str, user_ids: list = None, filter: dict = None, amount: float = None,
+                     reason: str = "", created_by: str = "cli") -> dict:
+    """Validate and record a new operation; run it with run_operation()"""
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    if (user_ids is None) == (filter is None):
+        raise ValueError("give either user_ids or filter")
+    if user_ids is not None:
+        if not user_ids:
+            raise ValueError("user_ids is empty")
+        query = {"user_id": {"$in": sorted(set(user_ids))}}
+    else:
+        _validate_filter(filter)
+        query = filter
+    if kind == "credit":
+        if amount is None or not 0 < amount <= MAX_BULK_CREDIT:
+            raise ValueError(f"amount must be between 0 and {MAX_BULK_CREDIT:.2f}")
+        if not reason:
+            raise ValueError("credits need a reason")
+        amount = round(amount, 2)
+    else:
+        amount = None
+
+    now = datetime.now()
+    operation = {
+        "operation_id": str(uuid.uuid4()),
+        "kind": kind,
+        # Stored as JSON: operator keys like $in are not valid field names everywhere
+        "query": json.dumps(query, sort_keys=True),
+        "amount": amount,
+        "reason": reason,
+        "created_by": created_by,
+        "status": "running",
+        "total": db_routing.routed(db, "users").count_documents(query),
+        "processed": 0,
+        "modified": 0,
+        "ledger_rows": 0,
+        "last_user_id": None,
+        "created_at": now,
+        "updated_at": now
+    }
+    db_routing.routed(db, "bulk_operations").insert_one(dict(operation))
+    app_logging.audit(
+        "admin.bulk_started", operation_id=operation["operation_id"], kind=kind, total=operation["total"],
+        amount=amount, reason=reason, created_by=created_by
+    )
+    return operation
+
+
+def get_operation(db, operation_id: str):
+    return db_routing.routed(db, "bulk_operations").find_one({"operation_id": operation_id}, {"_id": 0})
+
+
+def progress(operation: dict) -> dict:
+    return {
+        field: operation[field]
+        for field in ("operation_id", "kind", "status", "total", "processed", "modified", "ledger_rows",
+                      "last_user_id")
+    }
+
+
+def _user_update(operation: dict) -> dict:
+    update = {
+        "$inc": {"dashboard_version": 1},
+        "$push": {"bulk_operations": {"$each": [operation["operation_id"]], "$slice": -BULK_HISTORY_SIZE}}
+    }
+    if operation["kind"] == "deactivate":
+        update["$set"] = {"is_active": False}
+    elif operation["kind"] == "credit":
+        update["$inc"].update({"balance": operation["amount"], "total_earned": operation["amount"]})
+    else:
+        update["$set"] = {"clicks_today": 0, "videos_today": 0}
+    return update
+
+
+def _write_ledger_rows(clicks, operation: dict, user_ids: list, now: datetime):
+    rows = [
+        InsertOne({
+            "adjustment_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "amount": operation["amount"],
+            "reason": operation["reason"],
+            "operation_id": operation["operation_id"],
+            "idempotency_key": f"bulk:{operation['operation_id']}",
+            "created_at": now
+        })
+        for user_id in user_ids
+    ]
+    try:
+        clicks.bulk_write(rows, ordered=False)
+    except BulkWriteError as e:
+        # Rows an interrupted attempt already wrote
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+
+def _apply_chunk(db, operation: dict, user_ids: list) -> dict:
+    now = datetime.now()
+    ledger_rows = 0
+    if operation["kind"] == "credit":
+        _write_ledger_rows(db_routing.routed(db, "clicks"), operation, user_ids, now)
+        # Every user in the chunk now has exactly one row, whichever attempt wrote it
+        ledger_rows = len(user_ids)
+
+    update = _user_update(operation)
+    result = db_routing.routed(db, "users").bulk_write([
+        UpdateOne({"user_id": user_id, "bulk_operations": {"$ne": operation["operation_id"]}}, update)
+        for user_id in user_ids
+    ], ordered=False)
+
+    app_logging.audit(
+        "admin.bulk_chunk", operation_id=operation["operation_id"], kind=operation["kind"],
+        amount=operation["amount"], user_ids=user_ids, modified=result.modified_count
+    )
+    return {"modified": result.modified_count, "ledger_rows": ledger_rows}
+
+
+def run_operation(db, operation_id: str, chunk_size: int = None):
+    """Apply (or resume) an operation, yielding its progress after every chunk"""
+    chunk_size = chunk_size or BULK_CHUNK_SIZE
+    operations = db_routing.routed(db, "bulk_operations")
+    users = db_routing.routed(db, "users")
+    operation = get_operation(db, operation_id)
+    if operation is None:
+        raise KeyError(operation_id)
+    if operation["status"] != "running":
+        yield progress(operation)
+        return
+
+    while operation["status"] == "running":
+        query = json.loads(operation["query"])
+        if operation["last_user_id"] is not None:
+            query = {"$and": [query, {"user_id": {"$gt": operation["last_user_id"]}}]}
+        user_ids = [
+            user["user_id"]
+            for user in users.find(query, {"_id": 0, "user_id": 1}).sort("user_id", 1).limit(chunk_size)
+        ]
+
+        checkpoint = {"$set": {"updated_at": datetime.now()}}
+        if user_ids:
+            counts = _apply_chunk(db, operation, user_ids)
+            checkpoint["$set"]["last_user_id"] = user_ids[-1]
+            checkpoint["$inc"] = {"processed": len(user_ids), **counts}
+        if len(user_ids) < chunk_size:
+            checkpoint["$set"].update({"status": "complete", "finished_at": datetime.now()})
+        operations.update_one({"operation_id": operation_id}, checkpoint)
+        operation = get_operation(db, operation_id)
+        yield progress(operation)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk admin operations over ClickEarn Pro users")
+    parser.add_argument("kind", nargs="?", choices=KINDS)
+    parser.add_argument("--user-ids", help="file with one user_id per line")
+    parser.add_argument("--filter", help="JSON filter over user fields")
+    parser.add_argument("--amount", type=float, help="credit per user")
+    parser.add_argument("--reason", default="", help="reason recorded on ledger rows")
+    parser.add_argument("--resume", metavar="OPERATION_ID", help="continue an interrupted operation")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    import server
+    server.connect_database()
+    server.ensure_indexes()
+
+    if args.resume:
+        operation_id = args.resume
+    else:
+        if not args.kind:
+            parser.error("kind is required unless --resume is given")
+        user_ids = None
+        if args.user_ids:
+            with open(args.user_ids) as f:
+                user_ids = [line.strip() for line in f if line.strip()]
+        try:
+            operation = create_operation(
+                server.db, args.kind, user_ids, json.loads(args.filter) if args.filter else None,
+                args.amount, args.reason
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        operation_id = operation["operation_id"]
+        print(f"Operation {operation_id}: {args.kind} for {operation['total']} users")
+
+    final = None
+    for final in run_operation(server.db, operation_id, args.chunk_size):
+        print(f"  {final['processed']}/{final['total']} processed, {final['modified']} modified, "
+              f"{final['ledger_rows']} ledger rows", flush=True)
+    app_logging.flush()
+    return final is not None and final["status"] == "complete"
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
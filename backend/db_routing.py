@@ -0,0 +1,78 @@
+"""
+Read preference and write concern per class of operation.
+
+Each collection handle in backend/server.py is bound to one route:
+
+- "ledger": users (balances), ledger rows, withdrawals, idempotency
+  records, revocations, reconciliation state, bulk admin operations and
+  migration markers.
+  Writes wait for a journaled majority, so an acknowledged credit or
+  withdrawal survives a primary failover. Reads go to the primary.
+- "ephemeral": sessions and verification codes. Writes are w:1. Losing one
+  in a failover only means logging in or requesting a code again.
+- "history": read-only views of ledger rows and withdrawals for history
+  exports and recent activity. Reads go to a secondary at most
+  READ_MAX_STALENESS_SECONDS behind the primary. When no secondary
+  qualifies, they fall back to the primary.
+
+Set SECONDARY_READS=false to keep history reads on the primary. Against a
+standalone mongod (or memory://) every route resolves to the primary, and
+"majority" means that one node.
+"""
+
+import os
+
+from pymongo import ReadPreference
+from pymongo.read_preferences import SecondaryPreferred
+from pymongo.write_concern import WriteConcern
+
+# MongoDB rejects maxStalenessSeconds below 90
+READ_MAX_STALENESS_SECONDS = max(90, int(os.environ.get('READ_MAX_STALENESS_SECONDS', 90)))
+SECONDARY_READS = os.environ.get('SECONDARY_READS', 'true').lower() in ('1', 'true', 'yes')
+MAJORITY_WRITE_TIMEOUT_MS = int(os.environ.get('MAJORITY_WRITE_TIMEOUT_MS', 5000))
+
+
+def _routes() -> dict:
+    history_reads = (
+        SecondaryPreferred(max_staleness=READ_MAX_STALENESS_SECONDS) if SECONDARY_READS else ReadPreference.PRIMARY
+    )
+    return {
+        "ledger": {
+            "read_preference": ReadPreference.PRIMARY,
+            "write_concern": WriteConcern(w="majority", j=True, wtimeout=MAJORITY_WRITE_TIMEOUT_MS)
+        },
+        "ephemeral": {
+            "read_preference": ReadPreference.PRIMARY,
+            "write_concern": WriteConcern(w=1)
+        },
+        "history": {
+            "read_preference": history_reads
+        }
+    }
+
+
+ROUTES = _routes()
+
+# Route of every collection the API writes; history handles are derived separately
+COLLECTION_ROUTES = {
+    "users": "ledger",
+    "clicks": "ledger",
+    "withdrawals": "ledger",
+    "idempotency_keys": "ledger",
+    "session_revocations": "ledger",
+    "ledger_checkpoints": "ledger",
+    "reconciliation_runs": "ledger",
+    "bulk_operations": "ledger",
+    "migrations": "ledger",
+    "sessions": "ephemeral",
+    "verification_codes": "ephemeral",
+}
+
+
+def route(collection, name: str):
+    """collection with the read preference and write concern of route name"""
+    return collection.with_options(**ROUTES[name])
+
+
+def routed(database, collection_name: str):
+    return route(database[collection_name], COLLECTION_ROUTES[collection_name])
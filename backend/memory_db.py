@@ -0,0 +1,735 @@
+"""
+In-memory stand-in for the subset of pymongo that server.py uses.
+
+Selected with MONGO_URL=memory:// or injected with
+server.configure_database(InMemoryClient()["name"]). The whole API can
+then run in-process with no mongod, e.g. for the hermetic test suite.
+
+Supported:
+- find / find_one, with inclusion, exclusion and $elemMatch projections
+- sort, skip and limit cursors
+- count_documents
+- aggregate with $match, $group ($sum, $min, $max, $first, $last),
+  $sort and $limit
+- insert_one / insert_many / bulk_write
+- update_one / update_many / find_one_and_update, with upsert
+- delete_one / delete_many
+- unique and partial unique indexes
+- with_options, which records the read preference and write concern on
+  a view of the same collection (one node: both have no other effect)
+
+Query operators: equality on dotted paths through arrays, $in, $nin, $ne,
+$gt, $gte, $lt, $lte, $exists, $elemMatch, $or, $and.
+
+Update operators: $set, $unset, $inc, $setOnInsert, $push with
+$each/$slice, and $pull.
+
+Commands are reported to pymongo CommandListeners like a real client, so
+metrics, query budgets and tracing work unchanged. TTL indexes are
+accepted but documents are not expired.
+"""
+
+import copy
+import itertools
+import threading
+import time
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReadPreference, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.write_concern import WriteConcern
+
+_MISSING = object()
+_request_ids = itertools.count(1)
+
+
+class _CommandEvent:
+    """Duck-typed pymongo monitoring event"""
+
+    def __init__(self, database_name: str, command_name: str, command: dict, request_id: int):
+        self.database_name = database_name
+        self.command_name = command_name
+        self.command = command
+        self.request_id = request_id
+        self.operation_id = request_id
+        self.connection_id = ("memory", 0)
+        self.duration_micros = 0
+        self.reply = {"ok": 1}
+        self.failure = {}
+
+
+class _Result:
+    """Attribute bag matching pymongo's *Result objects"""
+
+    def __init__(self, **fields):
+        self.acknowledged = True
+        self.__dict__.update(fields)
+
+
+# Query matching
+
+def _resolve(value, parts: list) -> list:
+    """Values found at a dotted path, descending through arrays like MongoDB"""
+    if not parts:
+        return [value]
+    if isinstance(value, dict):
+        if parts[0] not in value:
+            return []
+        return _resolve(value[parts[0]], parts[1:])
+    if isinstance(value, list):
+        if parts[0].isdigit():
+            index = int(parts[0])
+            return _resolve(value[index], parts[1:]) if index < len(value) else []
+        found = []
+        for item in value:
+            found.extend(_resolve(item, parts))
+        return found
+    return []
+
+
+def _candidates(doc: dict, path: str) -> list:
+    """Resolved values, with array values also contributing their elements"""
+    values = _resolve(doc, path.split("."))
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+
+def _compare(left, right, op) -> bool:
+    if left is None or right is None:
+        return False
+    try:
+        return op(left, right)
+    except TypeError:
+        return False
+
+
+_COMPARISONS = {
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b,
+}
+
+
+def _equals_any(values: list, target) -> bool:
+    if target is None and not values:
+        return True
+    return any(value == target for value in values)
+
+
+def _match_condition(doc: dict, path: str, condition) -> bool:
+    values = _candidates(doc, path)
+    if not (isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)):
+        return _equals_any(values, condition)
+
+    for op, argument in condition.items():
+        if op == "$in":
+            if not any(_equals_any(values, target) for target in argument):
+                return False
+        elif op == "$nin":
+            if any(_equals_any(values, target) for target in argument):
+                return False
+        elif op == "$ne":
+            if _equals_any(values, argument):
+                return False
+        elif op == "$exists":
+            if bool(_resolve(doc, path.split("."))) != bool(argument):
+                return False
+        elif op in _COMPARISONS:
+            if not any(_compare(value, argument, _COMPARISONS[op]) for value in values):
+                return False
+        elif op == "$elemMatch":
+            arrays = [value for value in _resolve(doc, path.split(".")) if isinstance(value, list)]
+            if not any(_match_element(item, argument) for array in arrays for item in array):
+                return False
+        else:
+            raise OperationFailure(f"unsupported query operator {op}")
+    return True
+
+
+def _match_element(item, condition: dict) -> bool:
+    if isinstance(item, dict) and not all(key.startswith("$") for key in condition):
+        return matches(item, condition)
+    return _match_condition({"value": item}, "value", condition)
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+        elif not _match_condition(doc, key, condition):
+            return False
+    return True
+
+
+# Updates
+
+def _set_path(doc: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _get_path(doc: dict, path: str, default=_MISSING):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return default
+        doc = doc[part]
+    return doc
+
+
+def _unset_path(doc: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def apply_update(doc: dict, update: dict, inserting: bool = False):
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                continue
+            elif op == "$unset":
+                _unset_path(doc, path)
+            elif op == "$inc":
+                _set_path(doc, path, _get_path(doc, path, 0) + value)
+            elif op == "$push":
+                array = list(_get_path(doc, path, []))
+                if isinstance(value, dict) and "$each" in value:
+                    array.extend(copy.deepcopy(value["$each"]))
+                    if "$slice" in value:
+                        limit = value["$slice"]
+                        array = array[limit:] if limit < 0 else array[:limit]
+                else:
+                    array.append(copy.deepcopy(value))
+                _set_path(doc, path, array)
+            elif op == "$pull":
+                array = _get_path(doc, path, [])
+                if isinstance(value, dict):
+                    kept = [item for item in array if not _match_element(item, value)]
+                else:
+                    kept = [item for item in array if item != value]
+                _set_path(doc, path, kept)
+            else:
+                raise OperationFailure(f"unsupported update operator {op}")
+
+
+# Projection and sorting
+
+def project(doc: dict, projection) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    include_id = projection.get("_id", 1)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    inclusive = any(value == 1 or value is True or isinstance(value, dict) for value in fields.values())
+
+    if inclusive:
+        result = {}
+        for path, spec in fields.items():
+            if isinstance(spec, dict) and "$elemMatch" in spec:
+                array = doc.get(path)
+                if isinstance(array, list):
+                    for item in array:
+                        if _match_element(item, spec["$elemMatch"]):
+                            result[path] = [copy.deepcopy(item)]
+                            break
+                continue
+            value = _get_path(doc, path)
+            if value is not _MISSING:
+                _set_path(result, path, copy.deepcopy(value))
+    else:
+        result = copy.deepcopy(doc)
+        for path in fields:
+            _unset_path(result, path)
+    if include_id and "_id" in doc:
+        result["_id"] = doc["_id"]
+    elif not include_id:
+        result.pop("_id", None)
+    return result
+
+
+class _SortKey:
+    """Orders None/missing before any value and values of differing types by type name"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        a, b = self.value, other.value
+        if a is None or b is None:
+            return a is None and b is not None
+        try:
+            return a < b
+        except TypeError:
+            return type(a).__name__ < type(b).__name__
+
+
+def _normalize_sort(key_or_list, direction=None) -> list:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    return list(key_or_list)
+
+
+def sort_documents(docs: list, spec: list) -> list:
+    for path, direction in reversed(spec):
+        docs.sort(key=lambda doc: _SortKey(_get_path(doc, path, None)), reverse=direction < 0)
+    return docs
+
+
+def _expression(doc: dict, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get_path(doc, expression[1:], None)
+    return expression
+
+
+def _group(docs: list, spec: dict) -> list:
+    groups = {}
+    for doc in docs:
+        key = _expression(doc, spec["_id"])
+        group = groups.setdefault(repr(key), {"_id": key})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, expression), = accumulator.items()
+            value = _expression(doc, expression)
+            if op == "$sum":
+                group[field] = group.get(field, 0) + (value if isinstance(value, (int, float)) else 0)
+            elif op in ("$min", "$max"):
+                current = group.get(field)
+                if value is not None and (current is None or (value < current if op == "$min" else value > current)):
+                    group[field] = value
+                else:
+                    group.setdefault(field, None)
+            elif op == "$first":
+                group.setdefault(field, value)
+            elif op == "$last":
+                group[field] = value
+            else:
+                raise OperationFailure(f"unsupported accumulator {op}")
+    return list(groups.values())
+
+
+class InMemoryCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _evaluate(self) -> list:
+        if self._results is None:
+            command = {"filter": self._query}
+            if self._sort:
+                command["sort"] = dict(self._sort)
+            if self._projection:
+                command["projection"] = self._projection
+            if self._limit:
+                command["limit"] = self._limit
+            # Writers mutate documents in place; match, sort and copy under the lock
+            with self._collection.database.lock, self._collection._command("find", command):
+                docs = self._collection._matching(self._query)
+                if self._sort:
+                    docs = sort_documents(docs, self._sort)
+                docs = docs[self._skip:]
+                if self._limit:
+                    docs = docs[:self._limit]
+                self._results = [project(doc, self._projection) for doc in docs]
+        return self._results
+
+    def __iter__(self):
+        return iter(self._evaluate())
+
+    def to_list(self, length=None):
+        return list(self._evaluate())
+
+
+class InMemoryCollection:
+    read_preference = ReadPreference.PRIMARY
+    write_concern = WriteConcern()
+
+    def __init__(self, database, name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._docs = []
+        self._indexes = {"_id_": {"keys": [("_id", 1)], "unique": True, "partial": None}}
+
+    # Plumbing
+
+    def _command(self, command_name: str, fields: dict):
+        return self.database.client._monitor(self.database.name, command_name, {command_name: self.name, **fields})
+
+    def _matching(self, query: dict) -> list:
+        return [doc for doc in self._docs if matches(doc, query)]
+
+    def _index_key(self, doc: dict, keys: list):
+        return tuple(repr(_get_path(doc, path, None)) for path, _ in keys)
+
+    def _check_unique(self, doc: dict, ignore=None):
+        for name, index in self._indexes.items():
+            if not index["unique"]:
+                continue
+            if index["partial"] and not matches(doc, index["partial"]):
+                continue
+            key = self._index_key(doc, index["keys"])
+            for other in self._docs:
+                if other is doc or other is ignore:
+                    continue
+                if index["partial"] and not matches(other, index["partial"]):
+                    continue
+                if self._index_key(other, index["keys"]) == key:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.full_name} index: {name}",
+                        code=11000
+                    )
+
+    def _insert(self, doc: dict) -> ObjectId:
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        stored = copy.deepcopy(doc)
+        self._check_unique(stored)
+        self._docs.append(stored)
+        return doc["_id"]
+
+    def _update(self, query: dict, update: dict, upsert: bool, multi: bool) -> _Result:
+        targets = self._matching(query)
+        if not multi:
+            targets = targets[:1]
+        modified = 0
+        for doc in targets:
+            updated = copy.deepcopy(doc)
+            apply_update(updated, update)
+            if updated != doc:
+                self._check_unique(updated, ignore=doc)
+                doc.clear()
+                doc.update(updated)
+                modified += 1
+        upserted_id = None
+        if not targets and upsert:
+            doc = {
+                key: copy.deepcopy(value) for key, value in query.items()
+                if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))
+            }
+            apply_update(doc, update, inserting=True)
+            upserted_id = self._insert(doc)
+        return _Result(
+            matched_count=len(targets), modified_count=modified, upserted_id=upserted_id,
+            raw_result={"n": len(targets) or int(upserted_id is not None), "nModified": modified}
+        )
+
+    # Indexes
+
+    def create_index(self, keys, unique: bool = False, partialFilterExpression=None, name=None, **kwargs) -> str:
+        keys = _normalize_sort(keys)
+        name = name or "_".join(f"{path}_{direction}" for path, direction in keys)
+        with self.database.lock:
+            index = {"keys": keys, "unique": unique, "partial": partialFilterExpression}
+            if unique:
+                for doc in self._docs:
+                    self._check_unique_against(doc, index, name)
+            self._indexes[name] = index
+        return name
+
+    def _check_unique_against(self, doc, index, name):
+        if index["partial"] and not matches(doc, index["partial"]):
+            return
+        key = self._index_key(doc, index["keys"])
+        for other in self._docs:
+            if other is not doc and (not index["partial"] or matches(other, index["partial"])):
+                if self._index_key(other, index["keys"]) == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error index: {name}", code=11000)
+
+    def index_information(self) -> dict:
+        return {name: {"key": index["keys"], "unique": index["unique"]} for name, index in self._indexes.items()}
+
+    def drop_indexes(self):
+        self._indexes = {"_id_": self._indexes["_id_"]}
+
+    def drop(self):
+        self.database.drop_collection(self.name)
+
+    def with_options(self, read_preference=None, write_concern=None, **kwargs) -> "InMemoryCollectionView":
+        return InMemoryCollectionView(self, read_preference or self.read_preference, write_concern or self.write_concern)
+
+    # Reads
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, skip=0, **kwargs) -> InMemoryCursor:
+        cursor = InMemoryCursor(self, filter or {}, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        with self.database.lock:
+            for doc in self.find(filter, projection, sort=sort, limit=1):
+                return doc
+        return None
+
+    def count_documents(self, filter: dict, **kwargs) -> int:
+        with self.database.lock, self._command("count", {"query": filter}):
+            return len(self._matching(filter))
+
+    def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    def aggregate(self, pipeline: list, **kwargs) -> list:
+        with self.database.lock, self._command("aggregate", {"pipeline": pipeline}):
+            docs = [copy.deepcopy(doc) for doc in self._docs]
+            for stage in pipeline:
+                (name, spec), = stage.items()
+                if name == "$match":
+                    docs = [doc for doc in docs if matches(doc, spec)]
+                elif name == "$group":
+                    docs = _group(docs, spec)
+                elif name == "$sort":
+                    docs = sort_documents(docs, list(spec.items()))
+                elif name == "$limit":
+                    docs = docs[:spec]
+                else:
+                    raise OperationFailure(f"unsupported aggregation stage {name}")
+            return iter(docs)
+
+    def distinct(self, key: str, filter=None, **kwargs) -> list:
+        with self.database.lock, self._command("distinct", {"key": key, "query": filter or {}}):
+            values = []
+            for doc in self._matching(filter or {}):
+                for value in _candidates(doc, key):
+                    if not isinstance(value, list) and value not in values:
+                        values.append(value)
+            return values
+
+    # Writes
+
+    def insert_one(self, document: dict, **kwargs) -> _Result:
+        with self.database.lock, self._command("insert", {"documents": [document]}):
+            return _Result(inserted_id=self._insert(document))
+
+    def insert_many(self, documents, ordered: bool = True, **kwargs) -> _Result:
+        documents = list(documents)
+        result = self.bulk_write([InsertOne(document) for document in documents], ordered=ordered)
+        return _Result(inserted_ids=[document["_id"] for document in documents if "_id" in document],
+                       raw_result=result.bulk_api_result)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> _Result:
+        with self.database.lock, self._command("update", {"updates": [{"q": filter, "u": update}]}):
+            return self._update(filter, update, upsert, multi=False)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> _Result:
+        with self.database.lock, self._command("update", {"updates": [{"q": filter, "u": update, "multi": True}]}):
+            return self._update(filter, update, upsert, multi=True)
+
+    def delete_one(self, filter: dict, **kwargs) -> _Result:
+        return self._delete(filter, multi=False)
+
+    def delete_many(self, filter: dict, **kwargs) -> _Result:
+        return self._delete(filter, multi=True)
+
+    def _delete(self, filter: dict, multi: bool) -> _Result:
+        with self.database.lock, self._command("delete", {"deletes": [{"q": filter, "limit": 0 if multi else 1}]}):
+            targets = self._matching(filter)
+            if not multi:
+                targets = targets[:1]
+            ids = {id(doc) for doc in targets}
+            self._docs = [doc for doc in self._docs if id(doc) not in ids]
+            return _Result(deleted_count=len(targets))
+
+    def find_one_and_update(self, filter: dict, update: dict, projection=None, sort=None, upsert: bool = False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        with self.database.lock, self._command("findAndModify", {"query": filter, "update": update}):
+            docs = self._matching(filter)
+            if sort:
+                docs = sort_documents(docs, _normalize_sort(sort))
+            if not docs:
+                if not upsert:
+                    return None
+                result = self._update(filter, update, upsert=True, multi=False)
+                if return_document != ReturnDocument.AFTER:
+                    return None
+                return project(next(d for d in self._docs if d["_id"] == result.upserted_id), projection)
+            doc = docs[0]
+            before = project(doc, projection)
+            self._update({"_id": doc["_id"]}, update, upsert=False, multi=False)
+            return project(doc, projection) if return_document == ReturnDocument.AFTER else before
+
+    def bulk_write(self, requests, ordered: bool = True, **kwargs) -> _Result:
+        counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nUpserted": 0, "nRemoved": 0, "upserted": []}
+        errors = []
+        with self.database.lock, self._command("bulkWrite", {"ops": len(requests), "ordered": ordered}):
+            for index, request in enumerate(requests):
+                try:
+                    if isinstance(request, InsertOne):
+                        self._insert(request._doc)
+                        counts["nInserted"] += 1
+                    elif isinstance(request, (UpdateOne, UpdateMany)):
+                        result = self._update(request._filter, request._doc, request._upsert,
+                                              multi=isinstance(request, UpdateMany))
+                        counts["nMatched"] += result.matched_count
+                        counts["nModified"] += result.modified_count
+                        if result.upserted_id is not None:
+                            counts["nUpserted"] += 1
+                            counts["upserted"].append({"index": index, "_id": result.upserted_id})
+                    elif isinstance(request, (DeleteOne, DeleteMany)):
+                        deleted = self._delete(request._filter, multi=isinstance(request, DeleteMany))
+                        counts["nRemoved"] += deleted.deleted_count
+                    else:
+                        raise OperationFailure(f"unsupported bulk operation {type(request).__name__}")
+                except DuplicateKeyError as error:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(error), "op": request})
+                    if ordered:
+                        break
+        if errors:
+            raise BulkWriteError({**counts, "writeErrors": errors, "writeConcernErrors": []})
+        return _Result(
+            inserted_count=counts["nInserted"], matched_count=counts["nMatched"],
+            modified_count=counts["nModified"], deleted_count=counts["nRemoved"],
+            upserted_count=counts["nUpserted"], bulk_api_result=counts
+        )
+
+
+class InMemoryCollectionView:
+    """The same collection under other options, like pymongo's with_options()"""
+
+    def __init__(self, collection: InMemoryCollection, read_preference, write_concern):
+        self._collection = collection
+        self.read_preference = read_preference
+        self.write_concern = write_concern
+
+    def __getattr__(self, name: str):
+        return getattr(self._collection, name)
+
+    def with_options(self, read_preference=None, write_concern=None, **kwargs) -> "InMemoryCollectionView":
+        return InMemoryCollectionView(
+            self._collection, read_preference or self.read_preference, write_concern or self.write_concern
+        )
+
+
+class InMemoryDatabase:
+    def __init__(self, client, name: str):
+        self.client = client
+        self.name = name
+        self.lock = client.lock
+        self._collections = {}
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections.setdefault(name, InMemoryCollection(self, name))
+        return collection
+
+    def __getattr__(self, name: str) -> InMemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> InMemoryCollection:
+        return self[name]
+
+    def list_collection_names(self) -> list:
+        return list(self._collections)
+
+    def drop_collection(self, name: str):
+        self._collections.pop(name, None)
+
+    def command(self, command, *args, **kwargs) -> dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"unsupported command {name}")
+
+
+class InMemoryClient:
+    """MongoClient look-alike; databases live for the lifetime of the client"""
+
+    def __init__(self, host=None, event_listeners=None, **kwargs):
+        self.lock = threading.RLock()
+        self._listeners = list(event_listeners or [])
+        self._databases = {}
+
+    def __getitem__(self, name: str) -> InMemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases.setdefault(name, InMemoryDatabase(self, name))
+        return database
+
+    def __getattr__(self, name: str) -> InMemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str, **kwargs) -> InMemoryDatabase:
+        return self[name]
+
+    def drop_database(self, name_or_database):
+        name = getattr(name_or_database, "name", name_or_database)
+        self._databases.pop(name, None)
+
+    def list_database_names(self) -> list:
+        return list(self._databases)
+
+    def close(self):
+        pass
+
+    def _monitor(self, database_name: str, command_name: str, command: dict):
+        return _Monitor(self._listeners, database_name, command_name, command)
+
+
+class _Monitor:
+    """Publishes started/succeeded/failed events around one command"""
+
+    __slots__ = ("listeners", "event", "started")
+
+    def __init__(self, listeners, database_name, command_name, command):
+        self.listeners = listeners
+        self.event = _CommandEvent(database_name, command_name, command, next(_request_ids)) if listeners else None
+
+    def __enter__(self):
+        if self.event is not None:
+            for listener in self.listeners:
+                listener.started(self.event)
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.event is not None:
+            self.event.duration_micros = int((time.perf_counter() - self.started) * 1e6)
+            for listener in self.listeners:
+                if exc_type is None:
+                    listener.succeeded(self.event)
+                else:
+                    self.event.failure = {"errmsg": str(exc)}
+                    listener.failed(self.event)
+        return False
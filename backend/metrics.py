@@ -0,0 +1,243 @@
+"""
+Prometheus text-format metrics for the ClickEarn Pro API.
+
+Each worker process keeps its counters in plain dicts behind a single
+uncontended lock. When METRICS_DIR is set, every worker periodically
+snapshots its state to METRICS_DIR/metrics-<pid>.json and /metrics sums
+the snapshots of all workers, so the endpoint reports the whole server
+whichever worker answers the scrape.
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+
+from pymongo import monitoring
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "http_requests_total": ("counter", "HTTP requests by route and status code"),
+    "http_request_duration_seconds": ("histogram", "HTTP request latency by route"),
+    "http_requests_in_flight": ("gauge", "HTTP requests currently being served"),
+    "mongo_operations_total": ("counter", "MongoDB commands by collection, command and outcome"),
+    "mongo_operation_duration_seconds": ("histogram", "MongoDB command latency by collection and command"),
+    "cache_requests_total": ("counter", "In-process cache lookups by cache and result"),
+}
+
+
+class Registry:
+    """Counters, gauges and fixed-bucket histograms for one process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name: str, labels: tuple, value: float = 1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge_add(self, name: str, labels: tuple, value: float):
+        key = (name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name: str, labels: tuple, value: float):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "gauges": [[name, list(labels), value] for (name, labels), value in self.gauges.items()],
+                "histograms": [
+                    [name, list(labels), list(buckets), total, count]
+                    for (name, labels), (buckets, total, count) in self.histograms.items()
+                ],
+            }
+
+
+registry = Registry()
+
+
+def _labels(pairs: list) -> tuple:
+    return tuple(tuple(pair) for pair in pairs)
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"metrics-{pid}.json")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def flush():
+    """Write this worker's snapshot for the other workers to aggregate"""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def _collect() -> tuple:
+    """Sum snapshots of every worker; this worker contributes its live state"""
+    snapshots = [(os.getpid(), registry.snapshot())]
+    if METRICS_DIR:
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+            pid = int(os.path.basename(path)[len("metrics-"):-len(".json")])
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append((pid, json.load(f)))
+            except (OSError, ValueError):
+                continue
+
+    counters, gauges, histograms = {}, {}, {}
+    for pid, snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, _labels(labels))
+            counters[key] = counters.get(key, 0) + value
+        # Gauges describe live state, so exited workers no longer count
+        if pid == os.getpid() or _pid_alive(pid):
+            for name, labels, value in snapshot["gauges"]:
+                key = (name, _labels(labels))
+                gauges[key] = gauges.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot["histograms"]:
+            key = (name, _labels(labels))
+            merged = histograms.setdefault(key, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return counters, gauges, histograms
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render() -> str:
+    """Render all workers' metrics in the Prometheus text exposition format"""
+    counters, gauges, histograms = _collect()
+    gauges.setdefault(("http_requests_in_flight", ()), 0)
+
+    lines = []
+    for name, (metric_type, description) in HELP.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (metric, labels), value in sorted(gauges.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    registry.inc("cache_requests_total", (("cache", cache), ("result", "hit" if hit else "miss")))
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        registry.gauge_add("http_requests_in_flight", (), 1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            registry.gauge_add("http_requests_in_flight", (), -1)
+            # Route templates keep label cardinality bounded; unmatched paths share one label
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            registry.inc("http_requests_total", (("method", method), ("route", path), ("status", str(status))))
+            registry.observe("http_request_duration_seconds", (("method", method), ("route", path)), elapsed)
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """pymongo command listener counting and timing every command"""
+
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+        self.pending[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, outcome: str):
+        collection = self.pending.pop((event.connection_id, event.request_id), "")
+        labels = (("collection", collection), ("command", event.command_name))
+        registry.inc("mongo_operations_total", labels + (("outcome", outcome),))
+        registry.observe("mongo_operation_duration_seconds", labels, event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
@@ -0,0 +1,25 @@
+"""
+One-off migration of legacy sessions to per-user device sets.
+
+Older releases stored one sessions document per login. This folds each
+of them into its user's devices array and records a marker in the
+migrations collection. The API refuses to start while legacy documents
+are left, because the unique sessions.user_id index cannot be built over
+them; once the marker exists, startup no longer scans sessions.
+
+Run once after upgrading, before starting the API:
+
+    python backend/migrate_sessions.py
+"""
+
+import server
+
+
+def main():
+    server.connect_database()
+    migrated = server.migrate_legacy_sessions()
+    print(f"Migrated {migrated} legacy sessions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Sampled per-request profiling.
+
+ProfilingMiddleware profiles a PROFILE_SAMPLE_RATE fraction of requests,
+plus any request carrying "X-Profile: <PROFILE_DEBUG_TOKEN>". A profiled
+request gets a sampler thread that snapshots the event loop thread's stack
+every PROFILE_INTERVAL_MS. The stacks are written in collapsed format
+(one "frame;frame;frame count" line per stack, ready for flamegraph.pl or
+speedscope) to PROFILE_DIR/<route>/, keeping the newest PROFILE_MAX_FILES
+per route.
+
+The event loop interleaves concurrent requests, so samples taken while a
+profiled request is awaiting may belong to another request.
+
+The middleware is only installed when profiling is enabled, so a disabled
+profiler costs nothing per request.
+"""
+
+import asyncio
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DEBUG_TOKEN = os.environ.get('PROFILE_DEBUG_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/clickearn-profiles')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+
+PROFILE_ENABLED = PROFILE_SAMPLE_RATE > 0 or bool(PROFILE_DEBUG_TOKEN)
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a background thread"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack = ";".join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+def _route_dir(route: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", route).strip("_") or "root"
+
+
+def write_profile(method: str, route: str, elapsed: float, sampler: StackSampler):
+    """Write a collapsed-stack file and rotate old profiles for the route"""
+    directory = os.path.join(PROFILE_DIR, _route_dir(f"{method}{route}"))
+    os.makedirs(directory, exist_ok=True)
+    filename = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{int(elapsed * 1000)}ms.collapsed"
+    with open(os.path.join(directory, filename), "w") as f:
+        f.write(sampler.collapsed())
+
+    profiles = sorted(name for name in os.listdir(directory) if name.endswith(".collapsed"))
+    for name in profiles[:-PROFILE_MAX_FILES]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles sampled or explicitly requested requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _should_profile(self, scope) -> bool:
+        if PROFILE_DEBUG_TOKEN:
+            for name, value in scope["headers"]:
+                if name == b"x-profile":
+                    return hmac.compare_digest(value.decode("latin-1"), PROFILE_DEBUG_TOKEN)
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed = time.perf_counter() - started
+            await asyncio.to_thread(sampler.stop)
+            if sampler.samples:
+                route = scope.get("route")
+                path = route.path if route is not None else "unmatched"
+                await asyncio.to_thread(write_profile, scope["method"], path, elapsed, sampler)
@@ -0,0 +1,172 @@
+"""
+MongoDB command monitoring: slow-command log and per-request query budget.
+
+QueryMonitorListener sees every command pymongo sends. Commands slower
+than MONGO_SLOW_QUERY_MS are logged with the shape of their filter (values
+replaced by type names) so they can be grouped without leaking user data.
+Each command is also charged to the QueryStats of the request that issued
+it, which QueryBudgetMiddleware exposes as X-Query-Count / X-Query-Time-Ms
+response headers when DEBUG is enabled.
+"""
+
+import contextvars
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+DEBUG = os.environ.get('DEBUG', '').lower() in ('1', 'true', 'yes')
+MONGO_SLOW_QUERY_MS = float(os.environ.get('MONGO_SLOW_QUERY_MS', 100))
+
+logger = logging.getLogger("clickearn.mongo")
+
+# Filter-bearing fields per command name
+FILTER_FIELDS = {
+    "find": ("filter", "sort", "projection"),
+    "count": ("query",),
+    "distinct": ("query",),
+    "findAndModify": ("query", "sort", "fields"),
+    "aggregate": ("pipeline",),
+    "update": ("updates",),
+    "delete": ("deletes",),
+}
+
+
+class QueryStats:
+    """Mongo commands issued while serving one request"""
+
+    __slots__ = ("count", "total_ms", "commands")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.commands = []
+
+    def record(self, collection: str, command_name: str, duration_ms: float):
+        self.count += 1
+        self.total_ms += duration_ms
+        self.commands.append((collection, command_name, duration_ms))
+
+
+current_query_stats = contextvars.ContextVar("current_query_stats", default=None)
+
+# Active capture_queries() blocks; each receives (method, route, QueryStats) per request
+_captures = []
+_captures_lock = threading.Lock()
+
+
+def filter_shape(value):
+    """Replace literal values with their type names, keeping keys and operators"""
+    if isinstance(value, dict):
+        return {key: filter_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = filter_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return type(value).__name__
+
+
+def command_shape(command_name: str, command: dict) -> dict:
+    shape = {}
+    for field in FILTER_FIELDS.get(command_name, ()):
+        if field not in command:
+            continue
+        value = command[field]
+        if field == "updates":
+            value = [{"q": update.get("q"), "u": update.get("u")} for update in value]
+        elif field == "deletes":
+            value = [delete.get("q") for delete in value]
+        shape[field] = filter_shape(value)
+    return shape
+
+
+class QueryMonitorListener(monitoring.CommandListener):
+    """Charges commands to the current request and logs slow ones"""
+
+    def __init__(self, slow_ms: float = MONGO_SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self.pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+        shape = command_shape(event.command_name, event.command)
+        self.pending[(event.connection_id, event.request_id)] = (collection, shape)
+
+    def _finish(self, event, failed: bool):
+        collection, shape = self.pending.pop((event.connection_id, event.request_id), ("", {}))
+        duration_ms = event.duration_micros / 1000
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.record(collection, event.command_name, duration_ms)
+        if duration_ms >= self.slow_ms or failed:
+            logger.warning(
+                "%s mongo command %s.%s took %.1fms shape=%s",
+                "failed" if failed else "slow",
+                collection, event.command_name, duration_ms, shape
+            )
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+
+@contextmanager
+def capture_queries():
+    """Collect per-request query stats, e.g. to assert a query budget in tests:
+
+        with capture_queries() as requests:
+            client.get("/api/dashboard", headers=headers)
+        assert requests[0][2].count <= 3
+    """
+    captured = []
+    with _captures_lock:
+        _captures.append(captured)
+    try:
+        yield captured
+    finally:
+        with _captures_lock:
+            _captures.remove(captured)
+
+
+class QueryBudgetMiddleware:
+    """ASGI middleware giving each request its own QueryStats"""
+
+    def __init__(self, app, debug: bool = DEBUG):
+        self.app = app
+        self.debug = debug
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.debug:
+                headers = list(message.get("headers", []))
+                headers.append((b"x-query-count", str(stats.count).encode()))
+                headers.append((b"x-query-time-ms", f"{stats.total_ms:.2f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_query_stats.reset(token)
+            if _captures:
+                route = scope.get("route")
+                entry = (scope["method"], route.path if route is not None else scope["path"], stats)
+                with _captures_lock:
+                    for captured in _captures:
+                        captured.append(entry)
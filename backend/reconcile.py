@@ -0,0 +1,223 @@
+"""
+Incremental reconciliation of user balances against the ledger.
+
+ledger_checkpoints holds, per user, the sum and count of ledger credits
+(clicks collection) and withdrawals up to a checkpoint time. Each run:
+
+1. Folds the events created in (previous run's through, through] into the
+   checkpoints with one $group aggregation per collection and unordered
+   bulk upserts. through is now minus RECONCILE_SETTLE_SECONDS, so
+   in-flight requests have landed.
+2. Checks only the users with new events. The expected total_earned is
+   checkpoint credits plus credits after through. The expected balance
+   also subtracts withdrawals. Users whose stored values differ by more
+   than RECONCILE_TOLERANCE are re-read once. This skips credits caught
+   between their ledger insert and their user update.
+3. Writes confirmed mismatches to the audit log and the run document.
+   With repair=True, it $incs the user's figures by the difference.
+
+Work is proportional to the events since the last run. Only the first run
+scans the whole ledger, including archived partitions.
+
+Runs are recorded in reconciliation_runs. An interrupted run is resumed
+with the same window. Its run_id on each checkpoint keeps the resume from
+folding a user's events in twice.
+
+Run with: python backend/reconcile.py [--repair] [--settle-seconds 60]
+"""
+
+import argparse
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import app_logging
+import archive
+
+RECONCILE_SETTLE_SECONDS = int(os.environ.get('RECONCILE_SETTLE_SECONDS', 60))
+RECONCILE_TOLERANCE = float(os.environ.get('RECONCILE_TOLERANCE', 0.005))
+RECONCILE_CHUNK_SIZE = int(os.environ.get('RECONCILE_CHUNK_SIZE', 1000))
+
+# Mismatches stored on the run document; all of them go to the audit log
+MAX_REPORTED_MISMATCHES = 100
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _sums(collection, match: dict) -> dict:
+    """{user_id: (amount, events)} for the documents matching match"""
+    return {
+        row["_id"]: (row["amount"], row["events"])
+        for row in collection.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$user_id", "amount": {"$sum": "$amount"}, "events": {"$sum": 1}}}
+        ])
+    }
+
+
+def _merge(into: dict, extra: dict):
+    for user_id, (amount, events) in extra.items():
+        current = into.get(user_id, (0.0, 0))
+        into[user_id] = (current[0] + amount, current[1] + events)
+
+
+def _fold_into_checkpoints(db, run: dict, credits: dict, debits: dict):
+    now = datetime.now()
+    operations = [
+        UpdateOne(
+            {"user_id": user_id, "run_id": {"$ne": run["run_id"]}},
+            {
+                "$inc": {
+                    "credits": credits.get(user_id, (0.0, 0))[0],
+                    "credit_events": credits.get(user_id, (0.0, 0))[1],
+                    "debits": debits.get(user_id, (0.0, 0))[0],
+                    "debit_events": debits.get(user_id, (0.0, 0))[1]
+                },
+                "$set": {"run_id": run["run_id"], "through": run["through"], "updated_at": now}
+            },
+            upsert=True
+        )
+        for user_id in set(credits) | set(debits)
+    ]
+    for chunk in _chunks(operations, RECONCILE_CHUNK_SIZE):
+        try:
+            db.ledger_checkpoints.bulk_write(chunk, ordered=False)
+        except BulkWriteError as e:
+            # The upsert collides with the unique user_id when this run already
+            # folded that user in before being interrupted
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+
+def _find_mismatches(db, user_ids: list, through: datetime) -> list:
+    mismatches = []
+    for chunk in _chunks(user_ids, RECONCILE_CHUNK_SIZE):
+        users = {
+            user["user_id"]: user for user in db.users.find(
+                {"user_id": {"$in": chunk}}, {"_id": 0, "user_id": 1, "balance": 1, "total_earned": 1}
+            )
+        }
+        checkpoints = {
+            checkpoint["user_id"]: checkpoint for checkpoint in db.ledger_checkpoints.find(
+                {"user_id": {"$in": chunk}}, {"_id": 0, "user_id": 1, "credits": 1, "debits": 1}
+            )
+        }
+        recent = {"user_id": {"$in": chunk}, "created_at": {"$gt": through}}
+        recent_credits = _sums(db.clicks, recent)
+        recent_debits = _sums(db.withdrawals, recent)
+
+        for user_id in chunk:
+            user = users.get(user_id)
+            checkpoint = checkpoints.get(user_id)
+            if user is None or checkpoint is None:
+                continue
+            expected_total = checkpoint["credits"] + recent_credits.get(user_id, (0.0, 0))[0]
+            expected_balance = expected_total - checkpoint["debits"] - recent_debits.get(user_id, (0.0, 0))[0]
+            balance_diff = round(expected_balance - user.get("balance", 0.0), 2)
+            total_diff = round(expected_total - user.get("total_earned", 0.0), 2)
+            if abs(balance_diff) > RECONCILE_TOLERANCE or abs(total_diff) > RECONCILE_TOLERANCE:
+                mismatches.append({
+                    "user_id": user_id,
+                    "balance": user.get("balance", 0.0),
+                    "expected_balance": round(expected_balance, 2),
+                    "total_earned": user.get("total_earned", 0.0),
+                    "expected_total_earned": round(expected_total, 2),
+                    "balance_diff": balance_diff,
+                    "total_earned_diff": total_diff
+                })
+    return mismatches
+
+
+def reconcile(db, repair: bool = False, settle_seconds: int = RECONCILE_SETTLE_SECONDS) -> dict:
+    """Run (or resume) one incremental reconciliation pass and return its summary"""
+    runs = db.reconciliation_runs
+    run = runs.find_one({"status": "running"}, {"_id": 0})
+    if run is None:
+        last = runs.find_one({"status": "complete"}, {"_id": 0, "through": 1}, sort=[("through", -1)])
+        run = {
+            "run_id": str(uuid.uuid4()),
+            "since": last["through"] if last else None,
+            "through": datetime.now() - timedelta(seconds=settle_seconds),
+            "status": "running",
+            "started_at": datetime.now()
+        }
+        runs.insert_one(dict(run))
+
+    window = {"$lte": run["through"]}
+    if run["since"]:
+        window["$gt"] = run["since"]
+    credits = _sums(db.clicks, {"created_at": window})
+    debits = _sums(db.withdrawals, {"created_at": window})
+    if run["since"] is None:
+        # Baseline run: rows already moved to Parquet still count
+        _merge(credits, archive.archived_totals("clicks"))
+        _merge(debits, archive.archived_totals("withdrawals"))
+    _fold_into_checkpoints(db, run, credits, debits)
+
+    user_ids = sorted(set(credits) | set(debits))
+    suspects = _find_mismatches(db, user_ids, run["through"])
+    mismatches = _find_mismatches(db, [m["user_id"] for m in suspects], run["through"]) if suspects else []
+
+    for mismatch in mismatches:
+        app_logging.audit("reconcile.mismatch", run_id=run["run_id"], repaired=repair, **mismatch)
+        if repair:
+            db.users.update_one(
+                {"user_id": mismatch["user_id"]},
+                {"$inc": {
+                    "balance": mismatch["balance_diff"],
+                    "total_earned": mismatch["total_earned_diff"],
+                    "dashboard_version": 1
+                }}
+            )
+
+    summary = {
+        "run_id": run["run_id"],
+        "since": run["since"],
+        "through": run["through"],
+        "users_checked": len(user_ids),
+        "credit_events": sum(events for _, events in credits.values()),
+        "debit_events": sum(events for _, events in debits.values()),
+        "mismatch_count": len(mismatches),
+        "repaired": repair and bool(mismatches)
+    }
+    runs.update_one({"run_id": run["run_id"]}, {"$set": {
+        **summary,
+        "status": "complete",
+        "finished_at": datetime.now(),
+        "mismatches": mismatches[:MAX_REPORTED_MISMATCHES]
+    }})
+    return {**summary, "mismatches": mismatches}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile ClickEarn Pro balances against the ledger")
+    parser.add_argument("--repair", action="store_true", help="correct mismatched balances")
+    parser.add_argument("--settle-seconds", type=int, default=RECONCILE_SETTLE_SECONDS,
+                        help="leave events newer than this for the next run")
+    args = parser.parse_args()
+
+    import server
+    server.connect_database()
+    server.ensure_indexes()
+    summary = reconcile(server.db, args.repair, args.settle_seconds)
+    app_logging.flush()
+
+    print(f"Run {summary['run_id']}: {summary['credit_events']} credits and {summary['debit_events']} "
+          f"withdrawals through {summary['through']:%Y-%m-%d %H:%M:%S}, {summary['users_checked']} users checked")
+    for mismatch in summary["mismatches"]:
+        print(f"  {mismatch['user_id']}: balance {mismatch['balance']} expected {mismatch['expected_balance']}, "
+              f"total_earned {mismatch['total_earned']} expected {mismatch['expected_total_earned']}")
+    action = "repaired" if summary["repaired"] else "found"
+    print(f"{summary['mismatch_count']} mismatches {action}")
+    return summary["mismatch_count"] == 0 or summary["repaired"]
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
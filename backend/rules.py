@@ -0,0 +1,150 @@
+"""
+Reward and limit rules, compiled into lookup tables and hot-swapped.
+
+RULES_FILE (default backend/rules.json) holds:
+
+    {
+      "rewards": {"click": 0.5, "video": 0.25},
+      "content_rewards": {"video_3": 0.3},
+      "daily_limits": {"click": 20, "video": 10},
+      "min_watch_seconds": 30,
+      "min_withdrawal": 10.0,
+      "tiers": {"standard": {}, "gold": {"multiplier": 1.2, "daily_limits": {"click": 30}}},
+      "hour_multipliers": {"18-22": 1.5}
+    }
+
+- content_rewards overrides the base reward for a content or video id.
+- A tier scales every reward and can override daily limits. Users
+  without a known tier get DEFAULT_TIER.
+- hour_multipliers maps local hours ("H" or "H-H", end exclusive) to a
+  multiplier.
+
+compile_rules() precomputes every (tier, event type or content id)
+reward as a 24-entry tuple indexed by hour, rounded to cents. A credit
+then costs two dict lookups and a tuple index. The compiled Rules object
+is immutable. reload_if_changed() builds a new one when the file's mtime
+changes and swaps it in with one assignment. A request reads `current`
+once and keeps a consistent snapshot. An invalid file is logged and the
+previous rules stay in force.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+RULES_FILE = os.environ.get('RULES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json'))
+RULES_RELOAD_SECONDS = float(os.environ.get('RULES_RELOAD_SECONDS', 5))
+DEFAULT_TIER = "standard"
+EVENT_TYPES = ("click", "video")
+
+logger = logging.getLogger("clickearn.rules")
+
+
+class Rules:
+    """Compiled, read-only rule tables"""
+    __slots__ = ("version", "min_watch_seconds", "min_withdrawal", "_rewards", "_limits")
+
+    def __init__(self, version: str, min_watch_seconds: int, min_withdrawal: float, rewards: dict, limits: dict):
+        self.version = version
+        self.min_watch_seconds = min_watch_seconds
+        self.min_withdrawal = min_withdrawal
+        self._rewards = rewards
+        self._limits = limits
+
+    def reward(self, tier: str, event_type: str, content_id: str, hour: int) -> float:
+        table = self._rewards.get((tier, content_id)) or self._rewards.get((tier, event_type))
+        if table is None:
+            table = self._rewards.get((DEFAULT_TIER, content_id)) or self._rewards[(DEFAULT_TIER, event_type)]
+        return table[hour]
+
+    def daily_limit(self, tier: str, event_type: str) -> int:
+        limit = self._limits.get((tier, event_type))
+        return self._limits[(DEFAULT_TIER, event_type)] if limit is None else limit
+
+
+def _hours(spec: str) -> range:
+    start, _, end = spec.partition("-")
+    start = int(start)
+    end = int(end) if end else start + 1
+    if not 0 <= start < end <= 24:
+        raise ValueError(f"invalid hour range {spec!r}")
+    return range(start, end)
+
+
+def _amount(value, name: str) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f"{name} must be a non-negative number")
+    return float(value)
+
+
+def compile_rules(config: dict) -> Rules:
+    """Validate a rules config and precompute its lookup tables"""
+    hour_multipliers = [1.0] * 24
+    for spec, multiplier in config.get("hour_multipliers", {}).items():
+        for hour in _hours(spec):
+            hour_multipliers[hour] = _amount(multiplier, f"hour_multipliers[{spec}]")
+
+    base_rewards = {event_type: _amount(config["rewards"][event_type], f"rewards.{event_type}")
+                    for event_type in EVENT_TYPES}
+    base_rewards.update({content_id: _amount(value, f"content_rewards.{content_id}")
+                         for content_id, value in config.get("content_rewards", {}).items()})
+    base_limits = {event_type: int(config["daily_limits"][event_type]) for event_type in EVENT_TYPES}
+
+    tiers = dict(config.get("tiers", {}))
+    tiers.setdefault(DEFAULT_TIER, {})
+    rewards = {}
+    limits = {}
+    for tier, tier_config in tiers.items():
+        tier_multiplier = _amount(tier_config.get("multiplier", 1.0), f"tiers.{tier}.multiplier")
+        for key, base in base_rewards.items():
+            rewards[(tier, key)] = tuple(
+                round(base * tier_multiplier * hour_multipliers[hour], 2) for hour in range(24)
+            )
+        for event_type in EVENT_TYPES:
+            limit = int(tier_config.get("daily_limits", {}).get(event_type, base_limits[event_type]))
+            if limit < 0:
+                raise ValueError(f"tiers.{tier}.daily_limits.{event_type} must not be negative")
+            limits[(tier, event_type)] = limit
+
+    version = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+    return Rules(
+        version,
+        int(config["min_watch_seconds"]),
+        _amount(config["min_withdrawal"], "min_withdrawal"),
+        rewards,
+        limits
+    )
+
+
+def load(path: str = None) -> Rules:
+    with open(path or RULES_FILE, encoding="utf-8") as f:
+        return compile_rules(json.load(f))
+
+
+current = load()
+_loaded_mtime = os.path.getmtime(RULES_FILE)
+
+
+def reload_if_changed() -> bool:
+    """Swap in the rules file if it changed since the last load"""
+    global current, _loaded_mtime
+    try:
+        mtime = os.path.getmtime(RULES_FILE)
+    except OSError as e:
+        logger.error("Keeping rules %s; %s is unreadable: %s", current.version, RULES_FILE, e)
+        return False
+    if mtime == _loaded_mtime:
+        return False
+    # Each version of the file is attempted once; a broken edit is not retried until it changes again
+    _loaded_mtime = mtime
+    try:
+        rules = load()
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error("Keeping rules %s; %s could not be loaded: %s", current.version, RULES_FILE, e)
+        return False
+    if rules.version == current.version:
+        return False
+    current = rules
+    logger.warning("Loaded rules %s from %s", rules.version, RULES_FILE)
+    return True
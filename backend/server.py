@@ -1,21 +1,96 @@
-from fastapi import FastAPI, HTTPException, Request, Header, Depends
+from fastapi import FastAPI, HTTPException, Request, Response, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import pymongo
+from pymongo import MongoClient, InsertOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 import os
 from datetime import datetime, timedelta
 import uuid
 import httpx
-from typing import Optional
+import asyncio
+import time
+from jose import jwt, JWTError
+from typing import Optional, List
 import json
 import hashlib
-import random
+import hmac
 import re
+import signal
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, EmailStr, validator
 
+import app_logging
+import archive
+import bulk_ops
+import db_routing
+import metrics
+import profiling
+import query_monitor
+import rules
+import sms
+import tracing
+import traffic_capture
+import verification
+
+# True once this worker has begun shutting down
+draining = False
+http_client = None
+_background_tasks = []
+# Verification codes go out from a background task; the provider is never awaited in a request
+sms_queue = sms.SmsQueue(sms.create_provider())
+
+@asynccontextmanager
+async def lifespan(app):
+    """Per-worker resources: Mongo and HTTP clients, caches and background loops"""
+    global http_client, draining, _revocations_synced_at
+    draining = False
+    connect_database()
+    _idempotency_cache.clear()
+    _dashboard_cache.clear()
+    _revoked_tokens.clear()
+    _sessions_not_before.clear()
+    _revocations_synced_at = None
+    http_client = httpx.AsyncClient(
+        timeout=10,
+        limits=httpx.Limits(max_connections=max(2, HTTP_MAX_CONNECTIONS // WEB_CONCURRENCY))
+    )
+    await asyncio.to_thread(ensure_indexes)
+    if metrics.METRICS_DIR:
+        _background_tasks.append(asyncio.create_task(metrics_flush_loop()))
+    if SESSION_MODE == "signed":
+        await asyncio.to_thread(sync_session_revocations)
+        _background_tasks.append(asyncio.create_task(revocation_sync_loop()))
+    _background_tasks.append(asyncio.create_task(health_check_loop()))
+    _background_tasks.append(asyncio.create_task(rules_reload_loop()))
+    _background_tasks.append(asyncio.create_task(sms_queue.run()))
+    restore_signals = install_drain_handler()
+    try:
+        yield
+    finally:
+        restore_signals()
+        # The server has stopped accepting and waited for in-flight requests
+        draining = True
+        try:
+            await asyncio.wait_for(sms_queue.flush(), SHUTDOWN_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        for task in _background_tasks:
+            task.cancel()
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+        _background_tasks.clear()
+        await http_client.aclose()
+        metrics.flush()
+        tracing.exporter.flush()
+        app_logging.flush()
+        traffic_capture.flush()
+        client.close()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(default_response_class=tracing.TracedJSONResponse, lifespan=lifespan)
 
 # CORS configuration
 app.add_middleware(
@@ -26,19 +101,166 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts and latency per route
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Structured access log, written off the request path
+app.add_middleware(app_logging.AccessLogMiddleware)
+
+# Per-request Mongo query count/time (headers in DEBUG mode)
+app.add_middleware(query_monitor.QueryBudgetMiddleware)
+
+# Sampled flamegraph profiles; not installed at all when disabled
+if profiling.PROFILE_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+# Sampled request spans exported to local OTLP JSON files
+if tracing.TRACING_ENABLED:
+    app.add_middleware(tracing.TracingMiddleware)
+
+# Sampled, sanitized request stream for tests/replay_traffic.py
+if traffic_capture.CAPTURE_ENABLED:
+    app.add_middleware(traffic_capture.CaptureMiddleware)
+
 # MongoDB connection
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 DB_NAME = os.environ.get('DB_NAME', 'clickearn_pro')
 
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
+# Worker processes, and connection budgets shared by all of them
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+MONGO_MAX_CONNECTIONS = int(os.environ.get('MONGO_MAX_CONNECTIONS', 100))
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 100))
+SHUTDOWN_GRACE_SECONDS = int(os.environ.get('SHUTDOWN_GRACE_SECONDS', 30))
+
+# Dependency health checks behind /health/ready, and how long a worker keeps
+# serving while reporting not-ready after SIGTERM (load balancer deregistration)
+HEALTH_CHECK_SECONDS = float(os.environ.get('HEALTH_CHECK_SECONDS', 5))
+HEALTH_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_TIMEOUT_SECONDS', 2))
+DRAIN_SECONDS = float(os.environ.get('DRAIN_SECONDS', 0))
+
+_mongo_listeners = [
+    metrics.MongoMetricsListener(),
+    query_monitor.QueryMonitorListener(),
+    tracing.TracingMongoListener()
+]
+
+# Created per worker process by connect_database(), never at import time,
+# so no client is ever inherited across a fork
+client = None
+db = None
+
+def configure_database(database):
+    """Point the API at another database, e.g. a fresh in-memory one per test"""
+    global db, users_collection, sessions_collection, clicks_collection, withdrawals_collection
+    global verification_codes_collection, idempotency_keys_collection, session_revocations_collection
+    global ledger_checkpoints_collection, reconciliation_runs_collection
+    global clicks_history_collection, withdrawals_history_collection, code_store
+    db = database
+    # Each handle carries its route's read preference and write concern (see db_routing.py)
+    users_collection = db_routing.routed(db, "users")
+    sessions_collection = db_routing.routed(db, "sessions")
+    clicks_collection = db_routing.routed(db, "clicks")
+    withdrawals_collection = db_routing.routed(db, "withdrawals")
+    verification_codes_collection = db_routing.routed(db, "verification_codes")
+    idempotency_keys_collection = db_routing.routed(db, "idempotency_keys")
+    session_revocations_collection = db_routing.routed(db, "session_revocations")
+    ledger_checkpoints_collection = db_routing.routed(db, "ledger_checkpoints")
+    reconciliation_runs_collection = db_routing.routed(db, "reconciliation_runs")
+    # Read-only views that may be served by a lagging secondary
+    clicks_history_collection = db_routing.route(db.clicks, "history")
+    withdrawals_history_collection = db_routing.route(db.withdrawals, "history")
+    code_store = verification.create_store(verification_codes_collection, WEB_CONCURRENCY)
+
+def connect_database():
+    """Create this process's Mongo client, sized to its share of MONGO_MAX_CONNECTIONS"""
+    global client
+    # memory:// runs against the in-process stand-in (hermetic tests, local demos)
+    if MONGO_URL.startswith("memory://"):
+        import memory_db
+        client = memory_db.InMemoryClient(event_listeners=_mongo_listeners)
+    else:
+        client = MongoClient(
+            MONGO_URL,
+            event_listeners=_mongo_listeners,
+            maxPoolSize=max(2, MONGO_MAX_CONNECTIONS // WEB_CONCURRENCY),
+            minPoolSize=1
+        )
+    configure_database(client[DB_NAME])
+    return client
 
-# Collections
-users_collection = db.users
-sessions_collection = db.sessions
-clicks_collection = db.clicks
-withdrawals_collection = db.withdrawals
-verification_codes_collection = db.verification_codes
+# Emergent OAuth upstream
+EMERGENT_AUTH_HOST = "demobackend.emergentagent.com"
+
+# Maximum number of queued client events accepted by /api/events/batch
+MAX_BATCH_EVENTS = 50
+
+# Idempotency-Key replay window and per-process fast path size
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+# A pending claim older than this is taken over by the next retry (its worker died or hung)
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 60))
+
+# Event batches remembered on the user document, so a retried batch is credited once
+CREDITED_BATCH_HISTORY = 50
+
+# Rendered dashboards kept per process, keyed by user and dashboard_version
+DASHBOARD_CACHE_SIZE = int(os.environ.get('DASHBOARD_CACHE_SIZE', 10000))
+
+# Session mode: "database" (session documents) or "signed" (stateless HMAC tokens)
+SESSION_MODE = os.environ.get('SESSION_MODE', 'database')
+SESSION_SECRET = os.environ.get('SESSION_SECRET')
+SESSION_TTL_DAYS = 7
+MAX_DEVICES_PER_USER = int(os.environ.get('MAX_DEVICES_PER_USER', 5))
+SESSION_REVOCATION_SYNC_SECONDS = int(os.environ.get('SESSION_REVOCATION_SYNC_SECONDS', 30))
+
+if SESSION_MODE == "signed" and not SESSION_SECRET:
+    raise RuntimeError("SESSION_SECRET is required when SESSION_MODE=signed")
+
+# Shared secret for /api/admin/* (X-Admin-Token); admin endpoints are disabled without it
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+def ensure_indexes():
+    # Every query shape in this module must be served by one of these indexes;
+    # tests/test_query_plans.py checks the plans against a seeded database
+    users_collection.create_index("user_id", unique=True)
+    users_collection.create_index("email")
+    users_collection.create_index("phone")
+    clicks_collection.create_index([("user_id", 1), ("created_at", -1)])
+    withdrawals_collection.create_index([("user_id", 1), ("created_at", -1)])
+    # Oldest-first scans of backend/archive.py
+    clicks_collection.create_index("created_at")
+    withdrawals_collection.create_index("created_at")
+    verification_codes_collection.create_index("phone")
+    verification_codes_collection.create_index("expires_at", expireAfterSeconds=0)
+    # Client idempotency keys are unique per user; rows without a key are untouched
+    clicks_collection.create_index(
+        [("user_id", 1), ("idempotency_key", 1)],
+        unique=True,
+        partialFilterExpression={"idempotency_key": {"$exists": True}}
+    )
+    idempotency_keys_collection.create_index([("user_id", 1), ("key", 1)], unique=True)
+    idempotency_keys_collection.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+    require_sessions_migrated()
+    sessions_collection.create_index("user_id", unique=True)
+    sessions_collection.create_index("devices.session_id")
+    session_revocations_collection.create_index("revocation_id", unique=True)
+    session_revocations_collection.create_index("updated_at")
+    session_revocations_collection.create_index("expires_at", expireAfterSeconds=0)
+    # backend/reconcile.py
+    ledger_checkpoints_collection.create_index("user_id", unique=True)
+    reconciliation_runs_collection.create_index("run_id", unique=True)
+    reconciliation_runs_collection.create_index([("status", 1), ("through", -1)])
+    db_routing.routed(db, "bulk_operations").create_index("operation_id", unique=True)
+
+async def rules_reload_loop():
+    while True:
+        await asyncio.sleep(rules.RULES_RELOAD_SECONDS)
+        await asyncio.to_thread(rules.reload_if_changed)
+
+async def metrics_flush_loop():
+    while True:
+        await asyncio.sleep(metrics.METRICS_FLUSH_SECONDS)
+        await asyncio.to_thread(metrics.flush)
 
 # Pydantic models
 class ClickData(BaseModel):
@@ -48,6 +270,30 @@ class VideoWatchData(BaseModel):
     video_id: str
     watch_duration: int  # in seconds
 
+class BatchEvent(BaseModel):
+    type: str  # "click" or "video"
+    idempotency_key: str
+    content_id: Optional[str] = None
+    video_id: Optional[str] = None
+    watch_duration: Optional[int] = None  # in seconds, videos only
+
+    @validator('type')
+    def validate_type(cls, v):
+        if v not in ("click", "video"):
+            raise ValueError('Tipo de evento inválido')
+        return v
+
+class EventBatch(BaseModel):
+    events: List[BatchEvent]
+
+    @validator('events')
+    def validate_events(cls, v):
+        if not v:
+            raise ValueError('Lote vazio')
+        if len(v) > MAX_BATCH_EVENTS:
+            raise ValueError(f'Máximo de {MAX_BATCH_EVENTS} eventos por lote')
+        return v
+
 class WithdrawRequest(BaseModel):
     amount: float
     paypal_email: str
@@ -82,6 +328,19 @@ class VerifyCodeRequest(BaseModel):
 class SendCodeRequest(BaseModel):
     phone: str
 
+class BulkOperationRequest(BaseModel):
+    kind: str  # see bulk_ops.KINDS
+    user_ids: Optional[List[str]] = None
+    filter: Optional[dict] = None
+    amount: Optional[float] = None  # credits only
+    reason: str = ""
+
+    @validator('kind')
+    def validate_kind(cls, v):
+        if v not in bulk_ops.KINDS:
+            raise ValueError('Operação inválida')
+        return v
+
 # Utility functions
 def hash_password(password: str) -> str:
     """Hash password using SHA256"""
@@ -91,53 +350,449 @@ def verify_password(password: str, hashed: str) -> bool:
     """Verify password against hash"""
     return hash_password(password) == hashed
 
-def generate_verification_code() -> str:
-    """Generate 6-digit verification code"""
-    return str(random.randint(100000, 999999))
+# Signed sessions
+# Revoked token ids (jti -> exp) and per-user "issued before" cut-offs (user_id -> iat)
+_revoked_tokens = {}
+_sessions_not_before = {}
+_revocations_synced_at = None
 
-def create_session(user_id: str) -> str:
-    """Create new session for user"""
-    session_id = str(uuid.uuid4())
-    session_data = {
+def issue_session_token(user_id: str, now: Optional[float] = None, jti: Optional[str] = None) -> str:
+    """Issue a signed session token carrying user_id and expiry"""
+    now = now or time.time()
+    claims = {
+        "sub": user_id,
+        "iat": now,
+        "exp": int(now + SESSION_TTL_DAYS * 86400),
+        "jti": jti or uuid.uuid4().hex
+    }
+    return jwt.encode(claims, SESSION_SECRET, algorithm="HS256")
+
+def decode_session_token(token: str) -> Optional[dict]:
+    """Return token claims, or None if the token is invalid, expired or revoked"""
+    try:
+        claims = jwt.decode(token, SESSION_SECRET, algorithms=["HS256"])
+    except JWTError:
+        return None
+    if claims["jti"] in _revoked_tokens:
+        return None
+    if claims["iat"] < _sessions_not_before.get(claims["sub"], 0):
+        return None
+    return claims
+
+def is_signed_session_token(session_id: str) -> bool:
+    return SESSION_MODE == "signed" and session_id.count(".") == 2
+
+def _record_revocation(revocation_id: str, fields: dict, expires_at: datetime):
+    session_revocations_collection.update_one(
+        {"revocation_id": revocation_id},
+        {"$set": {**fields, "expires_at": expires_at, "updated_at": datetime.now()}},
+        upsert=True
+    )
+
+def revoke_user_sessions(user_id: str, not_before: float):
+    """Invalidate every token of the user issued before not_before"""
+    _sessions_not_before[user_id] = max(not_before, _sessions_not_before.get(user_id, 0))
+    _record_revocation(
+        f"user:{user_id}",
+        {"user_id": user_id, "not_before": not_before},
+        datetime.fromtimestamp(not_before) + timedelta(days=SESSION_TTL_DAYS)
+    )
+
+def revoke_session_token(claims: dict):
+    _revoked_tokens[claims["jti"]] = claims["exp"]
+    _record_revocation(
+        f"token:{claims['jti']}",
+        {"jti": claims["jti"], "user_id": claims["sub"]},
+        datetime.fromtimestamp(claims["exp"])
+    )
+
+def sync_session_revocations():
+    """Pull revocations written by other workers since the last sync"""
+    global _revocations_synced_at
+    started_at = datetime.now()
+    query = {}
+    if _revocations_synced_at:
+        # Overlap the window a little to tolerate clock skew between workers
+        query["updated_at"] = {"$gte": _revocations_synced_at - timedelta(seconds=5)}
+    for revocation in session_revocations_collection.find(query, {"_id": 0}):
+        if "jti" in revocation:
+            _revoked_tokens[revocation["jti"]] = revocation["expires_at"].timestamp()
+        else:
+            user_id = revocation["user_id"]
+            _sessions_not_before[user_id] = max(
+                revocation["not_before"], _sessions_not_before.get(user_id, 0)
+            )
+    _revocations_synced_at = started_at
+
+    # Entries past token lifetime can no longer match a valid token
+    now = time.time()
+    for jti in [jti for jti, exp in _revoked_tokens.items() if exp < now]:
+        del _revoked_tokens[jti]
+    cutoff = now - SESSION_TTL_DAYS * 86400
+    for user_id in [u for u, ts in _sessions_not_before.items() if ts < cutoff]:
+        del _sessions_not_before[user_id]
+
+async def revocation_sync_loop():
+    while True:
+        await asyncio.sleep(SESSION_REVOCATION_SYNC_SECONDS)
+        try:
+            await asyncio.to_thread(sync_session_revocations)
+        except Exception:
+            # Keep serving with the last known revocations until Mongo is back
+            pass
+
+def add_session_device(user_id: str, session_id: str, device_name: Optional[str] = None, **extra):
+    """Add a device session to the user's bounded device set in a single upsert"""
+    device = {
+        "device_id": str(uuid.uuid4()),
         "session_id": session_id,
-        "user_id": user_id,
+        "device_name": device_name or "",
         "created_at": datetime.now(),
-        "expires_at": datetime.now() + timedelta(days=7)
+        "expires_at": datetime.now() + timedelta(days=SESSION_TTL_DAYS),
+        **extra
     }
-    
-    # Remove existing sessions for user
-    sessions_collection.delete_many({"user_id": user_id})
-    sessions_collection.insert_one(session_data)
-    
+    # $slice keeps the newest MAX_DEVICES_PER_USER devices, evicting the oldest
+    sessions_collection.update_one(
+        {"user_id": user_id},
+        {
+            "$push": {"devices": {"$each": [device], "$slice": -MAX_DEVICES_PER_USER}},
+            "$set": {"updated_at": datetime.now()}
+        },
+        upsert=True
+    )
+
+def create_session(user_id: str, device_name: Optional[str] = None, relogin: bool = False) -> str:
+    """Create new session for user"""
+    if SESSION_MODE == "signed":
+        now = time.time()
+        if relogin:
+            # Re-login ends every earlier token, and the new one is issued exactly at the cut-off
+            revoke_user_sessions(user_id, now)
+            sessions_collection.update_one({"user_id": user_id}, {"$pull": {"devices": {"session_id": None}}})
+        # The device entry (device_id = jti, no session_id) only lists and scopes revocation;
+        # requests are still authenticated from the token alone
+        jti = uuid.uuid4().hex
+        add_session_device(user_id, None, device_name, device_id=jti)
+        return issue_session_token(user_id, now, jti)
+
+    session_id = str(uuid.uuid4())
+    add_session_device(user_id, session_id, device_name)
     return session_id
 
+# Marker in the migrations collection written once legacy sessions are folded
+LEGACY_SESSIONS_MIGRATION = "legacy_sessions"
+
+def _mark_sessions_migrated():
+    db_routing.routed(db, "migrations").update_one(
+        {"_id": LEGACY_SESSIONS_MIGRATION},
+        {"$setOnInsert": {"completed_at": datetime.now()}},
+        upsert=True
+    )
+
+def require_sessions_migrated():
+    """Refuse to start while one-document-per-session records are left
+
+    The marker makes this a single _id lookup on every boot after the first.
+    """
+    if db_routing.routed(db, "migrations").find_one({"_id": LEGACY_SESSIONS_MIGRATION}):
+        return
+    # One unindexed probe, only until the marker exists
+    if sessions_collection.find_one({"session_id": {"$exists": True}}, {"_id": 1}):
+        raise RuntimeError("Legacy sessions found: run python backend/migrate_sessions.py before starting")
+    _mark_sessions_migrated()
+
+def migrate_legacy_sessions() -> int:
+    """Fold one-document-per-session records into per-user device sets"""
+    migrated = 0
+    for legacy in sessions_collection.find({"session_id": {"$exists": True}}):
+        extra = {}
+        if "session_token" in legacy:
+            extra["session_token"] = legacy["session_token"]
+        sessions_collection.update_one(
+            {"user_id": legacy["user_id"], "devices": {"$exists": True}},
+            {
+                "$push": {"devices": {"$each": [{
+                    "device_id": str(uuid.uuid4()),
+                    "session_id": legacy["session_id"],
+                    "device_name": "",
+                    "created_at": legacy["created_at"],
+                    "expires_at": legacy["expires_at"],
+                    **extra
+                }], "$slice": -MAX_DEVICES_PER_USER}},
+                "$set": {"updated_at": datetime.now()}
+            },
+            upsert=True
+        )
+        sessions_collection.delete_one({"_id": legacy["_id"]})
+        migrated += 1
+    _mark_sessions_migrated()
+    return migrated
+
+# Idempotency-Key handling
+# Completed responses, keyed by (user_id, key): (expires_at, endpoint, request_hash, response)
+_idempotency_cache = OrderedDict()
+
+def idempotency_request_hash(request_data) -> str:
+    """Digest of a request body, so a key cannot be replayed with a different one"""
+    return hashlib.sha256(
+        json.dumps(jsonable_encoder(request_data), sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+def _cache_idempotent_response(cache_key, endpoint: str, request_hash: str, response: dict):
+    _idempotency_cache[cache_key] = (
+        datetime.now() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS), endpoint, request_hash, response
+    )
+    _idempotency_cache.move_to_end(cache_key)
+    while len(_idempotency_cache) > IDEMPOTENCY_CACHE_SIZE:
+        _idempotency_cache.popitem(last=False)
+
+def _check_idempotent_request(endpoint: str, request_hash: str, stored_endpoint: str, stored_hash: Optional[str]):
+    if stored_endpoint != endpoint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key já utilizada em outra operação")
+    # Claims written before request hashes were stored carry none
+    if stored_hash is not None and stored_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key já utilizada com outros dados")
+
+def _replay_idempotent_response(response: dict, http_response: Response):
+    http_response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+def _take_over_idempotency_claim(user_id: str, key: str, stored: dict, claim_id: str) -> bool:
+    """Take a pending claim whose lease ran out; only one retry can win it"""
+    now = datetime.now()
+    claimed_until = stored.get("claimed_until") or stored["created_at"] + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+    if claimed_until > now:
+        return False
+    taken = idempotency_keys_collection.find_one_and_update(
+        {"user_id": user_id, "key": key, "status": "pending", "claim_id": stored.get("claim_id")},
+        {"$set": {"claim_id": claim_id, "claimed_until": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)}},
+        projection={"_id": 1}
+    )
+    return taken is not None
+
+def run_idempotent(user_id: str, key: Optional[str], endpoint: str, request_data, operation, http_response: Response):
+    """Run a money-moving operation at most once per (user, Idempotency-Key)"""
+    if not key:
+        return operation()
+
+    request_hash = idempotency_request_hash(request_data)
+    cache_key = (user_id, key)
+    cached = _idempotency_cache.get(cache_key)
+    metrics.record_cache_lookup("idempotency", cached is not None)
+    if cached:
+        expires_at, stored_endpoint, stored_hash, response = cached
+        if datetime.now() < expires_at:
+            _check_idempotent_request(endpoint, request_hash, stored_endpoint, stored_hash)
+            return _replay_idempotent_response(response, http_response)
+        _idempotency_cache.pop(cache_key, None)
+
+    # Claim the key for one lease; the unique index makes concurrent retries lose the race
+    claim_id = uuid.uuid4().hex
+    now = datetime.now()
+    try:
+        idempotency_keys_collection.insert_one({
+            "user_id": user_id,
+            "key": key,
+            "endpoint": endpoint,
+            "request_hash": request_hash,
+            "status": "pending",
+            "claim_id": claim_id,
+            "claimed_until": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+            "response": None,
+            "created_at": now
+        })
+    except DuplicateKeyError:
+        stored = idempotency_keys_collection.find_one(
+            {"user_id": user_id, "key": key},
+            {"_id": 0, "endpoint": 1, "request_hash": 1, "status": 1, "response": 1,
+             "claim_id": 1, "claimed_until": 1, "created_at": 1}
+        )
+        if not stored:
+            raise HTTPException(status_code=409, detail="Requisição em processamento, tente novamente")
+        _check_idempotent_request(endpoint, request_hash, stored["endpoint"], stored.get("request_hash"))
+        if stored["status"] == "completed":
+            _cache_idempotent_response(cache_key, stored["endpoint"], stored.get("request_hash"), stored["response"])
+            return _replay_idempotent_response(stored["response"], http_response)
+        if not _take_over_idempotency_claim(user_id, key, stored, claim_id):
+            raise HTTPException(status_code=409, detail="Requisição em processamento, tente novamente")
+
+    try:
+        response = operation()
+    except Exception:
+        # Failed attempts are not recorded so the client can retry with the same key
+        idempotency_keys_collection.delete_one(
+            {"user_id": user_id, "key": key, "status": "pending", "claim_id": claim_id}
+        )
+        raise
+
+    idempotency_keys_collection.update_one(
+        {"user_id": user_id, "key": key},
+        {"$set": {"status": "completed", "response": response}, "$unset": {"claimed_until": ""}}
+    )
+    _cache_idempotent_response(cache_key, endpoint, request_hash, response)
+    return response
+
 # Authentication dependency
-async def get_current_user(x_session_id: str = Header(None)):
+class UserRecord:
+    """Compact per-request view of a user document, holding only projected fields"""
+    __slots__ = (
+        "user_id", "name", "email", "phone", "picture", "balance", "total_earned",
+        "clicks_today", "videos_today", "last_click_date", "last_video_date",
+        "created_at", "is_active", "auth_method", "phone_verified", "email_verified",
+        "dashboard_version", "tier"
+    )
+
+    # Values for fields that older documents may not have
+    DEFAULTS = {"clicks_today": 0, "videos_today": 0, "picture": "", "is_active": True, "dashboard_version": 0,
+                "tier": rules.DEFAULT_TIER}
+
+    def __init__(self, doc: dict, fields):
+        for field in fields:
+            setattr(self, field, doc.get(field, self.DEFAULTS.get(field)))
+
+def get_session_user_id(x_session_id: Optional[str]) -> str:
+    """Resolve the session header to a user_id, raising 401 when it is not valid"""
     if not x_session_id:
         raise HTTPException(status_code=401, detail="Session ID required")
     
-    session = sessions_collection.find_one({"session_id": x_session_id})
+    if is_signed_session_token(x_session_id):
+        claims = decode_session_token(x_session_id)
+        if not claims:
+            raise HTTPException(status_code=401, detail="Invalid session")
+        return claims["sub"]
+    
+    session = sessions_collection.find_one(
+        {"devices.session_id": x_session_id},
+        {"_id": 0, "user_id": 1, "devices": {"$elemMatch": {"session_id": x_session_id}}}
+    )
     if not session:
         raise HTTPException(status_code=401, detail="Invalid session")
     
     # Check session expiry
-    if datetime.now() > session["expires_at"]:
-        sessions_collection.delete_one({"session_id": x_session_id})
+    if datetime.now() > session["devices"][0]["expires_at"]:
+        sessions_collection.update_one(
+            {"user_id": session["user_id"]},
+            {"$pull": {"devices": {"session_id": x_session_id}}}
+        )
         raise HTTPException(status_code=401, detail="Session expired")
     
-    user = users_collection.find_one({"user_id": session["user_id"]})
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+    return session["user_id"]
+
+def current_user_with(*fields: str):
+    """Build an auth dependency that fetches only the given user fields"""
+    # is_active is always read: deactivated accounts lose every session at once
+    fields = ("user_id", "is_active") + tuple(field for field in fields if field not in ("user_id", "is_active"))
+    unknown = set(fields) - set(UserRecord.__slots__)
+    if unknown:
+        raise ValueError(f"Unknown user fields: {sorted(unknown)}")
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    
+    async def dependency(x_session_id: str = Header(None)) -> UserRecord:
+        with tracing.span("auth.lookup"):
+            user_id = get_session_user_id(x_session_id)
+            user = users_collection.find_one({"user_id": user_id}, projection)
+            if not user:
+                raise HTTPException(status_code=401, detail="User not found")
+            if not user.get("is_active", True):
+                raise HTTPException(status_code=401, detail="Conta desativada")
+            return UserRecord(user, fields)
     
-    return user
+    return dependency
+
+get_current_user = current_user_with(*UserRecord.__slots__)
 
 @app.get("/")
 async def root():
     return {"message": "ClickEarn Pro API", "status": "running"}
 
+# Health probes
+_health = {"checked_at": None, "dependencies": {}}
+
+async def _probe(check) -> dict:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(check(), HEALTH_TIMEOUT_SECONDS)
+        result = {"ok": True}
+    except Exception as e:
+        result = {"ok": False, "error": str(e) or type(e).__name__}
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+async def _ping_mongo():
+    def ping():
+        with pymongo.timeout(HEALTH_TIMEOUT_SECONDS):
+            db.command("ping")
+    await asyncio.to_thread(ping)
+
+async def _ping_oauth():
+    # Any HTTP answer means the upstream is reachable; only 5xx counts as down
+    response = await http_client.head(f"https://{EMERGENT_AUTH_HOST}/")
+    if response.status_code >= 500:
+        raise RuntimeError(f"HTTP {response.status_code}")
+
+async def check_health():
+    mongo, oauth = await asyncio.gather(_probe(_ping_mongo), _probe(_ping_oauth))
+    _health["dependencies"] = {"mongo": mongo, "oauth": oauth}
+    _health["checked_at"] = time.time()
+
+async def health_check_loop():
+    while True:
+        await check_health()
+        await asyncio.sleep(HEALTH_CHECK_SECONDS)
+
+def install_drain_handler():
+    """On SIGTERM report not-ready for DRAIN_SECONDS, then let uvicorn shut down"""
+    if DRAIN_SECONDS <= 0 or threading.current_thread() is not threading.main_thread():
+        return lambda: None
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def start_draining(signum, frame):
+        global draining
+        if draining or not callable(previous):
+            signal.signal(signal.SIGTERM, previous)
+            signal.raise_signal(signum)
+            return
+        draining = True
+        loop.call_soon_threadsafe(loop.call_later, DRAIN_SECONDS, previous, signum, frame)
+
+    signal.signal(signal.SIGTERM, start_draining)
+    return lambda: signal.signal(signal.SIGTERM, previous)
+
+@app.get("/health/live")
+async def liveness():
+    # Answering at all means the event loop is responsive
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    # Served from the background check's cache; probes never touch Mongo
+    checked_at = _health["checked_at"]
+    stale = checked_at is None or time.time() - checked_at > 3 * HEALTH_CHECK_SECONDS + HEALTH_TIMEOUT_SECONDS
+    mongo_ok = _health["dependencies"].get("mongo", {}).get("ok", False)
+    ready = mongo_ok and not stale and not draining
+    if draining:
+        status = "draining"
+    elif ready:
+        status = "ready" if _health["dependencies"]["oauth"]["ok"] else "degraded"
+    else:
+        status = "unavailable"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": status,
+            "checked_at": datetime.fromtimestamp(checked_at).isoformat() if checked_at else None,
+            "dependencies": _health["dependencies"]
+        }
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Email/Phone Registration and Login
 @app.post("/api/auth/register")
-async def register_user(user_data: UserRegister):
+async def register_user(user_data: UserRegister, user_agent: Optional[str] = Header(None)):
     try:
         # Check if user already exists
         existing_user = None
@@ -173,7 +828,8 @@ async def register_user(user_data: UserRegister):
         users_collection.insert_one(new_user)
         
         # Create session
-        session_id = create_session(user_id)
+        session_id = create_session(user_id, user_agent)
+        app_logging.audit("auth.register", user_id=user_id, method="email_phone")
         
         return {
             "success": True,
@@ -195,7 +851,7 @@ async def register_user(user_data: UserRegister):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/auth/login")
-async def login_user(login_data: UserLogin):
+async def login_user(login_data: UserLogin, user_agent: Optional[str] = Header(None)):
     try:
         # Find user by email or phone
         user = None
@@ -205,16 +861,20 @@ async def login_user(login_data: UserLogin):
             user = users_collection.find_one({"phone": login_data.phone})
         
         if not user:
+            app_logging.audit("auth.login_failed", reason="unknown_user")
             raise HTTPException(status_code=401, detail="Usuário não encontrado")
         
         if not verify_password(login_data.password, user["password"]):
+            app_logging.audit("auth.login_failed", user_id=user["user_id"], reason="bad_password")
             raise HTTPException(status_code=401, detail="Senha incorreta")
         
         if not user.get("is_active", True):
+            app_logging.audit("auth.login_failed", user_id=user["user_id"], reason="inactive")
             raise HTTPException(status_code=401, detail="Conta desativada")
         
         # Create session
-        session_id = create_session(user["user_id"])
+        session_id = create_session(user["user_id"], user_agent, relogin=True)
+        app_logging.audit("auth.login", user_id=user["user_id"], method="email_phone")
         
         return {
             "success": True,
@@ -238,54 +898,43 @@ async def login_user(login_data: UserLogin):
 @app.post("/api/auth/send-code")
 async def send_verification_code(request: SendCodeRequest):
     try:
-        # Generate verification code
-        code = generate_verification_code()
+        code = verification.generate_code()
         
-        # Store code in database (expires in 5 minutes)
-        verification_data = {
-            "phone": request.phone,
-            "code": code,
-            "created_at": datetime.now(),
-            "expires_at": datetime.now() + timedelta(minutes=5),
-            "used": False
-        }
+        # Only a hash of the code is stored (expires in CODE_TTL_SECONDS)
+        code_store.issue(request.phone, code)
         
-        # Remove old codes for this phone
-        verification_codes_collection.delete_many({"phone": request.phone})
-        verification_codes_collection.insert_one(verification_data)
+        try:
+            sms_queue.enqueue(request.phone, f"ClickEarn Pro: seu código de verificação é {code}")
+        except sms.QueueFull:
+            raise HTTPException(status_code=503, detail="Serviço de SMS indisponível, tente novamente")
         
-        # In production, send SMS here
-        # For demo, we'll return the code (remove in production!)
-        return {
+        response = {
             "success": True,
-            "message": "Código enviado por SMS",
-            "demo_code": code  # Remove this in production!
+            "message": "Código enviado por SMS"
         }
+        # The stub provider delivers nothing, so local DEBUG runs get the code here
+        if query_monitor.DEBUG and sms.SMS_PROVIDER == "stub":
+            response["demo_code"] = code
+        return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/auth/verify-code")
 async def verify_phone_code(request: VerifyCodeRequest):
     try:
-        # Find verification code
-        verification = verification_codes_collection.find_one({
-            "phone": request.phone,
-            "code": request.code,
-            "used": False
-        })
+        outcome = code_store.check(request.phone, request.code)
         
-        if not verification:
-            raise HTTPException(status_code=400, detail="Código inválido")
+        if outcome == verification.LOCKED:
+            raise HTTPException(status_code=429, detail="Muitas tentativas. Solicite um novo código")
         
-        if datetime.now() > verification["expires_at"]:
+        if outcome == verification.EXPIRED:
             raise HTTPException(status_code=400, detail="Código expirado")
         
-        # Mark code as used
-        verification_codes_collection.update_one(
-            {"_id": verification["_id"]},
-            {"$set": {"used": True}}
-        )
+        if outcome != verification.VERIFIED:
+            raise HTTPException(status_code=400, detail="Código inválido")
         
         # Update user phone verification status
         users_collection.update_one(
@@ -303,6 +952,100 @@ async def verify_phone_code(request: VerifyCodeRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/auth/logout")
+async def logout_user(x_session_id: str = Header(None)):
+    if not x_session_id:
+        raise HTTPException(status_code=401, detail="Session ID required")
+    
+    if is_signed_session_token(x_session_id):
+        claims = decode_session_token(x_session_id)
+        if claims:
+            revoke_session_token(claims)
+            sessions_collection.update_one(
+                {"user_id": claims["sub"]},
+                {"$pull": {"devices": {"device_id": claims["jti"]}}}
+            )
+    else:
+        sessions_collection.update_one(
+            {"devices.session_id": x_session_id},
+            {"$pull": {"devices": {"session_id": x_session_id}}}
+        )
+    
+    return {
+        "success": True,
+        "message": "Logout realizado com sucesso"
+    }
+
+@app.get("/api/sessions")
+async def list_sessions(current_user = Depends(current_user_with()), x_session_id: str = Header(None)):
+    # Signed-token devices have no session_id; the caller's is the one named by its jti
+    current_device = None
+    if is_signed_session_token(x_session_id):
+        current_device = decode_session_token(x_session_id)["jti"]
+    
+    session = sessions_collection.find_one(
+        {"user_id": current_user.user_id},
+        {"_id": 0, "devices": 1}
+    )
+    now = datetime.now()
+    devices = [
+        {
+            "device_id": device["device_id"],
+            "device_name": device.get("device_name", ""),
+            "created_at": device["created_at"],
+            "expires_at": device["expires_at"],
+            "current": device["device_id"] == current_device if current_device else device["session_id"] == x_session_id
+        }
+        for device in (session or {}).get("devices", [])
+        if device["expires_at"] > now
+    ]
+    devices.sort(key=lambda device: device["created_at"], reverse=True)
+    return {"sessions": devices}
+
+@app.delete("/api/sessions")
+async def revoke_other_sessions(current_user = Depends(current_user_with()), x_session_id: str = Header(None)):
+    if is_signed_session_token(x_session_id):
+        claims = decode_session_token(x_session_id)
+        revoke_user_sessions(current_user.user_id, claims["iat"])
+        sessions_collection.update_one(
+            {"user_id": current_user.user_id},
+            {"$pull": {"devices": {"device_id": {"$ne": claims["jti"]}}}}
+        )
+    else:
+        sessions_collection.update_one(
+            {"user_id": current_user.user_id},
+            {"$pull": {"devices": {"session_id": {"$ne": x_session_id}}}}
+        )
+    
+    return {
+        "success": True,
+        "message": "Outras sessões encerradas com sucesso"
+    }
+
+@app.delete("/api/sessions/{device_id}")
+async def revoke_session(device_id: str, current_user = Depends(current_user_with()), x_session_id: str = Header(None)):
+    # Only the caller's own devices can be ended, in either session mode
+    session = sessions_collection.find_one_and_update(
+        {"user_id": current_user.user_id, "devices.device_id": device_id},
+        {"$pull": {"devices": {"device_id": device_id}}},
+        projection={"_id": 0, "devices": {"$elemMatch": {"device_id": device_id}}}
+    )
+    if session is None:
+        raise HTTPException(status_code=404, detail="Sessão não encontrada")
+    device = session["devices"][0]
+    if device.get("session_id") is None:
+        # A signed token: its jti is the device_id, and it stays valid until revoked
+        revoke_session_token({
+            "jti": device_id,
+            "sub": current_user.user_id,
+            "exp": int(device["expires_at"].timestamp())
+        })
+    
+    return {
+        "success": True,
+        "message": "Sessão encerrada com sucesso"
+    }
+
 # Emergent Auth (existing)
 @app.post("/api/auth/profile")
 async def authenticate_user(request: Request):
@@ -312,17 +1055,17 @@ async def authenticate_user(request: Request):
         if not session_id:
             raise HTTPException(status_code=400, detail="Session ID required")
         
-        # Call Emergent auth API
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_id}
+        # Call Emergent auth API over this worker's pooled client
+        with tracing.span("emergent.oauth.session_data", tracing.KIND_CLIENT, **{"server.address": EMERGENT_AUTH_HOST}):
+            response = await http_client.get(
+                f"https://{EMERGENT_AUTH_HOST}/auth/v1/env/oauth/session-data",
+                headers=tracing.inject_headers({"X-Session-ID": session_id})
             )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=401, detail="Invalid session")
-            
-            auth_data = response.json()
+        
+        if response.status_code != 200:
+            raise HTTPException(status_code=401, detail="Invalid session")
+        
+        auth_data = response.json()
         
         # Check if user exists
         existing_user = users_collection.find_one({"email": auth_data["email"]})
@@ -352,17 +1095,13 @@ async def authenticate_user(request: Request):
             user = existing_user
         
         # Create session
-        session_data = {
-            "session_id": session_id,
-            "user_id": user["user_id"],
-            "session_token": auth_data["session_token"],
-            "created_at": datetime.now(),
-            "expires_at": datetime.now() + timedelta(days=7)
-        }
-        
-        # Replace existing session if any
-        sessions_collection.delete_many({"user_id": user["user_id"]})
-        sessions_collection.insert_one(session_data)
+        add_session_device(
+            user["user_id"],
+            session_id,
+            request.headers.get("User-Agent"),
+            session_token=auth_data["session_token"]
+        )
+        app_logging.audit("auth.login", user_id=user["user_id"], method="google", new_user=not existing_user)
         
         return {
             "user": {
@@ -379,12 +1118,44 @@ async def authenticate_user(request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Dashboard payloads by user_id: (etag, payload), least recently used first
+_dashboard_cache = OrderedDict()
+
+def dashboard_etag(user_id: str, version: int, today, rules_version: str) -> str:
+    # Date and rules are part of the tag, so day rollover or new limits invalidate it without a write
+    return f'W/"{user_id}.{version}.{today:%Y%m%d}.{rules_version}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or etag[2:] in tags
+
 @app.get("/api/dashboard")
-async def get_dashboard(current_user = Depends(get_current_user)):
-    # Reset daily clicks if new day
+async def get_dashboard(response: Response, current_user = Depends(current_user_with(
+    "name", "email", "phone", "picture", "balance", "total_earned",
+    "clicks_today", "videos_today", "last_click_date", "last_video_date", "dashboard_version", "tier"
+)), if_none_match: Optional[str] = Header(None)):
+    ruleset = rules.current
     today = datetime.now().date()
-    last_click_date = current_user.get("last_click_date")
-    last_video_date = current_user.get("last_video_date")
+    etag = dashboard_etag(current_user.user_id, current_user.dashboard_version, today, ruleset.version)
+    # Per-session responses: caches must revalidate and key by the session header
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "X-Session-ID"}
+    
+    # Unchanged since the client's copy: one version comparison, no ledger reads
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=cache_headers)
+    
+    cached = _dashboard_cache.get(current_user.user_id)
+    metrics.record_cache_lookup("dashboard", cached is not None and cached[0] == etag)
+    if cached and cached[0] == etag:
+        _dashboard_cache.move_to_end(current_user.user_id)
+        response.headers.update(cache_headers)
+        return cached[1]
+    
+    # Reset daily clicks if new day
+    last_click_date = current_user.last_click_date
+    last_video_date = current_user.last_video_date
     
     updates = {}
     if last_click_date and last_click_date.date() != today:
@@ -393,153 +1164,412 @@ async def get_dashboard(current_user = Depends(get_current_user)):
         updates["videos_today"] = 0
         
     if updates:
-        users_collection.update_one(
-            {"user_id": current_user["user_id"]},
-            {"$set": updates}
+        updated_user = users_collection.find_one_and_update(
+            {"user_id": current_user.user_id},
+            {"$set": updates, "$inc": {"dashboard_version": 1}},
+            projection={"_id": 0, "dashboard_version": 1},
+            return_document=ReturnDocument.AFTER
         )
-        current_user.update(updates)
+        for field, value in updates.items():
+            setattr(current_user, field, value)
+        etag = dashboard_etag(current_user.user_id, updated_user["dashboard_version"], today, ruleset.version)
+        cache_headers["ETag"] = etag
     
-    # Get today's earnings
-    today_clicks = clicks_collection.count_documents({
-        "user_id": current_user["user_id"],
-        "created_at": {"$gte": datetime.combine(today, datetime.min.time())}
-    })
+    # Get today's earnings; amounts vary with the rules in force when each credit happened
+    today_totals = list(clicks_collection.aggregate([
+        {"$match": {
+            "user_id": current_user.user_id,
+            "created_at": {"$gte": datetime.combine(today, datetime.min.time())}
+        }},
+        {"$group": {"_id": None, "amount": {"$sum": "$amount"}}}
+    ]))
     
-    today_earnings = today_clicks * 0.5
+    today_earnings = round(today_totals[0]["amount"], 2) if today_totals else 0.0
     
     # Get recent activity
-    recent_clicks = list(clicks_collection.find(
-        {"user_id": current_user["user_id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(10))
+    recent_clicks = recent_activity(current_user)
     
-    return {
+    payload = {
         "user": {
-            "name": current_user["name"],
-            "email": current_user.get("email"),
-            "phone": current_user.get("phone"),
-            "picture": current_user.get("picture", "")
+            "name": current_user.name,
+            "email": current_user.email,
+            "phone": current_user.phone,
+            "picture": current_user.picture
         },
-        "balance": current_user["balance"],
-        "total_earned": current_user["total_earned"],
-        "clicks_today": current_user.get("clicks_today", 0),
-        "videos_today": current_user.get("videos_today", 0),
-        "clicks_remaining": max(0, 20 - current_user.get("clicks_today", 0)),
-        "videos_remaining": max(0, 10 - current_user.get("videos_today", 0)),
+        "balance": current_user.balance,
+        "total_earned": current_user.total_earned,
+        "clicks_today": current_user.clicks_today,
+        "videos_today": current_user.videos_today,
+        "clicks_remaining": max(0, ruleset.daily_limit(current_user.tier, "click") - current_user.clicks_today),
+        "videos_remaining": max(0, ruleset.daily_limit(current_user.tier, "video") - current_user.videos_today),
         "today_earnings": today_earnings,
         "recent_activity": recent_clicks
     }
+    
+    _dashboard_cache[current_user.user_id] = (etag, payload)
+    _dashboard_cache.move_to_end(current_user.user_id)
+    while len(_dashboard_cache) > DASHBOARD_CACHE_SIZE:
+        _dashboard_cache.popitem(last=False)
+    
+    response.headers.update(cache_headers)
+    return payload
 
 @app.post("/api/click")
-async def process_click(click_data: ClickData, current_user = Depends(get_current_user)):
+async def process_click(
+    click_data: ClickData,
+    response: Response,
+    current_user = Depends(current_user_with("clicks_today", "last_click_date", "tier")),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return run_idempotent(
+        current_user.user_id, idempotency_key, "click", click_data,
+        lambda: apply_click(click_data, current_user), response
+    )
+
+def reset_daily_counter(user_id: str, counter: str, date_field: str, now: datetime):
+    """Zero a daily counter last touched on an earlier day
+
+    The date guard makes this a no-op once any request has reset it today,
+    so it never wipes increments from a concurrent credit.
+    """
+    midnight = datetime.combine(now.date(), datetime.min.time())
+    users_collection.update_one(
+        {"user_id": user_id, "$or": [{date_field: {"$lt": midnight}}, {date_field: None}]},
+        {"$set": {counter: 0, date_field: now}, "$inc": {"dashboard_version": 1}}
+    )
+
+def apply_click(click_data: ClickData, current_user: UserRecord) -> dict:
+    # One timestamp for the ledger row and last_*_date, so readers can tell if a replica has the row
+    now = datetime.now()
+    ruleset = rules.current
+    daily_limit = ruleset.daily_limit(current_user.tier, "click")
+    amount = ruleset.reward(current_user.tier, "click", click_data.content_id, now.hour)
+    
     # Check daily limit
-    today = datetime.now().date()
-    last_click_date = current_user.get("last_click_date")
+    today = now.date()
+    last_click_date = current_user.last_click_date
     
     # Reset daily clicks if new day
     if not last_click_date or last_click_date.date() != today:
-        users_collection.update_one(
-            {"user_id": current_user["user_id"]},
-            {"$set": {"clicks_today": 0, "last_click_date": datetime.now()}}
-        )
-        current_user["clicks_today"] = 0
+        reset_daily_counter(current_user.user_id, "clicks_today", "last_click_date", now)
+        current_user.clicks_today = 0
     
-    if current_user.get("clicks_today", 0) >= 20:
+    if current_user.clicks_today >= daily_limit:
         raise HTTPException(status_code=400, detail="Limite diário de cliques atingido")
     
     # Process valid click
     click_record = {
         "click_id": str(uuid.uuid4()),
-        "user_id": current_user["user_id"],
+        "user_id": current_user.user_id,
         "content_id": click_data.content_id,
-        "amount": 0.5,
-        "created_at": datetime.now(),
+        "amount": amount,
+        "created_at": now,
         "ip_address": "127.0.0.1"  # In production, get real IP
     }
     
     clicks_collection.insert_one(click_record)
     
-    # Update user stats
-    new_balance = current_user["balance"] + 0.5
-    new_total = current_user["total_earned"] + 0.5
-    new_clicks = current_user.get("clicks_today", 0) + 1
-    
-    users_collection.update_one(
-        {"user_id": current_user["user_id"]},
+    # Update user stats; $inc so concurrent credits and withdrawals are never overwritten
+    updated_user = users_collection.find_one_and_update(
+        {"user_id": current_user.user_id},
         {
-            "$set": {
-                "balance": new_balance,
-                "total_earned": new_total,
-                "clicks_today": new_clicks,
-                "last_click_date": datetime.now()
-            }
-        }
+            "$set": {"last_click_date": now},
+            "$inc": {"balance": amount, "total_earned": amount, "clicks_today": 1, "dashboard_version": 1}
+        },
+        projection={"_id": 0, "balance": 1, "clicks_today": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    new_balance = updated_user["balance"]
+    new_clicks = updated_user["clicks_today"]
+    
+    app_logging.audit(
+        "credit.click", user_id=current_user.user_id, click_id=click_record["click_id"],
+        amount=amount, balance_before=new_balance - amount, balance_after=new_balance
     )
     
     return {
         "success": True,
-        "amount_earned": 0.5,
+        "amount_earned": amount,
         "new_balance": new_balance,
-        "clicks_remaining": max(0, 20 - new_clicks),
-        "message": "Clique válido! $0.50 adicionado ao seu saldo."
+        "clicks_remaining": max(0, daily_limit - new_clicks),
+        "message": f"Clique válido! ${amount:.2f} adicionado ao seu saldo."
     }
 
 @app.post("/api/video/complete")
-async def complete_video(video_data: VideoWatchData, current_user = Depends(get_current_user)):
+async def complete_video(
+    video_data: VideoWatchData,
+    response: Response,
+    current_user = Depends(current_user_with("videos_today", "last_video_date", "tier")),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return run_idempotent(
+        current_user.user_id, idempotency_key, "video", video_data,
+        lambda: apply_video_completion(video_data, current_user), response
+    )
+
+def apply_video_completion(video_data: VideoWatchData, current_user: UserRecord) -> dict:
+    # One timestamp for the ledger row and last_*_date, so readers can tell if a replica has the row
+    now = datetime.now()
+    ruleset = rules.current
+    daily_limit = ruleset.daily_limit(current_user.tier, "video")
+    amount = ruleset.reward(current_user.tier, "video", video_data.video_id, now.hour)
+    
     # Check daily limit
-    today = datetime.now().date()
-    last_video_date = current_user.get("last_video_date")
+    today = now.date()
+    last_video_date = current_user.last_video_date
     
     # Reset daily videos if new day
     if not last_video_date or last_video_date.date() != today:
-        users_collection.update_one(
-            {"user_id": current_user["user_id"]},
-            {"$set": {"videos_today": 0, "last_video_date": datetime.now()}}
-        )
-        current_user["videos_today"] = 0
+        reset_daily_counter(current_user.user_id, "videos_today", "last_video_date", now)
+        current_user.videos_today = 0
     
-    if current_user.get("videos_today", 0) >= 10:
+    if current_user.videos_today >= daily_limit:
         raise HTTPException(status_code=400, detail="Limite diário de vídeos atingido")
     
-    # Validate minimum watch duration (30 seconds for reward)
-    if video_data.watch_duration < 30:
-        raise HTTPException(status_code=400, detail="Vídeo deve ser assistido por pelo menos 30 segundos")
+    # Validate minimum watch duration
+    if video_data.watch_duration < ruleset.min_watch_seconds:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Vídeo deve ser assistido por pelo menos {ruleset.min_watch_seconds} segundos"
+        )
     
     # Process valid video completion
     video_record = {
         "video_id": video_data.video_id,
-        "user_id": current_user["user_id"],
+        "user_id": current_user.user_id,
         "watch_duration": video_data.watch_duration,
-        "amount": 0.25,
-        "created_at": datetime.now(),
+        "amount": amount,
+        "created_at": now,
         "ip_address": "127.0.0.1"
     }
     
     clicks_collection.insert_one(video_record)  # Reusing clicks collection for simplicity
     
-    # Update user stats
-    new_balance = current_user["balance"] + 0.25
-    new_total = current_user["total_earned"] + 0.25
-    new_videos = current_user.get("videos_today", 0) + 1
-    
-    users_collection.update_one(
-        {"user_id": current_user["user_id"]},
+    # Update user stats; $inc so concurrent credits and withdrawals are never overwritten
+    updated_user = users_collection.find_one_and_update(
+        {"user_id": current_user.user_id},
         {
-            "$set": {
-                "balance": new_balance,
-                "total_earned": new_total,
-                "videos_today": new_videos,
-                "last_video_date": datetime.now()
-            }
-        }
+            "$set": {"last_video_date": now},
+            "$inc": {"balance": amount, "total_earned": amount, "videos_today": 1, "dashboard_version": 1}
+        },
+        projection={"_id": 0, "balance": 1, "videos_today": 1},
+        return_document=ReturnDocument.AFTER
     )
+    new_balance = updated_user["balance"]
+    new_videos = updated_user["videos_today"]
     
+    app_logging.audit(
+        "credit.video", user_id=current_user.user_id, video_id=video_data.video_id,
+        amount=amount, balance_before=new_balance - amount, balance_after=new_balance
+    )
+    
+    return {
+        "success": True,
+        "amount_earned": amount,
+        "new_balance": new_balance,
+        "videos_remaining": max(0, daily_limit - new_videos),
+        "message": f"Vídeo assistido! ${amount:.2f} adicionado ao seu saldo."
+    }
+
+@app.post("/api/events/batch")
+async def process_event_batch(batch: EventBatch, current_user = Depends(current_user_with(
+    "balance", "clicks_today", "videos_today", "last_click_date", "last_video_date", "tier"
+))):
+    user_id = current_user.user_id
+    now = datetime.now()
+    today = now.date()
+    # One rules snapshot for the whole batch, even if a reload lands mid-request
+    ruleset = rules.current
+    tier = current_user.tier
+    click_limit = ruleset.daily_limit(tier, "click")
+    video_limit = ruleset.daily_limit(tier, "video")
+
+    # Daily counters restart when the last credit happened on another day
+    last_click_date = current_user.last_click_date
+    last_video_date = current_user.last_video_date
+    clicks_reset = not last_click_date or last_click_date.date() != today
+    videos_reset = not last_video_date or last_video_date.date() != today
+    clicks_used = 0 if clicks_reset else current_user.clicks_today
+    videos_used = 0 if videos_reset else current_user.videos_today
+
+    # Keys already in the ledger were written by an earlier attempt. Rows still
+    # marked credited: False belong to an attempt that stopped before crediting
+    # the user; this request finishes that attempt's batch instead of skipping it
+    keys = [event.idempotency_key for event in batch.events]
+    existing = {
+        row["idempotency_key"]: row for row in clicks_collection.find(
+            {"user_id": user_id, "idempotency_key": {"$in": keys}},
+            {"_id": 0, "idempotency_key": 1, "amount": 1, "credited": 1, "batch_id": 1}
+        )
+    }
+    batch_id = str(uuid.uuid4())
+    unfinished_batches = {}
+
+    results = []
+    records = []
+    seen_keys = set()
+    for index, event in enumerate(batch.events):
+        result = {
+            "index": index,
+            "idempotency_key": event.idempotency_key,
+            "type": event.type,
+            "status": "rejected",
+            "amount": 0.0
+        }
+        results.append(result)
+
+        if event.idempotency_key in seen_keys:
+            result["status"] = "duplicate"
+            continue
+        seen_keys.add(event.idempotency_key)
+        row = existing.get(event.idempotency_key)
+        if row is not None:
+            if row.get("credited", True):
+                result["status"] = "duplicate"
+            else:
+                result["status"] = "credited"
+                result["amount"] = row["amount"]
+                unfinished_batches.setdefault(row["batch_id"], []).append(result)
+            continue
+
+        if event.type == "click":
+            if not event.content_id:
+                result["detail"] = "content_id é obrigatório"
+                continue
+            if clicks_used >= click_limit:
+                result["detail"] = "Limite diário de cliques atingido"
+                continue
+            clicks_used += 1
+            record = {
+                "click_id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "content_id": event.content_id,
+                "amount": ruleset.reward(tier, "click", event.content_id, now.hour),
+                "created_at": now,
+                "ip_address": "127.0.0.1"
+            }
+        else:
+            if not event.video_id:
+                result["detail"] = "video_id é obrigatório"
+                continue
+            if videos_used >= video_limit:
+                result["detail"] = "Limite diário de vídeos atingido"
+                continue
+            if (event.watch_duration or 0) < ruleset.min_watch_seconds:
+                result["detail"] = f"Vídeo deve ser assistido por pelo menos {ruleset.min_watch_seconds} segundos"
+                continue
+            videos_used += 1
+            record = {
+                "video_id": event.video_id,
+                "user_id": user_id,
+                "watch_duration": event.watch_duration,
+                "amount": ruleset.reward(tier, "video", event.video_id, now.hour),
+                "created_at": now,
+                "ip_address": "127.0.0.1"
+            }
+
+        record["idempotency_key"] = event.idempotency_key
+        record["batch_id"] = batch_id
+        record["credited"] = False
+        result["status"] = "credited"
+        result["amount"] = record["amount"]
+        records.append((result, record))
+
+    if records:
+        try:
+            clicks_collection.bulk_write(
+                [InsertOne(record) for _, record in records],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            # Unordered: every other row is already in the ledger and still gets its
+            # balance credit below. A duplicate key means a concurrent retry inserted
+            # the same key first and owns the credit; any other error fails only that
+            # event, which the client can resend with the same key
+            for error in e.details.get("writeErrors", []):
+                result, record = records[error["index"]]
+                if error.get("code") == 11000:
+                    result["status"] = "duplicate"
+                else:
+                    result["status"] = "failed"
+                    result["detail"] = "Falha ao registrar evento, tente novamente"
+                result["amount"] = 0.0
+                if "click_id" in record:
+                    clicks_used -= 1
+                else:
+                    videos_used -= 1
+
+    # This request's rows, then the rows of any earlier attempt it is finishing
+    credited = [(result, record) for result, record in records if result["status"] == "credited"]
+    credits = [(batch_id, [record for _, record in credited], [result for result, _ in credited])]
+    for earlier_batch, batch_results in unfinished_batches.items():
+        rows = list(clicks_collection.find(
+            {"user_id": user_id, "batch_id": earlier_batch, "credited": False},
+            {"_id": 0, "click_id": 1, "amount": 1, "idempotency_key": 1}
+        ))
+        credits.append((earlier_batch, rows, batch_results))
+
+    amount = 0.0
+    new_balance = current_user.balance
+    for credit_batch_id, rows, batch_results in credits:
+        if not rows:
+            continue
+        batch_amount = sum(row["amount"] for row in rows)
+        batch_clicks = sum(1 for row in rows if "click_id" in row)
+        batch_videos = len(rows) - batch_clicks
+        if batch_clicks and clicks_reset:
+            reset_daily_counter(user_id, "clicks_today", "last_click_date", now)
+        if batch_videos and videos_reset:
+            reset_daily_counter(user_id, "videos_today", "last_video_date", now)
+
+        inc = {"balance": batch_amount, "total_earned": batch_amount, "dashboard_version": 1}
+        update = {
+            "$inc": inc,
+            "$set": {},
+            "$push": {"credited_batches": {"$each": [credit_batch_id], "$slice": -CREDITED_BATCH_HISTORY}}
+        }
+        if batch_clicks:
+            inc["clicks_today"] = batch_clicks
+            update["$set"]["last_click_date"] = now
+        if batch_videos:
+            inc["videos_today"] = batch_videos
+            update["$set"]["last_video_date"] = now
+        # The filter credits each batch once, even when two retries finish it concurrently
+        updated_user = users_collection.find_one_and_update(
+            {"user_id": user_id, "credited_batches": {"$ne": credit_batch_id}},
+            update,
+            projection={"_id": 0, "balance": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        clicks_collection.update_many(
+            {"user_id": user_id, "batch_id": credit_batch_id, "credited": False},
+            {"$set": {"credited": True}}
+        )
+        if updated_user is None:
+            for result in batch_results:
+                result["status"] = "duplicate"
+                result["amount"] = 0.0
+            continue
+
+        amount += batch_amount
+        new_balance = updated_user["balance"]
+        if credit_batch_id != batch_id:
+            clicks_used += batch_clicks
+            videos_used += batch_videos
+        app_logging.audit(
+            "credit.batch", user_id=user_id, batch_id=credit_batch_id, amount=batch_amount,
+            clicks=batch_clicks, videos=batch_videos,
+            idempotency_keys=[row["idempotency_key"] for row in rows],
+            balance_before=new_balance - batch_amount, balance_after=new_balance
+        )
+
     return {
         "success": True,
-        "amount_earned": 0.25,
+        "amount_earned": amount,
         "new_balance": new_balance,
-        "videos_remaining": max(0, 10 - new_videos),
-        "message": "Vídeo assistido! $0.25 adicionado ao seu saldo."
+        "clicks_remaining": max(0, click_limit - clicks_used),
+        "videos_remaining": max(0, video_limit - videos_used),
+        "results": results
     }
 
 @app.get("/api/videos")
@@ -551,7 +1581,6 @@ async def get_videos():
             "title": "Anúncio - Produto Incrível",
             "duration": 30,
             "thumbnail": "https://images.unsplash.com/photo-1560472354-b33ff0c44a43?w=300&h=200&fit=crop",
-            "earnings": 0.25,
             "description": "Assista este vídeo promocional por 30 segundos"
         },
         {
@@ -559,7 +1588,6 @@ async def get_videos():
             "title": "Anúncio - Serviço Premium",
             "duration": 45,
             "thumbnail": "https://images.unsplash.com/photo-1551650975-87deedd944c3?w=300&h=200&fit=crop",
-            "earnings": 0.25,
             "description": "Vídeo publicitário de 45 segundos"
         },
         {
@@ -567,34 +1595,104 @@ async def get_videos():
             "title": "Anúncio - App Mobile",
             "duration": 60,
             "thumbnail": "https://images.unsplash.com/photo-1512941937669-90a1b58e7e9c?w=300&h=200&fit=crop",
-            "earnings": 0.25,
             "description": "Descubra este novo aplicativo"
         }
     ]
     
+    # Earnings shown are the standard tier's for the current hour
+    ruleset = rules.current
+    hour = datetime.now().hour
+    for video in videos:
+        video["earnings"] = ruleset.reward(rules.DEFAULT_TIER, "video", video["id"], hour)
+    
     return {"videos": videos}
 
+def recent_activity(current_user: UserRecord) -> list:
+    """The user's 10 newest ledger rows, from a secondary when it already has the latest credit"""
+    query = {"user_id": current_user.user_id}
+    rows = list(clicks_history_collection.find(query, {"_id": 0}).sort("created_at", -1).limit(10))
+    # Credits write created_at and last_*_date with one timestamp; a replica missing
+    # that row would otherwise be cached under the new dashboard_version
+    last_credit = max(filter(None, (current_user.last_click_date, current_user.last_video_date)), default=None)
+    if last_credit and (not rows or rows[0]["created_at"] < last_credit):
+        rows = list(clicks_collection.find(query, {"_id": 0}).sort("created_at", -1).limit(10))
+    return rows
+
+async def history_with_archive(collection, user_id: str, since: Optional[datetime], until: Optional[datetime]) -> list:
+    """A user's rows in [since, until), newest first; archived partitions only with an explicit since"""
+    query = {"user_id": user_id}
+    created_at = {}
+    if since:
+        created_at["$gte"] = since
+    if until:
+        created_at["$lt"] = until
+    if created_at:
+        query["created_at"] = created_at
+    
+    rows = list(collection.find(query, {"_id": 0}).sort("created_at", -1))
+    # Open-ended requests stay on the rows still in Mongo; only a since past the
+    # archive watermark opens Parquet files, off the event loop
+    if since is None:
+        return rows
+    archived = await asyncio.to_thread(archive.read_archived, collection.name, user_id, since, until)
+    if archived:
+        rows.extend(archived)
+        rows.sort(key=lambda row: row["created_at"], reverse=True)
+    return rows
+
 @app.get("/api/withdraw-history")
-async def get_withdraw_history(current_user = Depends(get_current_user)):
-    withdrawals = list(withdrawals_collection.find(
-        {"user_id": current_user["user_id"]},
-        {"_id": 0}
-    ).sort("created_at", -1))
+async def get_withdraw_history(
+    current_user = Depends(current_user_with()),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    withdrawals = await history_with_archive(withdrawals_history_collection, current_user.user_id, since, until)
     
     return {"withdrawals": withdrawals}
 
+@app.get("/api/activity-history")
+async def get_activity_history(
+    current_user = Depends(current_user_with()),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    # Export of every click and video credit in the range, archived ones included
+    activity = await history_with_archive(clicks_history_collection, current_user.user_id, since, until)
+    
+    return {"activity": activity}
+
 @app.post("/api/withdraw")
-async def request_withdrawal(withdraw_data: WithdrawRequest, current_user = Depends(get_current_user)):
-    if withdraw_data.amount < 10:
-        raise HTTPException(status_code=400, detail="Valor mínimo de saque é $10.00")
+async def request_withdrawal(
+    withdraw_data: WithdrawRequest,
+    response: Response,
+    current_user = Depends(current_user_with()),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return run_idempotent(
+        current_user.user_id, idempotency_key, "withdraw", withdraw_data,
+        lambda: apply_withdrawal(withdraw_data, current_user), response
+    )
+
+def apply_withdrawal(withdraw_data: WithdrawRequest, current_user: UserRecord) -> dict:
+    min_withdrawal = rules.current.min_withdrawal
+    if withdraw_data.amount < min_withdrawal:
+        raise HTTPException(status_code=400, detail=f"Valor mínimo de saque é ${min_withdrawal:.2f}")
     
-    if withdraw_data.amount > current_user["balance"]:
+    # Debit first, guarded on the current balance, so concurrent withdrawals cannot overdraw
+    updated_user = users_collection.find_one_and_update(
+        {"user_id": current_user.user_id, "balance": {"$gte": withdraw_data.amount}},
+        {"$inc": {"balance": -withdraw_data.amount, "dashboard_version": 1}},
+        projection={"_id": 0, "balance": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_user is None:
         raise HTTPException(status_code=400, detail="Saldo insuficiente")
+    new_balance = updated_user["balance"]
     
     # Create withdrawal request
     withdrawal_record = {
         "withdrawal_id": str(uuid.uuid4()),
-        "user_id": current_user["user_id"],
+        "user_id": current_user.user_id,
         "amount": withdraw_data.amount,
         "paypal_email": withdraw_data.paypal_email,
         "status": "pending",
@@ -602,13 +1700,19 @@ async def request_withdrawal(withdraw_data: WithdrawRequest, current_user = Depe
         "processed_at": None
     }
     
-    withdrawals_collection.insert_one(withdrawal_record)
+    try:
+        withdrawals_collection.insert_one(withdrawal_record)
+    except Exception:
+        # Give the debit back; the request can be retried
+        users_collection.update_one(
+            {"user_id": current_user.user_id},
+            {"$inc": {"balance": withdraw_data.amount, "dashboard_version": 1}}
+        )
+        raise
     
-    # Update user balance
-    new_balance = current_user["balance"] - withdraw_data.amount
-    users_collection.update_one(
-        {"user_id": current_user["user_id"]},
-        {"$set": {"balance": new_balance}}
+    app_logging.audit(
+        "withdrawal.requested", user_id=current_user.user_id, withdrawal_id=withdrawal_record["withdrawal_id"],
+        amount=withdraw_data.amount, balance_before=new_balance + withdraw_data.amount, balance_after=new_balance
     )
     
     return {
@@ -626,34 +1730,83 @@ async def get_content():
             "id": "content_1",
             "title": "Artigo sobre Tecnologia",
             "description": "Descubra as últimas tendências em tecnologia",
-            "image": "https://images.unsplash.com/photo-1518709268805-4e9042af2176?w=300&h=200&fit=crop",
-            "earnings": 0.5
+            "image": "https://images.unsplash.com/photo-1518709268805-4e9042af2176?w=300&h=200&fit=crop"
         },
         {
             "id": "content_2", 
             "title": "Dicas de Investimento",
             "description": "Como investir seu dinheiro de forma inteligente",
-            "image": "https://images.unsplash.com/photo-1559526324-593bc073d938?w=300&h=200&fit=crop",
-            "earnings": 0.5
+            "image": "https://images.unsplash.com/photo-1559526324-593bc073d938?w=300&h=200&fit=crop"
         },
         {
             "id": "content_3",
             "title": "Saúde e Bem-estar",
             "description": "Mantenha-se saudável com essas dicas",
-            "image": "https://images.unsplash.com/photo-1571019613454-1cb2f99b2d8b?w=300&h=200&fit=crop",
-            "earnings": 0.5
+            "image": "https://images.unsplash.com/photo-1571019613454-1cb2f99b2d8b?w=300&h=200&fit=crop"
         },
         {
             "id": "content_4",
             "title": "Receitas Deliciosas",
             "description": "Aprenda a fazer pratos incríveis",
-            "image": "https://images.unsplash.com/photo-1567620905732-2d1ec7ab7445?w=300&h=200&fit=crop",
-            "earnings": 0.5
+            "image": "https://images.unsplash.com/photo-1567620905732-2d1ec7ab7445?w=300&h=200&fit=crop"
         }
     ]
     
+    ruleset = rules.current
+    hour = datetime.now().hour
+    for item in content_items:
+        item["earnings"] = ruleset.reward(rules.DEFAULT_TIER, "click", item["id"], hour)
+    
     return {"content": content_items}
 
+def require_admin(x_admin_token: str = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Acesso negado")
+
+def stream_bulk_operation(operation_id: str) -> StreamingResponse:
+    """NDJSON progress, one line per chunk; a dropped connection leaves the operation resumable"""
+    async def lines():
+        progress = bulk_ops.run_operation(db, operation_id)
+        while True:
+            update = await asyncio.to_thread(next, progress, None)
+            if update is None:
+                break
+            yield json.dumps(update) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/api/admin/bulk", dependencies=[Depends(require_admin)])
+async def start_bulk_operation(request: BulkOperationRequest):
+    try:
+        operation = await asyncio.to_thread(
+            bulk_ops.create_operation, db, request.kind, request.user_ids, request.filter,
+            request.amount, request.reason, "api"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return stream_bulk_operation(operation["operation_id"])
+
+@app.post("/api/admin/bulk/{operation_id}/resume", dependencies=[Depends(require_admin)])
+async def resume_bulk_operation(operation_id: str):
+    if not bulk_ops.get_operation(db, operation_id):
+        raise HTTPException(status_code=404, detail="Operação não encontrada")
+    return stream_bulk_operation(operation_id)
+
+@app.get("/api/admin/bulk/{operation_id}", dependencies=[Depends(require_admin)])
+async def get_bulk_operation(operation_id: str):
+    operation = bulk_ops.get_operation(db, operation_id)
+    if not operation:
+        raise HTTPException(status_code=404, detail="Operação não encontrada")
+    return bulk_ops.progress(operation)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    # Each worker is a fresh process that imports this module and runs lifespan;
+    # on SIGTERM uvicorn stops accepting and lets in-flight requests finish
+    uvicorn.run(
+        "server:app",
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', 8001)),
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=SHUTDOWN_GRACE_SECONDS
+    )
\ No newline at end of file
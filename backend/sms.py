@@ -0,0 +1,112 @@
+"""
+Background SMS dispatch.
+
+Endpoints call SmsQueue.enqueue() and return at once. The worker task
+(SmsQueue.run, started in the lifespan handler) waits up to
+SMS_BATCH_WAIT_SECONDS for more messages and hands them to the provider
+in batches of up to SMS_BATCH_SIZE. A failed batch is retried
+SMS_MAX_RETRIES times with exponential backoff, then dropped and logged.
+The user can always request another code.
+
+Providers implement `async send_batch(messages)`. SMS_PROVIDER selects
+one. "stub" (the default) only logs and keeps the last messages in
+memory, for local runs and tests. While it is active and DEBUG is set,
+/api/auth/send-code also returns the code so the demo flow works without
+a phone.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from datetime import datetime
+
+SMS_PROVIDER = os.environ.get('SMS_PROVIDER', 'stub')
+SMS_BATCH_SIZE = int(os.environ.get('SMS_BATCH_SIZE', 50))
+SMS_BATCH_WAIT_SECONDS = float(os.environ.get('SMS_BATCH_WAIT_SECONDS', 0.2))
+SMS_QUEUE_SIZE = int(os.environ.get('SMS_QUEUE_SIZE', 10000))
+SMS_MAX_RETRIES = int(os.environ.get('SMS_MAX_RETRIES', 3))
+
+logger = logging.getLogger("clickearn.sms")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class StubSmsProvider:
+    """Logs messages instead of sending them; keeps the latest for inspection"""
+
+    def __init__(self, keep: int = 1000):
+        self.sent = deque(maxlen=keep)
+
+    async def send_batch(self, messages: list):
+        for message in messages:
+            logger.info("SMS to %s: %s", message["to"], message["body"])
+            self.sent.append(message)
+
+
+PROVIDERS = {
+    "stub": StubSmsProvider,
+}
+
+
+def create_provider():
+    try:
+        return PROVIDERS[SMS_PROVIDER]()
+    except KeyError:
+        raise RuntimeError(f"Unknown SMS_PROVIDER {SMS_PROVIDER!r}") from None
+
+
+class SmsQueue:
+    def __init__(self, provider, batch_size: int = SMS_BATCH_SIZE, batch_wait: float = SMS_BATCH_WAIT_SECONDS,
+                 max_size: int = SMS_QUEUE_SIZE):
+        self.provider = provider
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_size = max_size
+        self._pending = deque()
+        # Created by run(), so the queue can be built before any event loop exists
+        self._wakeup = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def enqueue(self, to: str, body: str):
+        """Queue a message without waiting for delivery; raises QueueFull when backed up"""
+        if len(self._pending) >= self.max_size:
+            raise QueueFull()
+        self._pending.append({"to": to, "body": body, "queued_at": datetime.now()})
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _deliver(self, batch: list):
+        for attempt in range(SMS_MAX_RETRIES + 1):
+            try:
+                await self.provider.send_batch(batch)
+                return
+            except Exception as e:
+                if attempt == SMS_MAX_RETRIES:
+                    logger.error("Dropping %d SMS after %d attempts: %s", len(batch), attempt + 1, e)
+                    return
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def flush(self):
+        """Deliver everything queued so far"""
+        while self._pending:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            await self._deliver(batch)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                if not self._pending:
+                    await self._wakeup.wait()
+                self._wakeup.clear()
+                # Give a burst of requests a moment to share one provider call
+                if len(self._pending) < self.batch_size:
+                    await asyncio.sleep(self.batch_wait)
+                await self.flush()
+        finally:
+            self._wakeup = None
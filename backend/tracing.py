@@ -0,0 +1,352 @@
+"""
+Lightweight request tracing with a local OTLP-JSON file exporter.
+
+TracingMiddleware opens a server span per request. It continues the
+trace from an incoming W3C "traceparent" header when there is one,
+otherwise it starts a new trace sampled at TRACE_SAMPLE_RATE. It also
+returns a traceparent header in the response. Child spans come from:
+
+- span(), for code blocks such as the auth lookup or the Emergent call
+- TracingMongoListener, one span per Mongo command
+- TracedJSONResponse, for response serialization
+
+Finished spans go onto a queue. A background thread batches them and
+appends one OTLP/JSON ExportTraceServiceRequest per line to
+TRACE_DIR/traces-YYYYMMDD.jsonl, so no collector is needed. Unsampled
+requests create no span objects. A batch that cannot be written is logged
+and counted in exporter.dropped; the thread keeps running, and flush()
+gives up after TRACE_FLUSH_TIMEOUT_SECONDS so shutdown never hangs on it.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+from fastapi.responses import JSONResponse
+from pymongo import monitoring
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+TRACE_DIR = os.environ.get('TRACE_DIR', '/tmp/clickearn-traces')
+TRACE_BATCH_SIZE = int(os.environ.get('TRACE_BATCH_SIZE', 512))
+TRACE_FLUSH_SECONDS = float(os.environ.get('TRACE_FLUSH_SECONDS', 2))
+TRACE_QUEUE_SIZE = int(os.environ.get('TRACE_QUEUE_SIZE', 10000))
+TRACE_FLUSH_TIMEOUT_SECONDS = float(os.environ.get('TRACE_FLUSH_TIMEOUT_SECONDS', 5))
+SERVICE_NAME = os.environ.get('SERVICE_NAME', 'clickearn-pro-api')
+
+TRACING_ENABLED = TRACE_SAMPLE_RATE > 0
+
+logger = logging.getLogger("clickearn.tracing")
+
+# OTLP SpanKind values
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "kind",
+        "start_ns", "end_ns", "attributes", "status"
+    )
+
+    def __init__(self, trace_id: str, parent_id: str, name: str, kind: int = KIND_INTERNAL, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.status = 0
+
+    def end(self, error: bool = False):
+        self.end_ns = time.time_ns()
+        self.status = STATUS_ERROR if error else STATUS_OK
+        exporter.submit(self)
+
+    def child(self, name: str, kind: int = KIND_INTERNAL, attributes=None) -> "Span":
+        return Span(self.trace_id, self.span_id, name, kind, attributes)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _attribute_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span: Span) -> dict:
+    otlp = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _attribute_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": span.status},
+    }
+    if span.parent_id:
+        otlp["parentSpanId"] = span.parent_id
+    return otlp
+
+
+class BatchFileExporter:
+    """Queues finished spans and writes them in batches from a daemon thread"""
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, span: Span):
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            # Tracing is best effort; never make a request wait on it
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # A None entry is a flush() marker and closes the batch early
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + TRACE_FLUSH_SECONDS
+            while batch[-1] is not None and len(batch) < TRACE_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            spans = [span for span in batch if span is not None]
+            try:
+                self._write(spans)
+            except Exception:
+                # Disk full, permissions, an unserializable attribute: lose this batch, not the thread
+                self.dropped += len(spans)
+                logger.exception("Dropping %d spans", len(spans))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, spans: list):
+        if not spans:
+            return
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "clickearn.tracing"}, "spans": [_otlp_span(s) for s in spans]}],
+            }]
+        }
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        path = os.path.join(TRACE_DIR, f"traces-{datetime.now().strftime('%Y%m%d')}.jsonl")
+        with open(path, "a") as f:
+            f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+
+    def flush(self, timeout: float = TRACE_FLUSH_TIMEOUT_SECONDS) -> bool:
+        """Wait up to timeout for queued spans to be written; False if they were not"""
+        if self._thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return False
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+
+exporter = BatchFileExporter()
+
+
+class _NoSpan:
+    """Context manager used when the current request is not being traced"""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """Child span of the current span, or a no-op when the request is not traced"""
+    parent = current_span.get()
+    if parent is None:
+        return _NO_SPAN
+    return _ActiveSpan(parent.child(name, kind, attributes))
+
+
+class _ActiveSpan:
+    """Makes a child span current for the duration of a with block"""
+
+    __slots__ = ("span", "token")
+
+    def __init__(self, child: Span):
+        self.span = child
+
+    def __enter__(self):
+        self.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        current_span.reset(self.token)
+        self.span.end(error=exc_type is not None)
+        return False
+
+
+def inject_headers(headers: dict) -> dict:
+    """Add the current traceparent to outgoing request headers"""
+    parent = current_span.get()
+    if parent is not None:
+        headers["traceparent"] = parent.traceparent
+    return headers
+
+
+def _parse_traceparent(value: str):
+    parts = value.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        sampled = int(parts[3], 16) & 1 == 1
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+class TracedJSONResponse(JSONResponse):
+    """JSONResponse that records rendering as a serialization span"""
+
+    def render(self, content) -> bytes:
+        with span("serialize") as current:
+            body = super().render(content)
+            if current is not None:
+                current.attributes["http.response.body.size"] = len(body)
+            return body
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a server span per sampled request"""
+
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                parent = _parse_traceparent(value.decode("latin-1"))
+                break
+
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = None, ""
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        server_span = Span(trace_id or f"{random.getrandbits(128):032x}", parent_id, scope["path"], KIND_SERVER, {
+            "http.request.method": scope["method"],
+            "url.path": scope["path"],
+        })
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"traceparent", server_span.traceparent.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = current_span.set(server_span)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                server_span.name = f"{scope['method']} {route.path}"
+                server_span.attributes["http.route"] = route.path
+            server_span.attributes["http.response.status_code"] = status
+            server_span.end(error=status >= 500)
+
+
+class TracingMongoListener(monitoring.CommandListener):
+    """Records each Mongo command as a client span of the current request"""
+
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        parent = current_span.get()
+        if parent is None:
+            return
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+        self.pending[(event.connection_id, event.request_id)] = parent.child(
+            f"mongo.{event.command_name}", KIND_CLIENT, {
+                "db.system": "mongodb",
+                "db.name": event.database_name,
+                "db.operation": event.command_name,
+                "db.mongodb.collection": collection,
+            }
+        )
+
+    def succeeded(self, event):
+        child = self.pending.pop((event.connection_id, event.request_id), None)
+        if child is not None:
+            child.end()
+
+    def failed(self, event):
+        child = self.pending.pop((event.connection_id, event.request_id), None)
+        if child is not None:
+            child.attributes["error.message"] = str(event.failure.get("errmsg", ""))
+            child.end(error=True)
@@ -0,0 +1,195 @@
+"""
+Opt-in capture of sanitized production traffic for replay benchmarks.
+
+CaptureMiddleware writes one JSON line per request to
+CAPTURE_DIR/capture.<pid>.jsonl, one file per worker. It uses app_logging's
+BatchingFileHandler, so the request only enqueues a record. Each line holds:
+
+- the method, path, route template and query string
+- the start time (epoch seconds), duration and status
+- the sanitized JSON body
+- pseudonymous session, user, bulk operation and Idempotency-Key ids
+
+Credentials and contact details are never written: the fields in
+REDACTED_FIELDS are replaced by a placeholder. Session ids and the fields
+in PSEUDONYMIZED_FIELDS (user ids, bulk operation ids, idempotency keys)
+become BLAKE2 digests keyed with CAPTURE_SALT, which is required whenever
+capture is on. Identifier fields are pseudonymized wherever they appear:
+in bodies, inside admin bulk filters such as {"user_id": {"$in": [...]}},
+and in path parameters. The replayer can then keep one journey per
+session, and retries stay retries, without the capture holding a usable
+token or a real account id.
+
+Sessions are sampled as a whole at CAPTURE_SAMPLE_RATE (0 disables
+capture) by hashing their id, so a captured journey is complete. For
+login and register the session id comes from the response body.
+
+tests/replay_traffic.py re-drives a capture against a local server.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+
+import app_logging
+
+CAPTURE_SAMPLE_RATE = float(os.environ.get('CAPTURE_SAMPLE_RATE', 0))
+CAPTURE_DIR = os.environ.get('CAPTURE_DIR', '/tmp/clickearn-captures')
+CAPTURE_SALT = os.environ.get('CAPTURE_SALT')
+CAPTURE_MAX_BODY_BYTES = int(os.environ.get('CAPTURE_MAX_BODY_BYTES', 64 * 1024))
+CAPTURE_QUEUE_SIZE = int(os.environ.get('CAPTURE_QUEUE_SIZE', 10000))
+
+CAPTURE_ENABLED = CAPTURE_SAMPLE_RATE > 0
+
+# Unkeyed digests of session ids could be matched against guessed ids
+if CAPTURE_ENABLED and not CAPTURE_SALT:
+    raise RuntimeError("CAPTURE_SALT is required when CAPTURE_SAMPLE_RATE > 0")
+
+REDACTED = "<redacted>"
+REDACTED_FIELDS = {"password", "email", "phone", "paypal_email", "name", "code", "session_token", "picture"}
+PSEUDONYMIZED_FIELDS = {"idempotency_key", "user_id", "user_ids", "operation_id"}
+
+# Routes whose response body carries the new session (and user) id
+SESSION_ISSUING_ROUTES = {"/api/auth/register", "/api/auth/login"}
+
+capture_logger = logging.getLogger("clickearn.capture")
+capture_handler = app_logging.BatchingFileHandler(
+    os.path.join(CAPTURE_DIR, "capture.jsonl"), maxsize=CAPTURE_QUEUE_SIZE
+)
+capture_logger.addHandler(capture_handler)
+capture_logger.setLevel(logging.INFO)
+capture_logger.propagate = False
+
+
+def pseudonym(value: str) -> str:
+    return hashlib.blake2b(value.encode(), digest_size=8, key=(CAPTURE_SALT or '').encode()[:64]).hexdigest()
+
+
+def sampled(session_hash: str) -> bool:
+    return int(session_hash, 16) < CAPTURE_SAMPLE_RATE * 2 ** 64
+
+
+def _pseudonymize(value):
+    """Every string inside an identifier field's value, e.g. a list of ids or a $in filter"""
+    if isinstance(value, str):
+        return pseudonym(value)
+    if isinstance(value, dict):
+        return {key: _pseudonymize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_pseudonymize(item) for item in value]
+    return value
+
+
+def sanitize(value):
+    """Copy of a JSON body with credentials redacted and identifiers pseudonymized"""
+    if isinstance(value, dict):
+        clean = {}
+        for key, item in value.items():
+            if key in REDACTED_FIELDS and item is not None:
+                clean[key] = REDACTED
+            elif key in PSEUDONYMIZED_FIELDS:
+                clean[key] = _pseudonymize(item)
+            else:
+                clean[key] = sanitize(item)
+        return clean
+    if isinstance(value, list):
+        return [sanitize(item) for item in value]
+    return value
+
+
+def sanitize_path(path: str, path_params: dict) -> str:
+    """The request path with identifier path parameters pseudonymized"""
+    for name, value in path_params.items():
+        if name in PSEUDONYMIZED_FIELDS and isinstance(value, str) and value:
+            path = path.replace(value, pseudonym(value))
+    return path
+
+
+def _parse_json(body: bytes):
+    if not body or len(body) > CAPTURE_MAX_BODY_BYTES:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def flush():
+    capture_handler.flush()
+
+
+class CaptureMiddleware:
+    """ASGI middleware recording sampled sessions as replayable JSON lines"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        session_id = headers.get(b"x-session-id")
+        session = pseudonym(session_id.decode("latin-1")) if session_id else None
+        issues_session = scope["path"] in SESSION_ISSUING_ROUTES
+        if session is not None and not sampled(session):
+            await self.app(scope, receive, send)
+            return
+        if session is None and not issues_session and random.random() >= CAPTURE_SAMPLE_RATE:
+            await self.app(scope, receive, send)
+            return
+
+        request_body = []
+        response_body = []
+        status = 500
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                request_body.append(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and issues_session:
+                response_body.append(message.get("body", b""))
+            await send(message)
+
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            record = {
+                "started_at": started_at,
+                "method": scope["method"],
+                "path": sanitize_path(scope["path"], scope.get("path_params", {})),
+                "route": scope["route"].path if scope.get("route") is not None else None,
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status,
+                "duration_ms": duration_ms,
+                "session": session,
+                "body": sanitize(_parse_json(b"".join(request_body))),
+            }
+            idempotency_key = headers.get(b"idempotency-key")
+            if idempotency_key:
+                record["idempotency_key"] = pseudonym(idempotency_key.decode("latin-1"))
+
+            keep = True
+            if issues_session:
+                issued = _parse_json(b"".join(response_body)) or {}
+                if issued.get("session_id"):
+                    record["issued_session"] = pseudonym(issued["session_id"])
+                    record["user"] = pseudonym(issued["user"]["user_id"])
+                    keep = sampled(record["issued_session"])
+                else:
+                    keep = random.random() < CAPTURE_SAMPLE_RATE
+            if keep:
+                capture_logger.info("request", extra={"fields": record})
@@ -0,0 +1,151 @@
+"""
+Phone verification code stores.
+
+A store keeps at most one live code per phone, as an HMAC of phone and
+code, never the code itself. Each code expires after CODE_TTL_SECONDS and
+allows MAX_CODE_ATTEMPTS wrong guesses. After that it is burned and a new
+code must be requested.
+
+- MemoryCodeStore: a dict in this process. Checking a code costs no I/O.
+  It only works when one worker serves every request for a phone.
+- MongoCodeStore: the verification_codes collection, shared by every
+  worker. An issue is one upsert instead of a delete and an insert. A
+  successful check is one find_one_and_update that also marks the code
+  used, so it cannot be redeemed twice.
+
+VERIFICATION_STORE picks one: "memory", "mongo", or "auto" (default). Auto
+means memory with a single worker and mongo with WEB_CONCURRENCY > 1.
+Codes are keyed with VERIFICATION_CODE_KEY, falling back to
+SESSION_SECRET; one of them is required. Every worker must share the key.
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+VERIFICATION_STORE = os.environ.get('VERIFICATION_STORE', 'auto')
+CODE_TTL_SECONDS = int(os.environ.get('CODE_TTL_SECONDS', 300))
+MAX_CODE_ATTEMPTS = int(os.environ.get('MAX_CODE_ATTEMPTS', 5))
+
+VERIFICATION_CODE_KEY = os.environ.get('VERIFICATION_CODE_KEY') or os.environ.get('SESSION_SECRET')
+
+# With a known key, a stored hash gives the code away in at most 900000 guesses
+if not VERIFICATION_CODE_KEY:
+    raise RuntimeError("VERIFICATION_CODE_KEY (or SESSION_SECRET) is required")
+
+_code_key = VERIFICATION_CODE_KEY.encode()
+
+# Outcomes of CodeStore.check()
+VERIFIED = "verified"
+INVALID = "invalid"
+EXPIRED = "expired"
+LOCKED = "locked"
+
+
+def generate_code() -> str:
+    """Unpredictable 6-digit verification code"""
+    return str(secrets.randbelow(900000) + 100000)
+
+
+def hash_code(phone: str, code: str) -> str:
+    return hmac.new(_code_key, f"{phone}:{code}".encode(), hashlib.sha256).hexdigest()
+
+
+class MemoryCodeStore:
+    """Per-process codes: {phone: [code_hash, expires_at, attempts]}"""
+
+    def __init__(self):
+        self._codes = {}
+        self._lock = threading.Lock()
+        self._next_sweep = datetime.now()
+
+    def _sweep(self, now: datetime):
+        # Codes nobody redeems would otherwise stay forever; one pass per TTL is enough
+        if now < self._next_sweep:
+            return
+        self._codes = {phone: entry for phone, entry in self._codes.items() if entry[1] > now}
+        self._next_sweep = now + timedelta(seconds=CODE_TTL_SECONDS)
+
+    def issue(self, phone: str, code: str):
+        now = datetime.now()
+        with self._lock:
+            self._sweep(now)
+            self._codes[phone] = [hash_code(phone, code), now + timedelta(seconds=CODE_TTL_SECONDS), 0]
+
+    def check(self, phone: str, code: str) -> str:
+        with self._lock:
+            entry = self._codes.get(phone)
+            if entry is None:
+                return INVALID
+            if entry[2] >= MAX_CODE_ATTEMPTS:
+                return LOCKED
+            if not hmac.compare_digest(entry[0], hash_code(phone, code)):
+                entry[2] += 1
+                return LOCKED if entry[2] >= MAX_CODE_ATTEMPTS else INVALID
+            del self._codes[phone]
+            return EXPIRED if datetime.now() > entry[1] else VERIFIED
+
+
+class MongoCodeStore:
+    """Codes shared by every worker through the verification_codes collection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def issue(self, phone: str, code: str):
+        now = datetime.now()
+        # Overwrites the previous code and its attempt count; plaintext codes from older releases go too
+        self.collection.update_one(
+            {"phone": phone},
+            {
+                "$set": {
+                    "code_hash": hash_code(phone, code),
+                    "created_at": now,
+                    "expires_at": now + timedelta(seconds=CODE_TTL_SECONDS),
+                    "attempts": 0,
+                    "used": False
+                },
+                "$unset": {"code": ""}
+            },
+            upsert=True
+        )
+
+    def check(self, phone: str, code: str) -> str:
+        redeemed = self.collection.find_one_and_update(
+            {
+                "phone": phone,
+                "code_hash": hash_code(phone, code),
+                "used": False,
+                "attempts": {"$lt": MAX_CODE_ATTEMPTS}
+            },
+            {"$set": {"used": True}},
+            projection={"_id": 0, "expires_at": 1}
+        )
+        if redeemed:
+            return EXPIRED if datetime.now() > redeemed["expires_at"] else VERIFIED
+
+        failed = self.collection.find_one_and_update(
+            {"phone": phone, "used": False},
+            {"$inc": {"attempts": 1}},
+            projection={"_id": 0, "attempts": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if failed and failed["attempts"] >= MAX_CODE_ATTEMPTS:
+            return LOCKED
+        return INVALID
+
+
+def create_store(collection, workers: int):
+    kind = VERIFICATION_STORE
+    if kind == "auto":
+        kind = "memory" if workers == 1 else "mongo"
+    if kind == "memory":
+        return MemoryCodeStore()
+    if kind == "mongo":
+        return MongoCodeStore(collection)
+    raise RuntimeError(f"Unknown VERIFICATION_STORE {VERIFICATION_STORE!r}")
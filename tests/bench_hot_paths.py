@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the auth, credit and dashboard hot paths.
+
+Seeds a fixed dataset (SEED) into BENCH_DB_NAME on MONGO_URL (dropped
+before and after the run; no other database is touched), then times each
+hot path in-process through an ASGI client:
+
+- get_current_user, the session and projected user lookup, called directly
+- POST /api/click and POST /api/video/complete
+- GET /api/dashboard
+- hash_password
+- JSON rendering of a dashboard payload
+
+Medians are compared with tests/benchmark_baselines.json, which also
+records the machine it was measured on. The run exits non-zero when any
+benchmark is slower than its baseline by more than --threshold. Without
+a baseline file, or with one from another machine, the comparison is
+reported as SKIPPED and the run exits zero: timings from different
+hardware say nothing about a regression. Use --update-baseline on the
+benchmark machine to record new baselines after an intentional change.
+
+Run with: python tests/bench_hot_paths.py [--update-baseline] [--threshold 0.25]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "backend"))
+# Codes issued here are throwaway; any key lets server import
+os.environ.setdefault("VERIFICATION_CODE_KEY", uuid.uuid4().hex)
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+
+SEED = 20240601
+USERS = 500
+HISTORY_PER_USER = 40
+BASELINE_PATH = os.path.join(TESTS_DIR, "benchmark_baselines.json")
+# Fixed on purpose: a DB_NAME from the environment may be a real database
+BENCH_DB_NAME = "clickearn_bench"
+
+
+def drop_bench_database():
+    if server.db.name != BENCH_DB_NAME:
+        raise RuntimeError(f"refusing to drop {server.db.name!r}; benchmarks only drop {BENCH_DB_NAME!r}")
+    server.client.drop_database(BENCH_DB_NAME)
+
+
+def seed_dataset() -> list:
+    """Load a deterministic dataset and return [(user_id, session_id)]"""
+    rng = random.Random(SEED)
+    server.connect_database()
+    server.configure_database(server.client[BENCH_DB_NAME])
+    drop_bench_database()
+    server.ensure_indexes()
+
+    now = datetime.now()
+    yesterday = now - timedelta(days=1)
+    users, sessions, ledger, withdrawals, accounts = [], [], [], [], []
+    for index in range(USERS):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        accounts.append((user_id, session_id))
+        total_earned = 0.0
+        for _ in range(HISTORY_PER_USER):
+            created_at = now - timedelta(days=rng.randint(1, 30), seconds=rng.randint(0, 86399))
+            if rng.random() < 0.7:
+                ledger.append({
+                    "click_id": str(uuid.UUID(int=rng.getrandbits(128))), "user_id": user_id,
+                    "content_id": f"content_{rng.randint(1, 4)}", "amount": 0.5,
+                    "created_at": created_at, "ip_address": "127.0.0.1"
+                })
+                total_earned += 0.5
+            else:
+                ledger.append({
+                    "video_id": f"video_{rng.randint(1, 3)}", "user_id": user_id,
+                    "watch_duration": rng.randint(30, 60), "amount": 0.25,
+                    "created_at": created_at, "ip_address": "127.0.0.1"
+                })
+                total_earned += 0.25
+        withdrawn = 10.0 if total_earned >= 10 else 0.0
+        if withdrawn:
+            withdrawals.append({
+                "withdrawal_id": str(uuid.UUID(int=rng.getrandbits(128))), "user_id": user_id,
+                "amount": withdrawn, "paypal_email": f"bench{index}@example.com", "status": "pending",
+                "created_at": now - timedelta(days=rng.randint(1, 30)), "processed_at": None
+            })
+        users.append({
+            "user_id": user_id, "name": f"Bench User {index}", "email": f"bench{index}@example.com",
+            "phone": None, "password": server.hash_password("BenchPassword123!"),
+            "balance": total_earned - withdrawn, "total_earned": total_earned,
+            "clicks_today": 0, "videos_today": 0,
+            "last_click_date": yesterday, "last_video_date": yesterday,
+            "created_at": now - timedelta(days=31), "is_active": True,
+            "auth_method": "email_phone", "phone_verified": False, "email_verified": False
+        })
+        sessions.append({
+            "user_id": user_id,
+            "devices": [{
+                "device_id": str(uuid.UUID(int=rng.getrandbits(128))), "session_id": session_id,
+                "device_name": "bench", "created_at": now, "expires_at": now + timedelta(days=7)
+            }],
+            "updated_at": now
+        })
+
+    server.users_collection.insert_many(users, ordered=False)
+    server.sessions_collection.insert_many(sessions, ordered=False)
+    server.clicks_collection.insert_many(ledger, ordered=False)
+    if withdrawals:
+        server.withdrawals_collection.insert_many(withdrawals, ordered=False)
+    return accounts
+
+
+def summarize(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        "iterations": len(ordered),
+        "median_us": round(statistics.median(ordered) * 1e6, 2),
+        "p95_us": round(ordered[int(len(ordered) * 0.95) - 1] * 1e6, 2),
+    }
+
+
+def time_sync(function, iterations: int, warmup: int = 50) -> dict:
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+async def time_async(make_call, iterations: int, warmup: int = 20) -> dict:
+    for index in range(warmup):
+        await make_call(index)
+    samples = []
+    for index in range(warmup, warmup + iterations):
+        started = time.perf_counter()
+        await make_call(index)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+async def run_benchmarks(accounts: list) -> dict:
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def current_user(index):
+            await server.get_current_user(x_session_id=accounts[index % USERS][1])
+        results["get_current_user"] = await time_async(current_user, 2000)
+
+        async def expect_ok(response):
+            if response.status_code != 200:
+                raise RuntimeError(f"{response.request.url}: {response.status_code} {response.text}")
+
+        # Spread credits over users so no one reaches the daily limits
+        async def click(index):
+            headers = {"X-Session-ID": accounts[index % USERS][1]}
+            await expect_ok(await client.post("/api/click", json={"content_id": "content_1"}, headers=headers))
+        results["process_click"] = await time_async(click, USERS * 10)
+
+        async def video(index):
+            headers = {"X-Session-ID": accounts[index % USERS][1]}
+            await expect_ok(await client.post(
+                "/api/video/complete", json={"video_id": "video_1", "watch_duration": 30}, headers=headers
+            ))
+        results["complete_video"] = await time_async(video, USERS * 5)
+
+        async def dashboard(index):
+            headers = {"X-Session-ID": accounts[index % USERS][1]}
+            await expect_ok(await client.get("/api/dashboard", headers=headers))
+        results["get_dashboard"] = await time_async(dashboard, 2000)
+
+        payload = (await client.get("/api/dashboard", headers={"X-Session-ID": accounts[0][1]})).json()
+
+    results["hash_password"] = time_sync(lambda: server.hash_password("BenchPassword123!"), 20000)
+    results["serialize_dashboard"] = time_sync(lambda: server.app.router.default_response_class(payload), 20000)
+    # Rule evaluation on the credit path should stay in the sub-microsecond range
+    results["rules_reward"] = time_sync(
+        lambda: server.rules.current.reward("standard", "click", "content_1", 12), 200000
+    )
+    return results
+
+
+def machine() -> dict:
+    """What the timings depend on besides the code"""
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def compare(results: dict, baselines: dict, threshold: float) -> list:
+    regressions = []
+    print(f"{'benchmark':22}{'median us':>12}{'p95 us':>12}{'baseline':>12}{'change':>10}")
+    for name, stats in results.items():
+        baseline = baselines.get(name, {}).get("median_us")
+        change = ""
+        if baseline:
+            delta = stats["median_us"] / baseline - 1
+            change = f"{delta:+.1%}"
+            if delta > threshold:
+                regressions.append(name)
+                change += " !"
+        print(f"{name:22}{stats['median_us']:>12}{stats['p95_us']:>12}{baseline or '-':>12}{change:>10}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ClickEarn Pro hot path micro-benchmarks")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed median slowdown, 0.25 = 25%%")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    accounts = seed_dataset()
+    try:
+        results = asyncio.run(run_benchmarks(accounts))
+    finally:
+        drop_bench_database()
+
+    recorded = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            recorded = json.load(f)
+    baselines = recorded.get("results", {}) if recorded.get("machine") == machine() else {}
+    regressions = compare(results, baselines, args.threshold)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"machine": machine(), "results": results}, f, indent=2)
+        print(f"\nBaselines saved to {BASELINE_PATH}")
+        return True
+    if not recorded:
+        print(f"\nSKIPPED: no baselines at {BASELINE_PATH}; run with --update-baseline to record them")
+        return True
+    if not baselines:
+        print(f"\nSKIPPED: baselines were recorded on {recorded.get('machine')}, not this machine")
+        return True
+    if regressions:
+        print(f"\nRegressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
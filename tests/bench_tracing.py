@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: overhead of the tracing layer.
+Measures span() with and without an active trace, and full in-process
+requests to /api/content untraced vs traced at a 100% sample rate.
+
+Run with: python tests/bench_tracing.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+os.environ.setdefault("TRACE_DIR", tempfile.mkdtemp(prefix="bench-traces-"))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import httpx  # noqa: E402
+
+import tracing  # noqa: E402
+from server import app  # noqa: E402
+
+SPAN_ITERATIONS = 200000
+REQUESTS = 2000
+
+
+def bench_span(active: bool) -> float:
+    token = tracing.current_span.set(tracing.Span("0" * 32, "", "bench") if active else None)
+    try:
+        def run():
+            with tracing.span("child"):
+                pass
+        return timeit.timeit(run, number=SPAN_ITERATIONS) / SPAN_ITERATIONS
+    finally:
+        tracing.current_span.reset(token)
+
+
+async def bench_requests(asgi_app) -> float:
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(100):
+            await client.get("/api/content")
+        started = time.perf_counter()
+        for _ in range(REQUESTS):
+            await client.get("/api/content")
+        return (time.perf_counter() - started) / REQUESTS
+
+
+def main():
+    idle_span = bench_span(active=False)
+    traced_span = bench_span(active=True)
+    plain = asyncio.run(bench_requests(app))
+    traced = asyncio.run(bench_requests(tracing.TracingMiddleware(app, sample_rate=1.0)))
+    tracing.exporter.flush()
+
+    print(f"{'span() without active trace':34}{idle_span * 1e6:>10.2f} us")
+    print(f"{'span() inside sampled trace':34}{traced_span * 1e6:>10.2f} us")
+    print(f"{'GET /api/content untraced':34}{plain * 1e6:>10.1f} us")
+    print(f"{'GET /api/content traced (100%)':34}{traced * 1e6:>10.1f} us")
+    print(f"{'tracing overhead per request':34}{(traced - plain) * 1e6:>10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: full user document vs projected fields in a UserRecord.
+Compares wire size, BSON decode time and resident memory per request.
+
+Run with: python tests/bench_user_record.py
+"""
+
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+
+import bson
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from server import UserRecord, hash_password  # noqa: E402
+
+ITERATIONS = 100000
+RECORDS = 10000
+
+# Fields declared by the hottest endpoint (/api/click)
+CLICK_FIELDS = ("user_id", "balance", "total_earned", "clicks_today", "last_click_date")
+
+
+def full_user_document():
+    """User document as written by register_user"""
+    return {
+        "_id": bson.ObjectId(),
+        "user_id": "0b0c43a4-9d4e-4a8e-9a38-6f1f1c1f5f0e",
+        "name": "Maria Aparecida da Silva",
+        "email": "maria.aparecida.silva@example.com",
+        "phone": "+55 11 91234-5678",
+        "password": hash_password("SenhaForte123!"),
+        "balance": 12.75,
+        "total_earned": 48.25,
+        "clicks_today": 7,
+        "videos_today": 3,
+        "last_click_date": datetime.now(),
+        "last_video_date": datetime.now(),
+        "created_at": datetime.now(),
+        "is_active": True,
+        "auth_method": "email_phone",
+        "phone_verified": False,
+        "email_verified": False
+    }
+
+
+def main():
+    full = full_user_document()
+    projected = {field: full[field] for field in CLICK_FIELDS}
+    full_bytes = bson.encode(full)
+    projected_bytes = bson.encode(projected)
+
+    full_decode = timeit.timeit(lambda: bson.decode(full_bytes), number=ITERATIONS)
+    projected_decode = timeit.timeit(
+        lambda: UserRecord(bson.decode(projected_bytes), CLICK_FIELDS), number=ITERATIONS
+    )
+
+    tracemalloc.start()
+    dicts = [bson.decode(full_bytes) for _ in range(RECORDS)]
+    full_memory = tracemalloc.get_traced_memory()[0]
+    del dicts
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    records = [UserRecord(bson.decode(projected_bytes), CLICK_FIELDS) for _ in range(RECORDS)]
+    projected_memory = tracemalloc.get_traced_memory()[0]
+    del records
+    tracemalloc.stop()
+
+    print(f"{'':28}{'full dict':>14}{'UserRecord':>14}")
+    print(f"{'wire bytes per fetch':28}{len(full_bytes):>14}{len(projected_bytes):>14}")
+    print(f"{'decode us per fetch':28}{full_decode / ITERATIONS * 1e6:>14.2f}"
+          f"{projected_decode / ITERATIONS * 1e6:>14.2f}")
+    print(f"{'bytes per resident user':28}{full_memory // RECORDS:>14}{projected_memory // RECORDS:>14}")
+
+
+if __name__ == "__main__":
+    main()
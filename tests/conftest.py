@@ -0,0 +1,12 @@
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# backend/ is not a package; server.py and its modules import each other by name.
+# The tools in tests/ (dataset generator, local mongod helpers) are imported the same way.
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "backend"))
+sys.path.insert(0, TESTS_DIR)
+
+# backend/verification.py refuses to start without a key for the code hashes
+os.environ.setdefault("VERIFICATION_CODE_KEY", "test-verification-key")
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Synthetic ClickEarn Pro dataset generator for scale testing.
+
+Bulk-loads users, device sessions, click/video ledger rows and withdrawals
+into a local MongoDB. The documents have the same shapes as those written
+by register_user, create_session, process_click, complete_video and
+request_withdrawal.
+
+Activity is heavy-tailed: most users are occasional and a few max out
+their daily limits. Events follow a diurnal hour-of-day curve and respect
+the 20 clicks / 10 videos daily limits.
+
+Users are generated in fixed-size chunks, each with its own RNG derived
+from --seed. The data is identical whatever the --workers count, and each
+worker process loads its chunks with unordered insert_many batches.
+
+Data goes to clickearn_scale unless --db-name names another database; the
+DB_NAME environment variable is ignored, so --drop cannot hit the app's.
+
+Run with: python tests/generate_dataset.py --users 1000000 --days 90 --workers 8 --drop
+"""
+
+import argparse
+import hashlib
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+CHUNK_USERS = 5000
+
+# Fixed on purpose: a DB_NAME from the environment may be the application database
+DEFAULT_DB_NAME = "clickearn_scale"
+
+# Relative traffic per hour of day (peaks at lunch and in the evening)
+HOUR_WEIGHTS = [2, 1, 1, 1, 1, 2, 4, 6, 7, 7, 8, 9, 10, 9, 8, 8, 8, 9, 11, 13, 14, 12, 8, 4]
+HOURS = list(range(24))
+HOUR_CUM_WEIGHTS = list(itertools.accumulate(HOUR_WEIGHTS))
+
+# Every generated password-login user can sign in with this password
+PASSWORD = "Password123!"
+PASSWORD_HASH = hashlib.sha256(PASSWORD.encode()).hexdigest()
+
+_db = None
+_args = None
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _event_time(rng: random.Random, day: datetime) -> datetime:
+    hour = rng.choices(HOURS, cum_weights=HOUR_CUM_WEIGHTS)[0]
+    return day + timedelta(hours=hour, seconds=rng.randint(0, 3599))
+
+
+def generate_chunk(chunk: int, users: int, days: int, seed: int, now: datetime) -> dict:
+    """Build every document for one chunk of users"""
+    rng = random.Random(seed * 1000003 + chunk)
+    today = datetime.combine(now.date(), datetime.min.time())
+    docs = {"users": [], "sessions": [], "clicks": [], "withdrawals": []}
+
+    for offset in range(users):
+        index = chunk * CHUNK_USERS + offset
+        user_id = _uuid(rng)
+        created_at = now - timedelta(days=rng.uniform(0, days))
+        google = rng.random() < 0.15
+
+        # Pareto activity: share of days active and events per active day
+        activity = min(rng.paretovariate(1.3), 20.0)
+        active_probability = min(0.95, 0.04 * activity)
+        clicks_per_day = min(20.0, 2.0 * activity)
+        videos_per_day = min(10.0, 1.0 * activity)
+
+        balance = total_earned = 0.0
+        clicks_today = videos_today = 0
+        last_click_date = last_video_date = None
+        last_active = None
+
+        first_day = datetime.combine(created_at.date(), datetime.min.time())
+        for day_offset in range((today - first_day).days + 1):
+            day = first_day + timedelta(days=day_offset)
+            if rng.random() >= active_probability:
+                continue
+            last_active = day
+            clicks = min(20, int(rng.expovariate(1 / clicks_per_day)))
+            videos = min(10, int(rng.expovariate(1 / videos_per_day)))
+            times = sorted(
+                [(_event_time(rng, day), "click") for _ in range(clicks)]
+                + [(_event_time(rng, day), "video") for _ in range(videos)]
+            )
+            day_clicks = day_videos = 0
+            for created, kind in times:
+                if created > now:
+                    continue
+                if kind == "click":
+                    docs["clicks"].append({
+                        "click_id": _uuid(rng), "user_id": user_id,
+                        "content_id": f"content_{rng.randint(1, 4)}", "amount": 0.5,
+                        "created_at": created, "ip_address": "127.0.0.1"
+                    })
+                    balance += 0.5
+                    total_earned += 0.5
+                    last_click_date = created
+                    day_clicks += 1
+                else:
+                    docs["clicks"].append({
+                        "video_id": f"video_{rng.randint(1, 3)}", "user_id": user_id,
+                        "watch_duration": rng.randint(30, 60), "amount": 0.25,
+                        "created_at": created, "ip_address": "127.0.0.1"
+                    })
+                    balance += 0.25
+                    total_earned += 0.25
+                    last_video_date = created
+                    day_videos += 1
+
+            # Counters hold the last active day's totals until the server resets them
+            if day_clicks:
+                clicks_today = day_clicks
+            if day_videos:
+                videos_today = day_videos
+
+            if balance >= 10 and rng.random() < 0.3:
+                amount = float(math.floor(balance))
+                requested = min(now, day + timedelta(hours=23, minutes=rng.randint(0, 59)))
+                processed = (now - requested).days >= 1
+                docs["withdrawals"].append({
+                    "withdrawal_id": _uuid(rng), "user_id": user_id, "amount": amount,
+                    "paypal_email": f"user{index}@example.com",
+                    "status": "completed" if processed else "pending",
+                    "created_at": requested,
+                    "processed_at": requested + timedelta(hours=rng.randint(1, 24)) if processed else None
+                })
+                balance -= amount
+
+        user = {
+            "user_id": user_id,
+            "name": f"User {index}",
+            "email": f"user{index}@example.com" if google or rng.random() < 0.8 else None,
+            "phone": None,
+            "balance": round(balance, 2),
+            "total_earned": round(total_earned, 2),
+            "clicks_today": clicks_today,
+            "videos_today": videos_today,
+            "last_click_date": last_click_date,
+            "last_video_date": last_video_date,
+            "created_at": created_at,
+            "is_active": rng.random() > 0.01,
+            "auth_method": "google" if google else "email_phone",
+            "phone_verified": False,
+            "email_verified": google
+        }
+        if google:
+            user["picture"] = ""
+        else:
+            if user["email"] is None:
+                user["phone"] = f"+55119{index:08d}"
+            user["password"] = PASSWORD_HASH
+        docs["users"].append(user)
+
+        # Users active in the last week still hold device sessions
+        if last_active and (now - last_active).days < 7:
+            devices = []
+            for _ in range(rng.randint(1, 3)):
+                login = min(now, last_active + timedelta(hours=rng.randint(0, 23)))
+                devices.append({
+                    "device_id": _uuid(rng), "session_id": _uuid(rng),
+                    "device_name": rng.choice(["Android", "iPhone", "Chrome", "Firefox"]),
+                    "created_at": login, "expires_at": login + timedelta(days=7)
+                })
+            docs["sessions"].append({"user_id": user_id, "devices": devices, "updated_at": devices[-1]["created_at"]})
+
+    return docs
+
+
+def _init_worker(args):
+    global _db, _args
+    _args = args
+    _db = MongoClient(args.mongo_url)[args.db_name]
+
+
+def _load_chunk(chunk: int) -> dict:
+    users = min(CHUNK_USERS, _args.users - chunk * CHUNK_USERS)
+    docs = generate_chunk(chunk, users, _args.days, _args.seed, _args.now)
+    counts = {}
+    for collection, rows in docs.items():
+        for start in range(0, len(rows), _args.batch_size):
+            _db[collection].insert_many(rows[start:start + _args.batch_size], ordered=False)
+        counts[collection] = len(rows)
+    return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk-load a synthetic ClickEarn Pro dataset")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=90, help="history window")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=5000, help="documents per insert_many")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=DEFAULT_DB_NAME, help="never read from DB_NAME; --drop drops this")
+    parser.add_argument("--drop", action="store_true", help="drop the database first")
+    parser.add_argument("--no-indexes", action="store_true", help="skip creating the server's indexes")
+    args = parser.parse_args()
+    # Fixed reference time so a seed always yields the same documents within a day
+    args.now = datetime.combine(datetime.now().date(), datetime.min.time()) + timedelta(hours=12)
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.drop:
+        with MongoClient(args.mongo_url) as client:
+            client.drop_database(args.db_name)
+
+    chunks = range(math.ceil(args.users / CHUNK_USERS))
+    totals = {"users": 0, "sessions": 0, "clicks": 0, "withdrawals": 0}
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(args,)) as pool:
+        for done, counts in enumerate(pool.imap_unordered(_load_chunk, chunks), 1):
+            for collection, count in counts.items():
+                totals[collection] += count
+            elapsed = time.perf_counter() - started
+            print(f"\r{done}/{len(chunks)} chunks, {totals['users']} users, {totals['clicks']} ledger rows "
+                  f"({sum(totals.values()) / elapsed:,.0f} docs/s)", end="", flush=True)
+    print()
+
+    if not args.no_indexes:
+        # Build indexes after the load; bulk inserts into unindexed collections are faster
+        os.environ["MONGO_URL"] = args.mongo_url
+        os.environ["DB_NAME"] = args.db_name
+        # Only ensure_indexes() runs; no verification code is hashed
+        os.environ.setdefault("VERIFICATION_CODE_KEY", uuid.uuid4().hex)
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+        import server
+        server.connect_database()
+        server.ensure_indexes()
+
+    elapsed = time.perf_counter() - started
+    print(f"Loaded {totals} into {args.db_name} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
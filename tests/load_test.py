@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+ClickEarn Pro async load test.
+
+Starts a local mongod (a three-member replica set with --replica-set)
+unless --mongo-url is given, and a local uvicorn server unless --base-url
+is given, then drives concurrent user journeys:
+
+    register -> dashboard -> clicks -> videos -> dashboard -> withdraw -> history
+
+Reports throughput and p50/p95/p99 latency per endpoint and writes a JSON
+report (with the git commit) so runs can be compared across commits.
+
+Run with: python tests/load_test.py --users 200 --concurrency 50 --output load_report.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    # Rounded first so float error (0.07 * 100 = 7.000000000000001) cannot push the rank up
+    index = max(0, math.ceil(round(fraction * len(sorted_values), 9)) - 1)
+    return sorted_values[index]
+
+
+class LocalMongo:
+    """Throwaway mongod in a temporary data directory"""
+
+    def __init__(self):
+        self.process = None
+        self.dbpath = None
+        self.port = free_port()
+
+    def __enter__(self) -> str:
+        mongod = shutil.which("mongod")
+        if not mongod:
+            raise RuntimeError("mongod not found on PATH; pass --mongo-url to use an existing server")
+        self.dbpath = tempfile.mkdtemp(prefix="clickearn-load-mongo-")
+        self.process = subprocess.Popen(
+            [mongod, "--dbpath", self.dbpath, "--port", str(self.port), "--bind_ip", "127.0.0.1", "--quiet"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        wait_for_port(self.port, 30)
+        return f"mongodb://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+        shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+class LocalReplicaSet:
+    """Throwaway replica set of local mongods, for read routing and write concern checks"""
+
+    def __init__(self, members: int = 3, name: str = "clickearn-rs"):
+        self.name = name
+        self.ports = [free_port() for _ in range(members)]
+        self.processes = []
+        self.dbpaths = []
+
+    def __enter__(self) -> str:
+        from pymongo import MongoClient
+
+        mongod = shutil.which("mongod")
+        if not mongod:
+            raise RuntimeError("mongod not found on PATH")
+        for port in self.ports:
+            dbpath = tempfile.mkdtemp(prefix="clickearn-rs-mongo-")
+            self.dbpaths.append(dbpath)
+            self.processes.append(subprocess.Popen(
+                [mongod, "--replSet", self.name, "--dbpath", dbpath, "--port", str(port),
+                 "--bind_ip", "127.0.0.1", "--quiet"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            ))
+        for port in self.ports:
+            wait_for_port(port, 30)
+
+        seed = MongoClient(f"mongodb://127.0.0.1:{self.ports[0]}", directConnection=True)
+        seed.admin.command("replSetInitiate", {
+            "_id": self.name,
+            "members": [
+                # The first member is preferred as primary so runs are repeatable
+                {"_id": index, "host": f"127.0.0.1:{port}", "priority": 2 if index == 0 else 1}
+                for index, port in enumerate(self.ports)
+            ]
+        })
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            states = [member["stateStr"] for member in seed.admin.command("replSetGetStatus").get("members", [])]
+            if states.count("PRIMARY") == 1 and states.count("SECONDARY") == len(self.ports) - 1:
+                break
+            time.sleep(0.5)
+        else:
+            raise RuntimeError(f"Replica set {self.name} did not elect a primary with caught-up secondaries")
+        seed.close()
+        hosts = ",".join(f"127.0.0.1:{port}" for port in self.ports)
+        return f"mongodb://{hosts}/?replicaSet={self.name}"
+
+    def __exit__(self, *exc_info):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait(timeout=30)
+        for dbpath in self.dbpaths:
+            shutil.rmtree(dbpath, ignore_errors=True)
+
+
+class LocalServer:
+    """uvicorn serving backend/server.py against the given Mongo"""
+
+    def __init__(self, mongo_url: str, workers: int):
+        self.mongo_url = mongo_url
+        self.workers = workers
+        self.port = free_port()
+        self.process = None
+
+    def __enter__(self) -> str:
+        env = {
+            **os.environ,
+            "MONGO_URL": self.mongo_url,
+            "DB_NAME": f"clickearn_load_{uuid.uuid4().hex[:8]}",
+            "WEB_CONCURRENCY": str(self.workers),
+            "VERIFICATION_CODE_KEY": os.environ.get("VERIFICATION_CODE_KEY") or uuid.uuid4().hex,
+        }
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env
+        )
+        wait_for_port(self.port, 60)
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+class LoadTester:
+    def __init__(self, base_url: str, args):
+        self.base_url = base_url
+        self.args = args
+        self.samples = {}
+        self.errors = {}
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.samples.setdefault(name, []).append(time.perf_counter() - started)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        return response if ok else None
+
+    async def journey(self, client: httpx.AsyncClient, index: int):
+        response = await self.call(client, "register", "POST", "/api/auth/register", json={
+            "name": f"Load User {index}",
+            "email": f"load_{index}_{uuid.uuid4().hex[:8]}@example.com",
+            "password": "LoadTest123!"
+        })
+        if response is None:
+            return
+        headers = {"X-Session-ID": response.json()["session_id"]}
+
+        await self.call(client, "dashboard", "GET", "/api/dashboard", headers=headers)
+        for click in range(self.args.clicks):
+            await self.call(client, "click", "POST", "/api/click", headers=headers,
+                            json={"content_id": f"content_{click % 4 + 1}"})
+        for video in range(self.args.videos):
+            await self.call(client, "video_complete", "POST", "/api/video/complete", headers=headers,
+                            json={"video_id": f"video_{video % 3 + 1}", "watch_duration": 30})
+        await self.call(client, "dashboard", "GET", "/api/dashboard", headers=headers)
+        if self.args.withdraw:
+            await self.call(client, "withdraw", "POST", "/api/withdraw", headers=headers,
+                            json={"amount": self.args.withdraw, "paypal_email": "load@example.com"})
+        await self.call(client, "withdraw_history", "GET", "/api/withdraw-history", headers=headers)
+
+    async def run(self) -> float:
+        pending = asyncio.Queue()
+        for index in range(self.args.users):
+            pending.put_nowait(index)
+
+        limits = httpx.Limits(max_connections=self.args.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=30) as client:
+            async def worker():
+                while True:
+                    try:
+                        index = pending.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    await self.journey(client, index)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+            return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for name, latencies in sorted(self.samples.items()):
+            ordered = sorted(latencies)
+            endpoints[name] = {
+                "requests": len(ordered),
+                "errors": self.errors.get(name, 0),
+                "throughput_rps": round(len(ordered) / elapsed, 2),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+            }
+        total = sum(len(latencies) for latencies in self.samples.values())
+        return {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "config": {
+                "users": self.args.users,
+                "concurrency": self.args.concurrency,
+                "clicks": self.args.clicks,
+                "videos": self.args.videos,
+                "withdraw": self.args.withdraw,
+                "workers": self.args.workers,
+            },
+            "elapsed_seconds": round(elapsed, 3),
+            "total_requests": total,
+            "total_errors": sum(self.errors.values()),
+            "throughput_rps": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+
+def print_report(report: dict):
+    print(f"\n{report['total_requests']} requests in {report['elapsed_seconds']}s "
+          f"({report['throughput_rps']} req/s, {report['total_errors']} errors)")
+    print(f"{'endpoint':18}{'reqs':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in report["endpoints"].items():
+        print(f"{name:18}{stats['requests']:>8}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ClickEarn Pro async load test")
+    parser.add_argument("--users", type=int, default=100, help="user journeys to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="journeys in flight at once")
+    parser.add_argument("--clicks", type=int, default=20, help="clicks per journey")
+    parser.add_argument("--videos", type=int, default=10, help="video completions per journey")
+    parser.add_argument("--withdraw", type=float, default=10.0, help="withdrawal amount, 0 to skip")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the local server")
+    parser.add_argument("--base-url", help="use an already running server instead of starting one")
+    parser.add_argument("--mongo-url", help="use an existing MongoDB instead of starting mongod")
+    parser.add_argument("--replica-set", action="store_true",
+                        help="start a local three-member replica set instead of a standalone mongod")
+    parser.add_argument("--output", default="load_report.json", help="JSON report path")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    def run(base_url: str) -> dict:
+        tester = LoadTester(base_url, args)
+        elapsed = asyncio.run(tester.run())
+        return tester.report(elapsed)
+
+    if args.base_url:
+        report = run(args.base_url)
+    elif args.mongo_url:
+        with LocalServer(args.mongo_url, args.workers) as base_url:
+            report = run(base_url)
+    else:
+        mongo = LocalReplicaSet() if args.replica_set else LocalMongo()
+        with mongo as mongo_url, LocalServer(mongo_url, args.workers) as base_url:
+            report = run(base_url)
+
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to {args.output}")
+    return report["total_errors"] == 0
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
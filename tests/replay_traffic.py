@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Replay a traffic capture (backend/traffic_capture.py) against a local server.
+
+Requests are re-sent in capture order at their original offsets, scaled by
+--speed (2 = twice as fast, 0 = no waiting). Pseudonymous ids are remapped:
+
+- every captured session gets a synthetic user, registered on first use
+  and outside the timed requests
+- captured register and login calls create or log into that user's
+  account, and their issued session is mapped to the new one
+- redacted fields get synthetic values
+- each captured Idempotency-Key gets a fresh key, so captured retries are
+  still retries
+
+Google sign-in (/api/auth/profile) needs the external OAuth service and is
+skipped. The report compares captured and replayed p50/p95 per route and
+counts status mismatches. Like tests/load_test.py, it starts mongod and
+uvicorn unless --base-url or --mongo-url is given. --mongo-url memory://
+uses the in-memory stand-in.
+
+Run with: python tests/replay_traffic.py /tmp/clickearn-captures --speed 4 --output replay_report.json
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+from load_test import LocalMongo, LocalServer, git_commit, percentile
+
+SKIPPED_ROUTES = {"/api/auth/profile"}
+REPLAY_PASSWORD = "ReplayPassword123!"
+
+
+def load_capture(paths: list) -> list:
+    """Captured requests from files or capture directories, oldest first"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "capture.*jsonl*"))))
+        else:
+            files.append(path)
+    records = []
+    for name in files:
+        with open(name, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record["started_at"])
+    return records
+
+
+class Replayer:
+    def __init__(self, base_url: str, records: list, speed: float):
+        self.base_url = base_url
+        self.records = records
+        self.speed = speed
+        self.accounts = {}       # captured user -> synthetic credentials
+        self.sessions = {}       # captured session -> live session id
+        self.session_accounts = {}
+        self.anonymous = {"email": "replay_anonymous@example.com", "registered": False}
+        self.session_locks = {}
+        self.idempotency_keys = {}
+        self.samples = {}        # route -> [(captured ms, replayed ms)]
+        self.mismatches = {}
+        self.skipped = 0
+
+    def synthetic_value(self, field: str, account: dict):
+        return {
+            "email": account["email"],
+            "paypal_email": account["email"],
+            "password": REPLAY_PASSWORD,
+            "name": "Replay User",
+            "code": "000000",
+        }.get(field)
+
+    def fill(self, value, account: dict):
+        if isinstance(value, dict):
+            filled = {}
+            for key, item in value.items():
+                if item == "<redacted>":
+                    item = self.synthetic_value(key, account)
+                    if item is None:
+                        continue
+                elif key == "idempotency_key":
+                    item = self.idempotency_keys.setdefault(item, str(uuid.uuid4()))
+                else:
+                    item = self.fill(item, account)
+                filled[key] = item
+            return filled
+        if isinstance(value, list):
+            return [self.fill(item, account) for item in value]
+        return value
+
+    def new_account(self, user: str = None) -> dict:
+        account = {"email": f"replay_{uuid.uuid4().hex[:12]}@example.com", "registered": False}
+        self.accounts[user or account["email"]] = account
+        return account
+
+    async def register(self, client: httpx.AsyncClient, account: dict) -> str:
+        response = await client.post("/api/auth/register", json={
+            "name": "Replay User", "email": account["email"], "password": REPLAY_PASSWORD
+        })
+        response.raise_for_status()
+        account["registered"] = True
+        return response.json()["session_id"]
+
+    async def replay(self, client: httpx.AsyncClient, record: dict):
+        route = record["route"] or record["path"]
+        if route in SKIPPED_ROUTES:
+            self.skipped += 1
+            return
+
+        # Requests of one journey stay in capture order; anonymous ones run freely
+        journey = record["session"] or record.get("issued_session")
+        lock = self.session_locks.setdefault(journey, asyncio.Lock()) if journey else asyncio.Lock()
+        async with lock:
+            if record["path"] == "/api/auth/register":
+                account = self.new_account(record.get("user"))
+                account["registered"] = True
+            elif record["path"] == "/api/auth/login":
+                account = self.accounts.get(record.get("user")) or self.new_account(record.get("user"))
+                if not account["registered"]:
+                    await self.register(client, account)
+            elif record["session"] and record["session"] not in self.sessions:
+                # Journey started before the capture did: give it a synthetic user
+                account = self.new_account()
+                self.sessions[record["session"]] = await self.register(client, account)
+                self.session_accounts[record["session"]] = account
+            else:
+                account = self.session_accounts.get(record["session"]) or self.anonymous
+
+            headers = {}
+            if record["session"]:
+                headers["X-Session-ID"] = self.sessions[record["session"]]
+            if record.get("idempotency_key"):
+                headers["Idempotency-Key"] = self.idempotency_keys.setdefault(
+                    record["idempotency_key"], str(uuid.uuid4())
+                )
+            body = self.fill(record["body"], account)
+            url = record["path"] + (f"?{record['query']}" if record["query"] else "")
+
+            started = time.perf_counter()
+            try:
+                response = await client.request(record["method"], url, json=body, headers=headers)
+                status = response.status_code
+            except httpx.HTTPError:
+                response, status = None, None
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            if response is not None and record.get("issued_session") and status == 200:
+                self.sessions[record["issued_session"]] = response.json()["session_id"]
+                self.session_accounts[record["issued_session"]] = account
+
+        self.samples.setdefault(route, []).append((record["duration_ms"], elapsed_ms))
+        if status != record["status"]:
+            self.mismatches[route] = self.mismatches.get(route, 0) + 1
+
+    async def run(self) -> float:
+        if not self.records:
+            return 0.0
+        first = self.records[0]["started_at"]
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=30) as client:
+            started = time.perf_counter()
+            tasks = []
+            for record in self.records:
+                if self.speed > 0:
+                    delay = (record["started_at"] - first) / self.speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self.replay(client, record)))
+            await asyncio.gather(*tasks)
+            return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route, pairs in sorted(self.samples.items()):
+            captured = sorted(pair[0] for pair in pairs)
+            replayed = sorted(pair[1] for pair in pairs)
+            stats = {"requests": len(pairs), "status_mismatches": self.mismatches.get(route, 0)}
+            for label, fraction in (("p50", 0.50), ("p95", 0.95)):
+                before = percentile(captured, fraction)
+                after = percentile(replayed, fraction)
+                stats[f"captured_{label}_ms"] = round(before, 2)
+                stats[f"replayed_{label}_ms"] = round(after, 2)
+                stats[f"{label}_delta_ms"] = round(after - before, 2)
+            routes[route] = stats
+        return {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "speed": self.speed,
+            "elapsed_seconds": round(elapsed, 3),
+            "requests": sum(stats["requests"] for stats in routes.values()),
+            "skipped": self.skipped,
+            "synthetic_users": len(self.accounts),
+            "status_mismatches": sum(self.mismatches.values()),
+            "routes": routes,
+        }
+
+
+def print_report(report: dict):
+    print(f"\n{report['requests']} requests replayed in {report['elapsed_seconds']}s at {report['speed']}x "
+          f"({report['synthetic_users']} synthetic users, {report['skipped']} skipped, "
+          f"{report['status_mismatches']} status mismatches)")
+    print(f"{'route':28}{'reqs':>7}{'p50 cap':>10}{'p50 now':>10}{'delta':>9}{'p95 cap':>10}{'p95 now':>10}{'delta':>9}")
+    for route, stats in report["routes"].items():
+        print(f"{route:28}{stats['requests']:>7}"
+              f"{stats['captured_p50_ms']:>10}{stats['replayed_p50_ms']:>10}{stats['p50_delta_ms']:>+9}"
+              f"{stats['captured_p95_ms']:>10}{stats['replayed_p95_ms']:>10}{stats['p95_delta_ms']:>+9}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay captured ClickEarn Pro traffic")
+    parser.add_argument("captures", nargs="+", help="capture files or directories")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale, 1 = real time, 0 = no waiting")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the local server")
+    parser.add_argument("--base-url", help="use an already running server instead of starting one")
+    parser.add_argument("--mongo-url", help="use an existing MongoDB (or memory://) instead of starting mongod")
+    parser.add_argument("--output", default="replay_report.json", help="JSON report path")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    records = load_capture(args.captures)
+    print(f"Loaded {len(records)} captured requests")
+
+    def run(base_url: str) -> dict:
+        replayer = Replayer(base_url, records, args.speed)
+        elapsed = asyncio.run(replayer.run())
+        return replayer.report(elapsed)
+
+    if args.base_url:
+        report = run(args.base_url)
+    elif args.mongo_url:
+        with LocalServer(args.mongo_url, args.workers) as base_url:
+            report = run(base_url)
+    else:
+        with LocalMongo() as mongo_url, LocalServer(mongo_url, args.workers) as base_url:
+            report = run(base_url)
+
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,701 @@
+"""
+Hermetic API tests: the whole app runs in-process against the in-memory
+Mongo stand-in (backend/memory_db.py), so no mongod or deployment is needed
+and every test gets a fresh database.
+"""
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from pymongo.errors import BulkWriteError
+
+import archive
+import bulk_ops
+import memory_db
+import query_monitor
+import reconcile
+import server
+import traffic_capture
+import tracing
+import verification
+
+
+@pytest.fixture
+def client():
+    mongo = memory_db.InMemoryClient(event_listeners=server._mongo_listeners)
+    server.configure_database(mongo["clickearn_test"])
+    server.ensure_indexes()
+    server._idempotency_cache.clear()
+    server._dashboard_cache.clear()
+    server._revoked_tokens.clear()
+    server._sessions_not_before.clear()
+    yield TestClient(server.app)
+
+
+def register(client, email="ana@example.com", password="Senha123!") -> dict:
+    response = client.post("/api/auth/register", json={"name": "Ana", "email": email, "password": password})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+def session(client) -> dict:
+    return {"X-Session-ID": register(client)["session_id"]}
+
+
+def test_register_and_login(client):
+    registered = register(client)
+    assert registered["user"]["balance"] == 0.0
+
+    duplicate = client.post("/api/auth/register", json={"name": "Ana", "email": "ana@example.com", "password": "x"})
+    assert duplicate.status_code != 200
+    assert "Usuário já existe" in duplicate.json()["detail"]
+
+    wrong = client.post("/api/auth/login", json={"email": "ana@example.com", "password": "errada"})
+    assert wrong.status_code == 401
+
+    login = client.post("/api/auth/login", json={"email": "ana@example.com", "password": "Senha123!"})
+    assert login.status_code == 200
+    assert login.json()["user"]["user_id"] == registered["user"]["user_id"]
+
+
+def test_requires_session(client):
+    assert client.get("/api/dashboard").status_code == 401
+    assert client.get("/api/dashboard", headers={"X-Session-ID": "unknown"}).status_code == 401
+
+
+def test_click_credits_until_daily_limit(client, session):
+    for expected in range(1, 21):
+        response = client.post("/api/click", json={"content_id": "content_1"}, headers=session)
+        assert response.status_code == 200
+        assert response.json()["new_balance"] == expected * 0.5
+
+    limited = client.post("/api/click", json={"content_id": "content_1"}, headers=session)
+    assert limited.status_code == 400
+
+    dashboard = client.get("/api/dashboard", headers=session).json()
+    assert dashboard["balance"] == 10.0
+    assert dashboard["clicks_remaining"] == 0
+    assert dashboard["today_earnings"] == 10.0
+    assert len(dashboard["recent_activity"]) == 10
+
+
+def test_dashboard_conditional_get(client, session):
+    first = client.get("/api/dashboard", headers=session)
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    with query_monitor.capture_queries() as captured:
+        unchanged = client.get("/api/dashboard", headers={**session, "If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert captured[0][2].count == 2  # session and user lookups only
+
+    client.post("/api/click", json={"content_id": "content_1"}, headers=session)
+    changed = client.get("/api/dashboard", headers={**session, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["balance"] == 0.5
+
+    # A copy fetched yesterday, before the counters reset
+    yesterday = datetime.now() - timedelta(days=1)
+    server.users_collection.update_one({}, {"$set": {"last_click_date": yesterday}})
+    stale_etag = changed.headers["ETag"].replace(f"{datetime.now():%Y%m%d}", f"{yesterday:%Y%m%d}")
+    server._dashboard_cache.clear()
+    rolled_over = client.get("/api/dashboard", headers={**session, "If-None-Match": stale_etag})
+    assert rolled_over.status_code == 200
+    assert rolled_over.json()["clicks_remaining"] == 20
+
+
+def test_video_requires_minimum_watch_time(client, session):
+    short = client.post("/api/video/complete", json={"video_id": "video_1", "watch_duration": 10}, headers=session)
+    assert short.status_code == 400
+
+    watched = client.post("/api/video/complete", json={"video_id": "video_1", "watch_duration": 30}, headers=session)
+    assert watched.status_code == 200
+    assert watched.json() == {
+        "success": True, "amount_earned": 0.25, "new_balance": 0.25, "videos_remaining": 9,
+        "message": "Vídeo assistido! $0.25 adicionado ao seu saldo."
+    }
+
+
+def test_withdrawal_and_history(client, session):
+    assert client.post("/api/withdraw", json={"amount": 10, "paypal_email": "a@b.com"}, headers=session).status_code == 400
+    for _ in range(20):
+        client.post("/api/click", json={"content_id": "content_1"}, headers=session)
+
+    withdrawal = client.post("/api/withdraw", json={"amount": 10, "paypal_email": "a@b.com"}, headers=session)
+    assert withdrawal.status_code == 200
+    assert withdrawal.json()["new_balance"] == 0.0
+
+    history = client.get("/api/withdraw-history", headers=session).json()["withdrawals"]
+    assert [row["amount"] for row in history] == [10.0]
+    assert history[0]["status"] == "pending"
+
+
+def test_balance_updates_do_not_overwrite_concurrent_changes(client, session):
+    user_id = server.sessions_collection.find_one({})["user_id"]
+    fields = ("user_id", "balance", "total_earned", "clicks_today", "last_click_date", "tier")
+    stale = server.UserRecord(server.users_collection.find_one({"user_id": user_id}), fields)
+
+    # A bulk credit lands after the click handler loaded the user
+    server.users_collection.update_one({"user_id": user_id}, {"$inc": {"balance": 15.0}})
+    assert server.apply_click(server.ClickData(content_id="content_1"), stale)["new_balance"] == 15.5
+
+    # Two withdrawals that both saw the full balance cannot both debit it
+    stale = server.UserRecord(server.users_collection.find_one({"user_id": user_id}), fields)
+    withdraw = server.WithdrawRequest(amount=10, paypal_email="a@b.com")
+    assert server.apply_withdrawal(withdraw, stale)["new_balance"] == 5.5
+    with pytest.raises(server.HTTPException) as error:
+        server.apply_withdrawal(withdraw, stale)
+    assert error.value.detail == "Saldo insuficiente"
+    assert server.users_collection.find_one({"user_id": user_id})["balance"] == 5.5
+    assert server.withdrawals_collection.count_documents({}) == 1
+
+
+def test_idempotent_click_is_replayed(client, session):
+    headers = {**session, "Idempotency-Key": "click-1"}
+    first = client.post("/api/click", json={"content_id": "content_1"}, headers=headers)
+    server._idempotency_cache.clear()
+    replay = client.post("/api/click", json={"content_id": "content_1"}, headers=headers)
+
+    assert replay.json() == first.json()
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert client.get("/api/dashboard", headers=session).json()["balance"] == 0.5
+
+    conflict = client.post("/api/video/complete", json={"video_id": "video_1", "watch_duration": 30}, headers=headers)
+    assert conflict.status_code == 422
+
+
+def test_idempotency_key_checks_body_and_recovers_abandoned_claims(client, session):
+    headers = {**session, "Idempotency-Key": "click-1"}
+    client.post("/api/click", json={"content_id": "content_1"}, headers=headers)
+    server._idempotency_cache.clear()
+    other_body = client.post("/api/click", json={"content_id": "content_2"}, headers=headers)
+    assert other_body.status_code == 422
+
+    # A claim left pending by a worker that died mid-request
+    user_id = server.sessions_collection.find_one({})["user_id"]
+    now = datetime.now()
+    claim = {"user_id": user_id, "key": "click-2", "endpoint": "click", "status": "pending", "response": None,
+             "request_hash": server.idempotency_request_hash(server.ClickData(content_id="content_1")),
+             "claim_id": "dead-worker", "created_at": now, "claimed_until": now + timedelta(seconds=30)}
+    server.idempotency_keys_collection.insert_one(claim)
+    retry = {**session, "Idempotency-Key": "click-2"}
+    assert client.post("/api/click", json={"content_id": "content_1"}, headers=retry).status_code == 409
+
+    server.idempotency_keys_collection.update_one(
+        {"key": "click-2"}, {"$set": {"claimed_until": now - timedelta(seconds=1)}}
+    )
+    taken_over = client.post("/api/click", json={"content_id": "content_1"}, headers=retry)
+    assert taken_over.status_code == 200
+    assert taken_over.json()["new_balance"] == 1.0
+    assert server.idempotency_keys_collection.find_one({"key": "click-2"})["status"] == "completed"
+
+
+def test_event_batch_deduplicates_keys(client, session):
+    events = [
+        {"type": "click", "idempotency_key": "a", "content_id": "content_1"},
+        {"type": "click", "idempotency_key": "a", "content_id": "content_1"},
+        {"type": "video", "idempotency_key": "b", "video_id": "video_1", "watch_duration": 45},
+        {"type": "video", "idempotency_key": "c", "video_id": "video_1", "watch_duration": 5},
+    ]
+    body = client.post("/api/events/batch", json={"events": events}, headers=session).json()
+    assert [result["status"] for result in body["results"]] == ["credited", "duplicate", "credited", "rejected"]
+    assert body["new_balance"] == 0.75
+
+    retried = client.post("/api/events/batch", json={"events": events[:1]}, headers=session).json()
+    assert retried["results"][0]["status"] == "duplicate"
+    assert retried["new_balance"] == 0.75
+
+
+def test_event_batch_credits_inserted_rows_when_one_insert_fails(client, session, monkeypatch):
+    ledger = server.clicks_collection
+    bulk_write = ledger.bulk_write
+
+    def failing_bulk_write(requests, ordered=True, **kwargs):
+        # A concurrent retry owns "b"; "c" hits a non-duplicate write error
+        ledger.insert_one({**requests[1]._doc, "click_id": "concurrent", "batch_id": "other", "credited": True})
+        bulk_write(requests[:1], ordered=ordered, **kwargs)
+        raise BulkWriteError({"writeErrors": [
+            {"index": 1, "code": 11000, "errmsg": "duplicate key"},
+            {"index": 2, "code": 121, "errmsg": "Document failed validation"},
+        ]})
+
+    monkeypatch.setattr(ledger, "bulk_write", failing_bulk_write)
+    events = [{"type": "click", "idempotency_key": key, "content_id": "content_1"} for key in "abc"]
+    response = client.post("/api/events/batch", json={"events": events}, headers=session)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == ["credited", "duplicate", "failed"]
+    assert body["amount_earned"] == 0.5
+    assert body["clicks_remaining"] == 19
+    user = server.users_collection.find_one({})
+    assert (user["balance"], user["clicks_today"]) == (0.5, 1)
+
+    monkeypatch.setattr(ledger, "bulk_write", bulk_write)
+    retried = client.post("/api/events/batch", json={"events": events}, headers=session).json()
+    assert [result["status"] for result in retried["results"]] == ["duplicate", "duplicate", "credited"]
+    assert retried["new_balance"] == 1.0
+
+
+def test_event_batch_retry_finishes_a_batch_that_stopped_before_crediting(client, session, monkeypatch):
+    users = server.users_collection
+    credit = users.find_one_and_update
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("worker died")
+
+    events = [
+        {"type": "click", "idempotency_key": "a", "content_id": "content_1"},
+        {"type": "video", "idempotency_key": "b", "video_id": "video_1", "watch_duration": 45},
+    ]
+    monkeypatch.setattr(users, "find_one_and_update", crash)
+    with pytest.raises(RuntimeError):
+        client.post("/api/events/batch", json={"events": events}, headers=session)
+    assert server.clicks_collection.count_documents({"credited": False}) == 2
+    assert users.find_one({})["balance"] == 0.0
+
+    # The retry carries only one of the keys; the whole stopped batch is credited once
+    monkeypatch.setattr(users, "find_one_and_update", credit)
+    retried = client.post("/api/events/batch", json={"events": events[:1]}, headers=session).json()
+    assert retried["results"][0]["status"] == "credited"
+    assert retried["new_balance"] == 0.75
+    user = users.find_one({})
+    assert (user["balance"], user["clicks_today"], user["videos_today"]) == (0.75, 1, 1)
+    assert server.clicks_collection.count_documents({"credited": False}) == 0
+
+    again = client.post("/api/events/batch", json={"events": events}, headers=session).json()
+    assert [result["status"] for result in again["results"]] == ["duplicate", "duplicate"]
+    assert again["new_balance"] == 0.75
+
+    server.app_logging.audit_handler.flush()
+    audit_log = server.app_logging.audit_handler.path
+    with open(audit_log) as f:
+        batches = [json.loads(line) for line in f if '"credit.batch"' in line]
+    assert (batches[-1]["balance_before"], batches[-1]["balance_after"]) == (0.0, 0.75)
+
+
+def test_daily_counter_reset_keeps_concurrent_increments(client, session):
+    user_id = server.sessions_collection.find_one({})["user_id"]
+    yesterday = datetime.now() - timedelta(days=1)
+    server.users_collection.update_one({}, {"$set": {"clicks_today": 20, "last_click_date": yesterday}})
+
+    # Two requests saw yesterday's counter; the second reset lands after the first credit
+    now = datetime.now()
+    server.reset_daily_counter(user_id, "clicks_today", "last_click_date", now)
+    server.users_collection.update_one({}, {"$inc": {"clicks_today": 3}, "$set": {"last_click_date": now}})
+    server.reset_daily_counter(user_id, "clicks_today", "last_click_date", now)
+    assert server.users_collection.find_one({})["clicks_today"] == 3
+
+
+def test_daily_counters_reset_on_new_day(client, session):
+    for _ in range(20):
+        client.post("/api/click", json={"content_id": "content_1"}, headers=session)
+    server.users_collection.update_one({}, {"$set": {"last_click_date": datetime.now() - timedelta(days=1)}})
+
+    dashboard = client.get("/api/dashboard", headers=session).json()
+    assert dashboard["clicks_remaining"] == 20
+    assert client.post("/api/click", json={"content_id": "content_1"}, headers=session).status_code == 200
+
+
+def test_sessions_per_device(client):
+    first = register(client)
+    phone = {"X-Session-ID": first["session_id"]}
+    laptop = {"X-Session-ID": client.post(
+        "/api/auth/login", json={"email": "ana@example.com", "password": "Senha123!"}
+    ).json()["session_id"]}
+
+    devices = client.get("/api/sessions", headers=phone).json()["sessions"]
+    assert len(devices) == 2
+    assert sum(device["current"] for device in devices) == 1
+
+    assert client.delete("/api/sessions", headers=laptop).status_code == 200
+    assert client.get("/api/dashboard", headers=phone).status_code == 401
+    assert client.get("/api/dashboard", headers=laptop).status_code == 200
+
+    assert client.post("/api/auth/logout", headers=laptop).status_code == 200
+    assert client.get("/api/dashboard", headers=laptop).status_code == 401
+
+
+def test_signed_relogin_revokes_earlier_tokens(client, monkeypatch):
+    monkeypatch.setattr(server, "SESSION_MODE", "signed")
+    monkeypatch.setattr(server, "SESSION_SECRET", "test-session-secret")
+    first = {"X-Session-ID": register(client)["session_id"]}
+    assert client.get("/api/dashboard", headers=first).status_code == 200
+
+    login = client.post("/api/auth/login", json={"email": "ana@example.com", "password": "Senha123!"})
+    second = {"X-Session-ID": login.json()["session_id"]}
+    assert client.get("/api/dashboard", headers=second).status_code == 200
+    assert client.get("/api/dashboard", headers=first).status_code == 401
+
+    # Other workers pick the cut-off up from Mongo
+    server._sessions_not_before.clear()
+    server.sync_session_revocations()
+    assert client.get("/api/dashboard", headers=first).status_code == 401
+
+
+def test_legacy_sessions_are_migrated_once_before_startup():
+    server.configure_database(memory_db.InMemoryClient()["clickearn_legacy"])
+    expires_at = datetime.now() + timedelta(days=1)
+    server.sessions_collection.insert_many([
+        {"session_id": session_id, "user_id": "u1", "created_at": datetime.now(), "expires_at": expires_at}
+        for session_id in ("s1", "s2")
+    ])
+    with pytest.raises(RuntimeError):
+        server.ensure_indexes()
+
+    assert server.migrate_legacy_sessions() == 2
+    server.ensure_indexes()
+    session = server.sessions_collection.find_one({"user_id": "u1"})
+    assert [device["session_id"] for device in session["devices"]] == ["s1", "s2"]
+
+    # Later boots only look up the marker
+    server.sessions_collection.insert_one({"session_id": "s3", "user_id": "u2"})
+    server.ensure_indexes()
+
+
+def test_signed_sessions_can_only_revoke_own_devices(client, monkeypatch):
+    monkeypatch.setattr(server, "SESSION_MODE", "signed")
+    monkeypatch.setattr(server, "SESSION_SECRET", "test-session-secret")
+    ana = {"X-Session-ID": register(client)["session_id"]}
+    bia = {"X-Session-ID": register(client, "bia@example.com")["session_id"]}
+    ana_id = server.decode_session_token(ana["X-Session-ID"])["sub"]
+    laptop_token = server.create_session(ana_id, "laptop")
+    laptop_jti = server.decode_session_token(laptop_token)["jti"]
+
+    sessions = client.get("/api/sessions", headers=ana).json()["sessions"]
+    assert len(sessions) == 2
+    assert [session["current"] for session in sessions if session["device_id"] != laptop_jti] == [True]
+
+    # Another user's jti, or one that was never issued, is not revocable
+    assert client.delete(f"/api/sessions/{laptop_jti}", headers=bia).status_code == 404
+    assert client.delete("/api/sessions/unknown", headers=ana).status_code == 404
+    assert client.get("/api/dashboard", headers={"X-Session-ID": laptop_token}).status_code == 200
+
+    assert client.delete(f"/api/sessions/{laptop_jti}", headers=ana).status_code == 200
+    assert client.get("/api/dashboard", headers={"X-Session-ID": laptop_token}).status_code == 401
+    assert client.get("/api/dashboard", headers=ana).status_code == 200
+    assert len(client.get("/api/sessions", headers=ana).json()["sessions"]) == 1
+
+
+def test_phone_verification(client, monkeypatch):
+    client.post("/api/auth/register", json={"name": "Bia", "phone": "+5511900000001", "password": "Senha123!"})
+    # The code is only echoed back in DEBUG runs
+    assert "demo_code" not in client.post("/api/auth/send-code", json={"phone": "+5511900000001"}).json()
+    monkeypatch.setattr(query_monitor, "DEBUG", True)
+    code = client.post("/api/auth/send-code", json={"phone": "+5511900000001"}).json()["demo_code"]
+
+    assert client.post("/api/auth/verify-code", json={"phone": "+5511900000001", "code": "000000"}).status_code == 400
+    assert client.post("/api/auth/verify-code", json={"phone": "+5511900000001", "code": code}).status_code == 200
+    assert server.users_collection.find_one({"phone": "+5511900000001"})["phone_verified"] is True
+    # Single use
+    assert client.post("/api/auth/verify-code", json={"phone": "+5511900000001", "code": code}).status_code == 400
+
+    # The SMS went through the queue, not the request
+    asyncio.run(server.sms_queue.flush())
+    assert code in server.sms_queue.provider.sent[-1]["body"]
+
+
+@pytest.mark.parametrize("store", ["memory", "mongo"])
+def test_verification_codes_are_hashed_and_attempt_limited(client, store, monkeypatch):
+    monkeypatch.setattr(verification, "VERIFICATION_STORE", store)
+    code_store = verification.create_store(server.verification_codes_collection, workers=1)
+    phone = "+5511900000002"
+
+    code_store.issue(phone, "123456")
+    stored = server.verification_codes_collection.find_one({"phone": phone})
+    assert stored is None if store == "memory" else "123456" not in str(stored)
+
+    for _ in range(verification.MAX_CODE_ATTEMPTS - 1):
+        assert code_store.check(phone, "000000") == verification.INVALID
+    assert code_store.check(phone, "000000") == verification.LOCKED
+    # Even the right code is refused once the attempts are spent
+    assert code_store.check(phone, "123456") == verification.LOCKED
+
+    code_store.issue(phone, "654321")
+    assert code_store.check(phone, "654321") == verification.VERIFIED
+    assert code_store.check(phone, "654321") == verification.INVALID
+
+
+def test_dashboard_query_budget(client, session):
+    with query_monitor.capture_queries() as captured:
+        client.get("/api/dashboard", headers=session)
+    (method, route, stats), = captured
+    assert (method, route) == ("GET", "/api/dashboard")
+    assert stats.count <= 4
+
+
+@pytest.fixture
+def lifespan(monkeypatch):
+    """Run the app's lifespan against memory:// with no outbound OAuth health pings"""
+    async def upstream_up():
+        pass
+
+    monkeypatch.setattr(server, "MONGO_URL", "memory://")
+    monkeypatch.setattr(server, "_ping_oauth", upstream_up)
+
+
+def test_lifespan_manages_worker_resources(lifespan):
+    with TestClient(server.app) as client:
+        assert not server.draining
+        assert isinstance(server.client, memory_db.InMemoryClient)
+        assert "user_id_1" in server.users_collection.index_information()
+        register(client)
+    assert server.draining
+    assert server.http_client.is_closed
+
+
+def test_readiness_reflects_cached_dependency_health(lifespan, monkeypatch):
+    async def upstream_down():
+        raise RuntimeError("HTTP 502")
+
+    monkeypatch.setattr(server, "_ping_oauth", upstream_down)
+    with TestClient(server.app) as client:
+        assert client.get("/health/live").status_code == 200
+        for _ in range(100):
+            if server._health["checked_at"]:
+                break
+            time.sleep(0.01)
+
+        with query_monitor.capture_queries() as captured:
+            ready = client.get("/health/ready")
+        assert ready.status_code == 200
+        assert ready.json()["status"] == "degraded"
+        assert captured[0][2].count == 0
+
+        monkeypatch.setattr(server, "draining", True)
+        draining = client.get("/health/ready")
+        assert draining.status_code == 503
+        assert draining.json()["status"] == "draining"
+
+
+def test_archived_history_is_read_transparently(client, session, tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    user_id = server.sessions_collection.find_one({})["user_id"]
+    old = datetime.now() - timedelta(days=200)
+    server.clicks_collection.insert_many([
+        {"click_id": f"old-{day}", "user_id": user_id, "content_id": "content_1", "amount": 0.5,
+         "created_at": old + timedelta(days=day), "ip_address": "127.0.0.1"}
+        for day in range(45)
+    ])
+    server.withdrawals_collection.insert_many([
+        {"withdrawal_id": "paid", "user_id": user_id, "amount": 10.0, "paypal_email": "a@b.com",
+         "status": "completed", "created_at": old, "processed_at": old + timedelta(hours=3)},
+        {"withdrawal_id": "stuck", "user_id": user_id, "amount": 10.0, "paypal_email": "a@b.com",
+         "status": "pending", "created_at": old, "processed_at": None},
+    ])
+    client.post("/api/click", json={"content_id": "content_2"}, headers=session)
+
+    cutoff = datetime.now() - timedelta(days=90)
+    assert archive.archive_collection(server.clicks_collection, cutoff, batch_size=10) == 45
+    assert archive.archive_collection(server.withdrawals_collection, cutoff) == 1
+    assert server.clicks_collection.count_documents({}) == 1
+    assert [row["withdrawal_id"] for row in server.withdrawals_collection.find({})] == ["stuck"]
+    assert len(list(tmp_path.glob("clicks/month=*/*.parquet"))) >= 2
+
+    # Open-ended requests only read what is still in Mongo
+    hot = client.get("/api/activity-history", headers=session).json()["activity"]
+    assert [row["content_id"] for row in hot] == ["content_2"]
+
+    since = {"since": (old - timedelta(days=1)).isoformat()}
+    activity = client.get("/api/activity-history", params=since, headers=session).json()["activity"]
+    assert len(activity) == 46
+    assert activity[0]["content_id"] == "content_2"
+    assert activity[-1]["click_id"] == "old-0"
+    assert "video_id" not in activity[-1]
+
+    recent = client.get(
+        "/api/activity-history", params={"since": (cutoff + timedelta(days=1)).isoformat()}, headers=session
+    ).json()["activity"]
+    assert [row["content_id"] for row in recent] == ["content_2"]
+
+    withdrawals = client.get("/api/withdraw-history", headers=session).json()["withdrawals"]
+    assert [row["withdrawal_id"] for row in withdrawals] == ["stuck"]
+    withdrawals = client.get("/api/withdraw-history", params=since, headers=session).json()["withdrawals"]
+    assert sorted(row["withdrawal_id"] for row in withdrawals) == ["paid", "stuck"]
+
+
+def test_reconciliation_is_incremental_and_repairs_drift(client, session):
+    for _ in range(4):
+        client.post("/api/click", json={"content_id": "content_1"}, headers=session)
+    client.post("/api/video/complete", json={"video_id": "video_1", "watch_duration": 30}, headers=session)
+    user_id = server.sessions_collection.find_one({})["user_id"]
+
+    baseline = reconcile.reconcile(server.db, settle_seconds=0)
+    assert (baseline["credit_events"], baseline["mismatch_count"]) == (5, 0)
+    assert server.ledger_checkpoints_collection.find_one({"user_id": user_id})["credits"] == 2.25
+
+    # A lost update: the ledger row exists but the balance never moved
+    server.clicks_collection.insert_one({
+        "click_id": "lost", "user_id": user_id, "content_id": "content_1", "amount": 0.5,
+        "created_at": datetime.now(), "ip_address": "127.0.0.1"
+    })
+    flagged = reconcile.reconcile(server.db, settle_seconds=0)
+    assert flagged["credit_events"] == 1
+    assert flagged["mismatches"][0]["balance_diff"] == 0.5
+    assert client.get("/api/dashboard", headers=session).json()["balance"] == 2.25
+
+    server.users_collection.update_one({}, {"$inc": {"balance": -0.5, "total_earned": -0.5}})
+    repaired = reconcile.reconcile(server.db, repair=True, settle_seconds=0)
+    assert repaired["credit_events"] == 0
+    assert repaired["users_checked"] == 0
+
+    # Drift is only detected for users with new activity
+    client.post("/api/click", json={"content_id": "content_1"}, headers=session)
+    repaired = reconcile.reconcile(server.db, repair=True, settle_seconds=0)
+    assert repaired["mismatches"][0]["balance_diff"] == 1.0
+    dashboard = client.get("/api/dashboard", headers=session).json()
+    assert (dashboard["balance"], dashboard["total_earned"]) == (3.25, 3.25)
+    assert reconcile.reconcile(server.db, settle_seconds=0)["mismatch_count"] == 0
+
+
+def test_rules_apply_tier_and_hour_multipliers(client, session, monkeypatch):
+    monkeypatch.setattr(server.rules, "current", server.rules.compile_rules({
+        "rewards": {"click": 0.5, "video": 0.25},
+        "content_rewards": {"content_2": 1.0},
+        "daily_limits": {"click": 20, "video": 10},
+        "min_watch_seconds": 30,
+        "min_withdrawal": 10.0,
+        "tiers": {"gold": {"multiplier": 2, "daily_limits": {"click": 2}}},
+        "hour_multipliers": {"0-24": 1.5}
+    }))
+    standard = client.post("/api/click", json={"content_id": "content_1"}, headers=session).json()
+    assert standard["amount_earned"] == 0.75
+    assert standard["clicks_remaining"] == 19
+
+    server.users_collection.update_one({}, {"$set": {"tier": "gold"}})
+    gold = client.post("/api/click", json={"content_id": "content_2"}, headers=session).json()
+    assert gold["amount_earned"] == 3.0
+    assert gold["clicks_remaining"] == 0
+    assert gold["message"] == "Clique válido! $3.00 adicionado ao seu saldo."
+
+    dashboard = client.get("/api/dashboard", headers=session).json()
+    assert dashboard["today_earnings"] == 3.75
+    assert dashboard["clicks_remaining"] == 0
+
+
+def test_rules_reload_swaps_only_valid_files(tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    config = json.loads(open(server.rules.RULES_FILE).read())
+    path.write_text(json.dumps({**config, "min_withdrawal": 25.0}))
+    monkeypatch.setattr(server.rules, "RULES_FILE", str(path))
+    monkeypatch.setattr(server.rules, "current", server.rules.current)
+    monkeypatch.setattr(server.rules, "_loaded_mtime", None)
+
+    assert server.rules.reload_if_changed()
+    assert server.rules.current.min_withdrawal == 25.0
+    assert not server.rules.reload_if_changed()
+
+    path.write_text(json.dumps({**config, "rewards": {"click": -1, "video": 0.25}}))
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert not server.rules.reload_if_changed()
+    assert server.rules.current.min_withdrawal == 25.0
+
+
+def test_recent_activity_falls_back_to_primary_when_replica_lags(client, session, monkeypatch):
+    assert server.clicks_history_collection.read_preference.mongos_mode == "secondaryPreferred"
+    assert server.users_collection.write_concern.document["w"] == "majority"
+
+    client.post("/api/click", json={"content_id": "content_1"}, headers=session)
+    # A secondary that has not replicated the click yet
+    lagging = memory_db.InMemoryClient()["lagging"].clicks
+    monkeypatch.setattr(server, "clicks_history_collection", lagging)
+    assert len(client.get("/api/dashboard", headers=session).json()["recent_activity"]) == 1
+    assert client.get("/api/activity-history", headers=session).json()["activity"] == []
+
+
+def test_bulk_credit_streams_progress_and_resumes(client, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "admin-secret")
+    admin = {"X-Admin-Token": "admin-secret"}
+    user_ids = [register(client, f"user{index}@example.com")["user"]["user_id"] for index in range(5)]
+    request = {"kind": "credit", "user_ids": user_ids, "amount": 2.5, "reason": "Promo"}
+
+    assert client.post("/api/admin/bulk", json=request).status_code == 403
+    assert client.post("/api/admin/bulk", json={**request, "amount": -1}, headers=admin).status_code == 400
+
+    # Interrupted after the first chunk, then again halfway through the second
+    operation = bulk_ops.create_operation(server.db, "credit", user_ids, amount=2.5, reason="Promo")
+    operation_id = operation["operation_id"]
+    assert next(bulk_ops.run_operation(server.db, operation_id, chunk_size=2))["processed"] == 2
+    bulk_ops._apply_chunk(server.db, bulk_ops.get_operation(server.db, operation_id), user_ids[2:3])
+
+    monkeypatch.setattr(bulk_ops, "BULK_CHUNK_SIZE", 2)
+    response = client.post(f"/api/admin/bulk/{operation_id}/resume", headers=admin)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["processed"] for line in lines] == [4, 5]
+    assert lines[-1]["status"] == "complete"
+
+    for user_id in user_ids:
+        assert server.users_collection.find_one({"user_id": user_id})["balance"] == 2.5
+        assert server.clicks_collection.count_documents({"user_id": user_id, "operation_id": operation_id}) == 1
+    assert reconcile.reconcile(server.db, settle_seconds=0)["mismatch_count"] == 0
+    assert client.get(f"/api/admin/bulk/{operation_id}", headers=admin).json()["ledger_rows"] == 5
+
+
+def test_bulk_deactivate_by_filter_ends_sessions(client, session, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "admin-secret")
+    client.post("/api/auth/register", json={"name": "Bia", "phone": "+5511900000009", "password": "Senha123!"})
+
+    response = client.post(
+        "/api/admin/bulk", json={"kind": "deactivate", "filter": {"email": "ana@example.com"}},
+        headers={"X-Admin-Token": "admin-secret"}
+    )
+    assert json.loads(response.text.splitlines()[-1])["modified"] == 1
+    assert client.get("/api/dashboard", headers=session).status_code == 401
+    assert server.users_collection.find_one({"phone": "+5511900000009"})["is_active"] is True
+
+    rejected = client.post(
+        "/api/admin/bulk", json={"kind": "deactivate", "filter": {"password": {"$regex": "^a"}}},
+        headers={"X-Admin-Token": "admin-secret"}
+    )
+    assert rejected.status_code == 400
+
+
+def test_load_report_percentiles_are_nearest_rank():
+    import load_test
+
+    values = list(range(1, 101))
+    assert [load_test.percentile(values, fraction) for fraction in (0.50, 0.95, 0.99, 1.0)] == [50, 95, 99, 100]
+    assert load_test.percentile(values, 0.07) == 7
+    assert load_test.percentile([3.0], 0.99) == 3.0
+    assert load_test.percentile([], 0.5) == 0.0
+
+
+def test_trace_exporter_survives_write_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_DIR", str(tmp_path))
+    exporter = tracing.BatchFileExporter()
+    write = exporter._write
+
+    def disk_full(spans):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(exporter, "_write", disk_full)
+    exporter.submit(tracing.Span("0" * 32, "", "lost"))
+    assert exporter.flush(timeout=5)
+    assert exporter.dropped == 1
+
+    monkeypatch.setattr(exporter, "_write", write)
+    exporter.submit(tracing.Span("0" * 32, "", "kept"))
+    assert exporter.flush(timeout=5)
+    assert "kept" in next(tmp_path.glob("traces-*.jsonl")).read_text()
+
+
+def test_capture_pseudonymizes_identifiers(monkeypatch):
+    monkeypatch.setattr(traffic_capture, "CAPTURE_SALT", "test-salt")
+    body = traffic_capture.sanitize({
+        "kind": "credit", "user_ids": ["u1", "u2"], "filter": {"user_id": {"$in": ["u3"]}},
+        "email": "ana@example.com", "idempotency_key": "k1", "amount": 5
+    })
+    assert body["user_ids"] == [traffic_capture.pseudonym("u1"), traffic_capture.pseudonym("u2")]
+    assert body["filter"] == {"user_id": {"$in": [traffic_capture.pseudonym("u3")]}}
+    assert body["email"] == traffic_capture.REDACTED
+    assert body["idempotency_key"] == traffic_capture.pseudonym("k1")
+    assert body["amount"] == 5
+    assert "op-1" not in traffic_capture.sanitize_path("/api/admin/bulk/op-1", {"operation_id": "op-1"})
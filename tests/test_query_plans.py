@@ -0,0 +1,119 @@
+"""
+Query-plan regression tests: every query shape used by backend/server.py
+must be answered from an index, with no COLLSCAN and no in-memory SORT.
+
+Needs a MongoDB at MONGO_URL (default mongodb://localhost:27017); the tests
+are skipped when none is reachable.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+
+# Seeded and dropped by these tests; never the application's DB_NAME
+QUERY_PLANS_DB = "clickearn_query_plans"
+
+NOW = datetime(2024, 6, 1, 12)
+TODAY = datetime(2024, 6, 1)
+
+# name -> (collection, filter, sort)
+QUERY_SHAPES = {
+    "session by session_id": ("sessions", {"devices.session_id": "SESSION_ID"}, None),
+    "session devices by user": ("sessions", {"user_id": "USER_ID"}, None),
+    "user by user_id": ("users", {"user_id": "USER_ID"}, None),
+    "user by email": ("users", {"email": "user1@example.com"}, None),
+    "user by phone": ("users", {"phone": "+5511900000001"}, None),
+    "today's ledger rows by user": ("clicks", {"user_id": "USER_ID", "created_at": {"$gte": TODAY}}, None),
+    "recent ledger rows by user": ("clicks", {"user_id": "USER_ID"}, [("created_at", -1)]),
+    "ledger rows by idempotency key": ("clicks", {"user_id": "USER_ID", "idempotency_key": {"$in": ["a", "b"]}}, None),
+    "uncredited ledger rows of a batch": (
+        "clicks", {"user_id": "USER_ID", "batch_id": "BATCH_ID", "credited": False}, None
+    ),
+    "withdrawals by user by date": ("withdrawals", {"user_id": "USER_ID"}, [("created_at", -1)]),
+    "ledger rows in a date range by user": (
+        "clicks", {"user_id": "USER_ID", "created_at": {"$gte": TODAY - timedelta(days=7), "$lt": TODAY}},
+        [("created_at", -1)]
+    ),
+    "ledger rows to archive": ("clicks", {"created_at": {"$lt": TODAY - timedelta(days=20)}}, [("created_at", 1)]),
+    "withdrawals to archive": (
+        "withdrawals", {"created_at": {"$lt": TODAY - timedelta(days=20)}, "status": {"$ne": "pending"}},
+        [("created_at", 1)]
+    ),
+    "verification code by phone": ("verification_codes", {"phone": "+5511900000001", "used": False}, None),
+    "idempotency key by user": ("idempotency_keys", {"user_id": "USER_ID", "key": "a"}, None),
+    "revocations since last sync": ("session_revocations", {"updated_at": {"$gte": TODAY}}, None),
+    "revocation by id": ("session_revocations", {"revocation_id": "token:abc"}, None),
+    "ledger rows since last reconciliation": (
+        "clicks", {"created_at": {"$gt": TODAY - timedelta(days=1), "$lte": TODAY}}, None
+    ),
+    "ledger rows after checkpoint by users": (
+        "clicks", {"user_id": {"$in": ["USER_ID", "OTHER_ID"]}, "created_at": {"$gt": TODAY}}, None
+    ),
+    "checkpoints by users": ("ledger_checkpoints", {"user_id": {"$in": ["USER_ID", "OTHER_ID"]}}, None),
+    "last complete reconciliation": ("reconciliation_runs", {"status": "complete"}, [("through", -1)]),
+    "users after bulk checkpoint": (
+        "users", {"$and": [{"user_id": {"$in": ["USER_ID", "OTHER_ID"]}}, {"user_id": {"$gt": "A"}}]},
+        [("user_id", 1)]
+    ),
+    "bulk operation by id": ("bulk_operations", {"operation_id": "OPERATION_ID"}, None),
+}
+
+
+def plan_stages(plan) -> list:
+    """All stage names in an explain() plan tree, classic or slot-based"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key in ("inputStage", "queryPlan"):
+            if key in plan:
+                stages.extend(plan_stages(plan[key]))
+        for child in plan.get("inputStages", []):
+            stages.extend(plan_stages(child))
+    return stages
+
+
+@pytest.fixture(scope="module")
+def seeded_db():
+    client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"no MongoDB reachable at {MONGO_URL}")
+
+    import generate_dataset
+    import server
+
+    client.drop_database(QUERY_PLANS_DB)
+    server.configure_database(client[QUERY_PLANS_DB])
+    docs = generate_dataset.generate_chunk(0, 2000, 30, 1, NOW)
+    for collection, rows in docs.items():
+        if rows:
+            server.db[collection].insert_many(rows, ordered=False)
+    server.verification_codes_collection.insert_many([
+        {"phone": f"+55119{index:08d}", "code_hash": f"{index:064x}", "created_at": NOW,
+         "expires_at": NOW + timedelta(minutes=5), "attempts": 0, "used": False}
+        for index in range(2000)
+    ])
+    server.ensure_indexes()
+    yield server.db
+    client.drop_database(QUERY_PLANS_DB)
+    client.close()
+
+
+@pytest.mark.parametrize("name", list(QUERY_SHAPES))
+def test_query_shape_uses_index(seeded_db, name):
+    collection, query, sort = QUERY_SHAPES[name]
+    cursor = seeded_db[collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    stages = plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+
+    assert "COLLSCAN" not in stages, f"{name}: collection scan in {stages}"
+    assert "SORT" not in stages, f"{name}: in-memory sort in {stages}"
+    assert any(stage in ("IXSCAN", "EXPRESS_IXSCAN", "IDHACK", "COUNT_SCAN") for stage in stages), stages
@@ -0,0 +1,89 @@
+"""
+Read routing and write concerns against a local three-member replica set.
+
+Needs mongod on PATH; the tests are skipped otherwise. The replica set is
+started once for the module (see LocalReplicaSet in tests/load_test.py).
+"""
+
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+from pymongo import monitoring
+
+import db_routing
+import server
+
+
+class ServerAddresses(monitoring.CommandListener):
+    """(command name, collection, server address) of every command sent"""
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append((event.command_name, event.command.get(event.command_name), event.connection_id))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@pytest.fixture(scope="module")
+def replica_set(monkeypatch_module):
+    if not shutil.which("mongod"):
+        pytest.skip("mongod not found on PATH")
+    from load_test import LocalReplicaSet
+
+    listener = ServerAddresses()
+    with LocalReplicaSet() as mongo_url:
+        monkeypatch_module.setattr(server, "MONGO_URL", mongo_url)
+        monkeypatch_module.setattr(server, "DB_NAME", "clickearn_replica_routing")
+        monkeypatch_module.setattr(server, "_mongo_listeners", [*server._mongo_listeners, listener])
+        server.connect_database()
+        server.ensure_indexes()
+        yield listener
+        server.client.close()
+
+
+@pytest.fixture(scope="module")
+def monkeypatch_module():
+    with pytest.MonkeyPatch.context() as patch:
+        yield patch
+
+
+def test_handles_carry_their_route(replica_set):
+    assert server.users_collection.write_concern.document == {"w": "majority", "j": True, "wtimeout": 5000}
+    assert server.clicks_collection.read_preference.mode == 0  # primary
+    assert server.sessions_collection.write_concern.document == {"w": 1}
+    history = server.clicks_history_collection.read_preference
+    assert history.mongos_mode == "secondaryPreferred"
+    assert history.max_staleness == db_routing.READ_MAX_STALENESS_SECONDS
+
+
+def test_history_reads_go_to_a_secondary(replica_set):
+    client = TestClient(server.app)
+    response = client.post(
+        "/api/auth/register", json={"name": "Ana", "email": "replica@example.com", "password": "Senha123!"}
+    )
+    headers = {"X-Session-ID": response.json()["session_id"]}
+    assert client.post("/api/click", json={"content_id": "content_1"}, headers=headers).status_code == 200
+
+    primary = server.client.primary
+    replica_set.commands.clear()
+    client.get("/api/activity-history", headers=headers)
+    finds = [address for name, collection, address in replica_set.commands if (name, collection) == ("find", "clicks")]
+    assert finds and all(address != primary for address in finds)
+
+    # Balances and ledger writes stay on the primary
+    replica_set.commands.clear()
+    client.post("/api/click", json={"content_id": "content_1"}, headers=headers)
+    writes = [address for name, _, address in replica_set.commands if name in ("insert", "update")]
+    assert writes and all(address == primary for address in writes)
+
+    # Recent activity includes the latest credit even if the chosen secondary lags
+    dashboard = client.get("/api/dashboard", headers=headers).json()
+    assert dashboard["balance"] == 1.0
+    assert len(dashboard["recent_activity"]) == 2